@@ -1,66 +1,284 @@
 import datetime
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 import json
 import asyncio
+import os
 import uuid
-from dotenv import load_dotenv
+from blob_store import BlobStore
+from fast_path import FastPath, FastPathRule
 from memory import LinearMemory, DAGMemory
-from models import Action, ActionType, TodoMemory
-from llm import GeminiProvider, OpenAIProvider
-from gateway_tools import MCPGatewayTools
-
-# Load environment variables from .env file
-load_dotenv()
+from memory_store import DAGMemoryStore
+from models import (Action, ActionNode, ActionType, TodoMemory, ConversationStateMemory,
+                    ConversationCompressionMemory)
+from llm import ModelRouter, ProviderPool, create_provider, load_env
+from gateway_tools import MCPGatewayTools, ToolResultCache
+from prompt_registry import PromptRegistry
+from response_cache import CachedProvider, ResponseCache, ResponseNotRecorded, sampling
+from stream_parser import IncrementalResponseParser
+from tracing import NULL_TRACER, Tracer
 
 
 class CoreAgent:
     """Lightweight linear agent runtime"""
     MAX_ACTIONS = 10
     ACTION_MAX_RETRIES = 3
-
-    def __init__(self, llm=None):
-        self.memory = DAGMemory()
-        self.llm = llm or OpenAIProvider()
-        self.gateway_tools = MCPGatewayTools()
+    # > 1 samples the LLM concurrently and keeps the first response with a valid next action
+    SPECULATIVE_SAMPLES = 1
+    # tool calls of one batched AGENT_TOOL_EXECUTION running at once, per session
+    MAX_CONCURRENT_TOOL_CALLS = 4
+    # context budget in estimated tokens per model name prefix (the system prompt comes on top)
+    CONTEXT_TOKEN_BUDGETS = {
+        "gpt-5": 64_000,
+        "gemini-2.5": 128_000,
+    }
+    DEFAULT_CONTEXT_TOKEN_BUDGET = 32_000
+    # tool outputs longer than this are spilled to the blob store, the node keeps a head/tail preview
+    SPILL_TOOL_OUTPUT_CHARS = 8_000
+    TOOL_OUTPUT_PREVIEW_HEAD_CHARS = 2_000
+    TOOL_OUTPUT_PREVIEW_TAIL_CHARS = 1_000
+    # local tool reading a slice of a spilled output, answered without the gateway
+    READ_TOOL_OUTPUT = "read_tool_output"
+    MAX_TOOL_OUTPUT_SLICE_BYTES = 8_000
+
+    def __init__(self, llm=None, prompt_registry: Optional[PromptRegistry] = None, prompt_set: str = "coding",
+                 watch_prompts: bool = False, stream_responses: bool = False,
+                 on_response_text: Optional[Callable[[str], None]] = None,
+                 speculative_samples: Optional[int] = None, memory_dir: Optional[str] = None,
+                 gateway_tools: Optional[MCPGatewayTools] = None, context_token_budget: Optional[int] = None,
+                 update_memory: bool = False, max_concurrent_tool_calls: Optional[int] = None,
+                 cache_tool_results: bool = False, spill_tool_output_chars: Optional[int] = None,
+                 blob_dir: Optional[str] = None, tracer: Optional[Tracer] = None,
+                 model_routes: Optional[Union[str, Dict[ActionType, List[Any]]]] = None,
+                 llm_timeout: Optional[float] = None, provider_pool: Optional[ProviderPool] = None,
+                 fast_path_rules: Optional[List[FastPathRule]] = None,
+                 verbose: bool = True):
+        # with a memory_dir the session is restored from, and durably logged to, that directory
+        self.memory = DAGMemory.restore(DAGMemoryStore(memory_dir)) if memory_dir else DAGMemory()
+        # a provider instance, or a registered provider name (AGENT_LLM_PROVIDER or openai by default)
+        self.llm = llm if llm is not None and not isinstance(llm, str) else create_provider(llm)
+        # step tracing output (full context every action), turn off when hosting many sessions
+        self.log = print if verbose else (lambda *args, **kwargs: None)
+        if (llm is None or isinstance(llm, str)) and hasattr(self.llm, "log"):
+            self.llm.log = self.log
+        # per-ActionType provider/model chains (a ModelRouter.PRESETS name or a table), self.llm for the rest.
+        # A routed call failing or taking longer than llm_timeout moves on to the next model of its chain.
+        # Routed models come from provider_pool (llm.PROVIDER_POOL by default), shared with other sessions
+        self.router = ModelRouter(self.llm, model_routes, timeout=llm_timeout, pool=provider_pool,
+                                  log=self.log)
+        self.prompts = prompt_registry or PromptRegistry.default()
+        self.prompt_set = prompt_set
+        self.watch_prompts = watch_prompts
+        # streaming prints AGENT_RESPONSE text as it is generated and starts tool calls early
+        self.stream_responses = stream_responses
+        self.on_response_text = on_response_text or (
+            lambda text: self.log(text, end="", flush=True))
+        # (action_type, action parameters key, task) of a tool action started before its LLM response finished
+        self.early_dispatch: Optional[Tuple[ActionType, str, asyncio.Task]] = None
+        self.speculative_samples = speculative_samples or self.SPECULATIVE_SAMPLES
+        self.gateway_tools = gateway_tools or MCPGatewayTools()
+        # memoise idempotent (readonly) tool results for this session, stats in gateway_tools.result_cache
+        if cache_tool_results and self.gateway_tools.result_cache is None:
+            self.gateway_tools.result_cache = ToolResultCache()
+        self.tool_semaphore = asyncio.Semaphore(max_concurrent_tool_calls or self.MAX_CONCURRENT_TOOL_CALLS)
+        self.spill_tool_output_chars = spill_tool_output_chars or self.SPILL_TOOL_OUTPUT_CHARS
+        # spilled outputs are kept next to a durable session, so its previews stay readable after a reload
+        self.blob_store = BlobStore(blob_dir or (os.path.join(memory_dir, "blobs") if memory_dir else None))
+        # older steps are sent as their summaries so the context stays within this budget
+        self.context_token_budget = context_token_budget or self.get_context_token_budget(
+            getattr(self.llm, "model_name", ""))
+        # timing spans of every run_action phase, the default NULL_TRACER records nothing
+        self.tracer = tracer or NULL_TRACER
+        # deterministic transitions that skip an LLM call (FastPath.default_rules() by default, [] for none)
+        self.fast_path = FastPath(fast_path_rules)
         self.session_id = None
         self.is_running = True
+        # background todo list / conversation state / compression updates at every step boundary
+        self.memory_agent = MemoryAgent(self.memory, self, llm=self.llm) if update_memory else None
+
+    @classmethod
+    def get_context_token_budget(cls, model_name: str) -> int:
+        for prefix, budget in cls.CONTEXT_TOKEN_BUDGETS.items():
+            if model_name.startswith(prefix):
+                return budget
+        return cls.DEFAULT_CONTEXT_TOKEN_BUDGET
 
     async def get_context(self):
-        return self.memory.get_context()
+        return self.memory.get_budgeted_context(self.context_token_budget)
+
+    def llm_for(self, action_type: ActionType):
+        return self.router.provider_for(action_type)
 
     def get_bash_execute_tool_description(self):
-        """Returns the bash_execute tool description by reading from file"""
-        with open('prompts/coding/bash_execute_tool_description.md', 'r') as f:
-            return f.read()
+        """Returns the bash_execute tool description"""
+        return self.prompts.get_tool_description(self.prompt_set)
 
     def get_prompt(self, action_type: ActionType):
-        # Get the bash execute tool description
-        bash_tool_description = self.get_bash_execute_tool_description()
-
-        if action_type == ActionType.PROCESS_USER_INPUT:
-            with open('prompts/coding/process_user_input_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.AGENT_RESPONSE:
-            with open('prompts/coding/agent_response_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.AGENT_PLANNING:
-            with open('prompts/coding/agent_planning_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT:
-            with open('prompts/coding/process_tool_search_result_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT:
-            with open('prompts/coding/process_tool_execution_result_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.STEP_SUMMARY:
-            with open('prompts/coding/step_summary_prompt.md', 'r') as f:
-                prompt_content = f.read()
+        # the bash execute tool description is already injected at the top of all coding prompts
+        with self.tracer.span("prompt.load", action_type=action_type.value):
+            return self.prompts.get(action_type, self.prompt_set)
+
+    async def generate_response(self, context: str, prompt: str, action_type: ActionType,
+                                available_next_actions: List[ActionType], allow_early_dispatch: bool = True) -> str:
+        """Get the raw LLM response for an action, streaming it when stream_responses is set"""
+        llm = self.llm_for(action_type)
+        with self.tracer.span("llm.generate", action_type=action_type.value, stream=self.stream_responses,
+                              model=getattr(llm, "model_name", ""), context_chars=len(context)):
+            if not self.stream_responses:
+                return await llm.generate(context, prompt)
+            return await self.generate_response_stream(context, prompt, action_type, available_next_actions,
+                                                       allow_early_dispatch)
+
+    async def generate_response_stream(self, context: str, prompt: str, action_type: ActionType,
+                                       available_next_actions: List[ActionType], allow_early_dispatch: bool) -> str:
+        """Stream the LLM response, printing AGENT_RESPONSE text and dispatching tool calls as they arrive"""
+        parser = IncrementalResponseParser()
+        dispatched = False
+        async for chunk in self.llm_for(action_type).generate_stream(context, prompt):
+            parser.feed(chunk)
+            if action_type == ActionType.AGENT_RESPONSE:
+                text = parser.take_string_delta("response")
+                if text:
+                    self.on_response_text(text)
+            elif allow_early_dispatch and not dispatched \
+                    and parser.has("next_action") and parser.has("next_action_parameters"):
+                dispatched = True
+                self.dispatch_early(parser.fields["next_action"],
+                                    parser.fields["next_action_parameters"], available_next_actions)
+        if action_type == ActionType.AGENT_RESPONSE:
+            self.on_response_text("\n")
+        return parser.buffer
+
+    @staticmethod
+    def action_parameters_key(action_parameters: Any) -> str:
+        return json.dumps(action_parameters, sort_keys=True, default=str)
+
+    def dispatch_early(self, next_action: Any, next_action_parameters: Any, available_next_actions: List[ActionType]):
+        """
+        Start the tool call a streamed response asks for before the response has finished.
+        Tool executions are only started early when they are readonly, the final parsed response
+        still decides whether the result is used.
+        """
+        try:
+            action_type = ActionType(next_action)
+        except ValueError:
+            return
+        if action_type not in available_next_actions or not isinstance(next_action_parameters, dict):
+            return
+
+        if action_type == ActionType.AGENT_TOOL_SEARCH:
+            if "tool_search_query" not in next_action_parameters:
+                return
+            coroutine = self.run_agent_tool_search_action(next_action_parameters)
+        elif action_type == ActionType.AGENT_TOOL_EXECUTION:
+            try:
+                tool_calls = self.get_tool_calls(next_action_parameters)
+            except AssertionError:
+                return
+            if any(tool_call["tool_args"].get("permission") != "readonly"
+                   and tool_call["tool_name"] != self.READ_TOOL_OUTPUT for tool_call in tool_calls):
+                return
+            coroutine = self.run_agent_tool_execution_action(next_action_parameters)
         else:
-            raise ValueError(
-                f"No prompt available for action type: {action_type}")
-
-        # Inject bash execute tool description at the top of all coding prompts
-        return bash_tool_description + "\n" + prompt_content
+            return
+
+        self.cancel_early_dispatch()
+        self.early_dispatch = (action_type, self.action_parameters_key(next_action_parameters),
+                               asyncio.create_task(coroutine))
+
+    def take_early_dispatch(self, action_type: ActionType, action_parameters: Any) -> Optional[asyncio.Task]:
+        """Get the early started task for this exact tool action, dropping any stale one"""
+        if self.early_dispatch is None:
+            return None
+        dispatched_action_type, parameters_key, task = self.early_dispatch
+        self.early_dispatch = None
+        if dispatched_action_type == action_type and parameters_key == self.action_parameters_key(action_parameters):
+            return task
+        task.cancel()
+        return None
+
+    def cancel_early_dispatch(self):
+        if self.early_dispatch is not None:
+            self.early_dispatch[2].cancel()
+            self.early_dispatch = None
+
+    async def sample_next_action(self, context: str, prompt: str, action_type: ActionType,
+                                 available_next_actions: List[ActionType],
+                                 allow_early_dispatch: bool = True,
+                                 sample_index: int = 0) -> Optional[Tuple[str, ActionType, Optional[Dict[Any, Any]]]]:
+        """
+        Sample one LLM response, returning None if it is malformed or proposes an unavailable action
+        A response cache keys the sample by sample_index and only records the response once it is accepted.
+        """
+        with sampling(sample_index) as sample:
+            try:
+                response = await self.generate_response(context, prompt, action_type, available_next_actions,
+                                                        allow_early_dispatch=allow_early_dispatch)
+            except ResponseNotRecorded as e:
+                # the recorded run discarded this sample, a later one has the accepted response
+                self.log(f"Discarding {action_type.value} sample: {e}")
+                return None
+        try:
+            with self.tracer.span("response.parse", action_type=action_type.value):
+                parsed = self.parse_response(response, action_type)
+        except (ValueError, AssertionError) as e:
+            self.log(f"Discarding {action_type.value} response: {e}")
+            return None
+        if parsed[1] not in available_next_actions:
+            self.log(f"Discarding {action_type.value} response: {parsed[1].value} is not an available next action")
+            return None
+        sample.commit()
+        return parsed
+
+    async def generate_next_action(self, context: str, prompt: str, action_type: ActionType,
+                                   available_next_actions: List[ActionType]) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
+        """
+        Sample the LLM until it proposes a valid next action, up to ACTION_MAX_RETRIES retries
+        With speculative_samples > 1 the samples are fired in concurrent batches (never past the
+        retry budget), the first valid response wins and the rest of the batch is cancelled. A
+        sample whose LLM call raises counts as a failed sample, its siblings can still win.
+        """
+        # to prevent LLM hallucinations just do a retry
+        max_samples = self.ACTION_MAX_RETRIES + 1
+        samples = 0
+        last_error: Optional[Exception] = None
+        while samples < max_samples:
+            # one span per attempt, retry=True for the ones after an invalid response
+            with self.tracer.span("action.attempt", action_type=action_type.value, retry=samples > 0) as span:
+                if self.speculative_samples <= 1:
+                    samples += 1
+                    parsed = await self.sample_next_action(context, prompt, action_type, available_next_actions,
+                                                           sample_index=samples - 1)
+                    span.set("valid", parsed is not None)
+                    if parsed:
+                        return parsed
+                    continue
+
+                # concurrent samples would race each other to start tool calls, so none start early
+                batch = [asyncio.create_task(self.sample_next_action(context, prompt, action_type,
+                                                                     available_next_actions,
+                                                                     allow_early_dispatch=False,
+                                                                     sample_index=samples + i))
+                         for i in range(min(self.speculative_samples, max_samples - samples))]
+                samples += len(batch)
+                span.set("samples", len(batch))
+                try:
+                    for next_done in asyncio.as_completed(batch):
+                        try:
+                            parsed = await next_done
+                        except Exception as e:
+                            self.log(f"Discarding {action_type.value} sample: {type(e).__name__}: {e}")
+                            last_error = e
+                            continue
+                        if parsed:
+                            span.set("valid", True)
+                            return parsed
+                    span.set("valid", False)
+                finally:
+                    for task in batch:
+                        task.cancel()
+
+        raise ValueError(
+            f"Failed to get a valid next action after {self.ACTION_MAX_RETRIES} retries") from last_error
 
     def parse_response(self, response: str, action_type: ActionType) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         # parse the JSON response for the next action
@@ -124,48 +342,17 @@ class CoreAgent:
 
         joined_context = context + "\n\n" + "USER: " + user_input
 
-        response = await self.llm.generate(joined_context, prompt)
-        response_text, proposed_next_action, next_action_parameters = self.parse_response(
-            response, ActionType.PROCESS_USER_INPUT)
-
-        retries = 0
-        # to prevent LLM hallucinations just do a retry
-        while proposed_next_action not in available_next_actions and retries < self.ACTION_MAX_RETRIES:
-            retries += 1
-            response = await self.llm.generate(joined_context, prompt)
-            response_text, proposed_next_action, next_action_parameters = self.parse_response(
-                response, ActionType.PROCESS_USER_INPUT)
-
-        if retries == self.ACTION_MAX_RETRIES:
-            raise ValueError(
-                f"Failed to get a valid next action after {self.ACTION_MAX_RETRIES} retries")
-
-        return response_text, proposed_next_action, next_action_parameters
+        return await self.generate_next_action(joined_context, prompt, ActionType.PROCESS_USER_INPUT, available_next_actions)
 
     async def run_agent_planning_action(self, context: str, available_next_actions: List[ActionType]) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         prompt = self.get_prompt(ActionType.AGENT_PLANNING)
 
-        response = await self.llm.generate(context, prompt)
-        response_text, proposed_next_action, next_action_parameters = self.parse_response(
-            response, ActionType.AGENT_PLANNING)
-
-        retries = 0
-        # to prevent LLM hallucinations just do a retry
-        while proposed_next_action not in available_next_actions and retries < self.ACTION_MAX_RETRIES:
-            retries += 1
-            response = await self.llm.generate(context, prompt)
-            response_text, proposed_next_action, next_action_parameters = self.parse_response(
-                response, ActionType.AGENT_PLANNING)
-
-        if retries == self.ACTION_MAX_RETRIES:
-            raise ValueError(
-                f"Failed to get a valid next action after {self.ACTION_MAX_RETRIES} retries")
-
-        return response_text, proposed_next_action, next_action_parameters
+        return await self.generate_next_action(context, prompt, ActionType.AGENT_PLANNING, available_next_actions)
 
     async def run_agent_tool_search_action(self, action_parameters: Optional[Dict[Any, Any]] = None) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         if not self.gateway_tools.session_id:
-            await self.gateway_tools.create_session()
+            with self.tracer.span("gateway.create_session"):
+                await self.gateway_tools.create_session()
 
         assert action_parameters is not None, "action_parameters is required for AGENT_TOOL_SEARCH"
         assert isinstance(
@@ -173,7 +360,8 @@ class CoreAgent:
         assert "tool_search_query" in action_parameters, "tool_search_query is required for AGENT_TOOL_SEARCH"
         tool_search_query = action_parameters["tool_search_query"]
 
-        search_result = await self.gateway_tools.search_tools(tool_search_query)
+        with self.tracer.span("gateway.search_tools"):
+            search_result = await self.gateway_tools.search_tools(tool_search_query)
 
         # Return the action_parameters so we can capture search query in memory
         return search_result, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT, action_parameters
@@ -181,75 +369,112 @@ class CoreAgent:
     async def run_process_agent_tool_search_result_action(self, context: str, available_next_actions: List[ActionType]) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         prompt = self.get_prompt(ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT)
 
-        response = await self.llm.generate(context, prompt)
-        response_text, proposed_next_action, next_action_parameters = self.parse_response(
-            response, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT)
-
-        retries = 0
-        while proposed_next_action not in available_next_actions and retries < self.ACTION_MAX_RETRIES:
-            retries += 1
-            response = await self.llm.generate(context, prompt)
-            response_text, proposed_next_action, next_action_parameters = self.parse_response(
-                response, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT)
-
-        if retries == self.ACTION_MAX_RETRIES:
-            raise ValueError(
-                f"Failed to get a valid next action after {self.ACTION_MAX_RETRIES} retries")
-
-        return response_text, proposed_next_action, next_action_parameters
-
-    async def run_agent_tool_execution_action(self, action_parameters: Optional[Dict[Any, Any]] = None) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
-        if not self.gateway_tools.session_id:
-            await self.gateway_tools.create_session()
+        return await self.generate_next_action(context, prompt, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT, available_next_actions)
 
+    @staticmethod
+    def get_tool_calls(action_parameters: Optional[Dict[Any, Any]]) -> List[Dict[str, Any]]:
+        """The tool calls of an AGENT_TOOL_EXECUTION: one {tool_name, tool_args}, or a batch of them under "tool_calls" """
         assert action_parameters is not None, "action_parameters is required for AGENT_TOOL_EXECUTION"
         assert isinstance(
             action_parameters, dict), f"action_parameters is not a dict: {action_parameters}. It is a {type(action_parameters)}"
-        assert "tool_name" in action_parameters, "tool_name is required for AGENT_TOOL_EXECUTION"
-        assert "tool_args" in action_parameters, "tool_args is required for AGENT_TOOL_EXECUTION"
-        tool_name = action_parameters["tool_name"]
-        tool_args = action_parameters["tool_args"]
-
-        result = await self.gateway_tools.execute_tool(tool_name, **tool_args)
-        # Return the action_parameters so we can capture tool info in memory
-        return result, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, action_parameters
+        tool_calls = action_parameters.get("tool_calls", [action_parameters])
+        assert isinstance(tool_calls, list) and tool_calls, f"tool_calls is not a non-empty list: {tool_calls}"
+        for tool_call in tool_calls:
+            assert isinstance(tool_call, dict), f"tool call is not a dict: {tool_call}"
+            assert "tool_name" in tool_call, "tool_name is required for AGENT_TOOL_EXECUTION"
+            assert "tool_args" in tool_call, "tool_args is required for AGENT_TOOL_EXECUTION"
+            assert isinstance(tool_call["tool_args"], dict), f"tool_args is not a dict: {tool_call['tool_args']}"
+        return tool_calls
+
+    async def execute_tool_call(self, tool_call: Dict[str, Any]) -> str:
+        if tool_call["tool_name"] == self.READ_TOOL_OUTPUT:
+            with self.tracer.span("blob.read"):
+                return self.read_tool_output(**tool_call["tool_args"])
+        async with self.tool_semaphore:
+            with self.tracer.span("gateway.execute_tool", tool_name=tool_call["tool_name"]) as span:
+                result = await self.gateway_tools.execute_tool(tool_call["tool_name"], **tool_call["tool_args"])
+                span.set("result_chars", len(result) if isinstance(result, str) else 0)
+        return self.spill_tool_output(result)
+
+    def spill_tool_output(self, output: str) -> str:
+        """Store a large tool output in the blob store and return the head/tail preview that goes into memory"""
+        if not isinstance(output, str) or len(output) <= self.spill_tool_output_chars:
+            return output
+        blob = self.blob_store.put(output)
+        head = output[:self.TOOL_OUTPUT_PREVIEW_HEAD_CHARS]
+        tail = output[-self.TOOL_OUTPUT_PREVIEW_TAIL_CHARS:]
+        omitted = len(output) - len(head) - len(tail)
+        return (f"{head}\n... [{omitted} characters omitted. The full output ({self.blob_store.size(blob)} bytes) is "
+                f"blob {blob}, read slices of it with the {self.READ_TOOL_OUTPUT} tool: "
+                f'{{"blob": "{blob}", "offset": <byte offset>, "length": <at most {self.MAX_TOOL_OUTPUT_SLICE_BYTES}>}}'
+                f"] ...\n{tail}")
+
+    def read_tool_output(self, blob: str = "", offset: int = 0, length: Optional[int] = None, **kwargs) -> str:
+        """A slice of a spilled tool output, at most MAX_TOOL_OUTPUT_SLICE_BYTES long"""
+        # offset and length come from the model's JSON and may be strings, floats or garbage
+        try:
+            offset = int(offset or 0)
+            length = min(int(length or self.MAX_TOOL_OUTPUT_SLICE_BYTES), self.MAX_TOOL_OUTPUT_SLICE_BYTES)
+            size = self.blob_store.size(blob)
+            text = self.blob_store.read(blob, offset, length)
+        except (TypeError, ValueError) as e:
+            return f"Tool execution failed: {e}"
+        offset = min(offset, size)
+        return f"[bytes {offset}-{min(size, offset + length)} of {size}]\n{text}"
+
+    async def run_agent_tool_execution_action(self, action_parameters: Optional[Dict[Any, Any]] = None) -> Tuple[Any, ActionType, Optional[Dict[Any, Any]]]:
+        """
+        Run one tool call, or a batch of independent ones concurrently
+        A batch returns a list of (result, tool call) pairs, which run_step records as one node per call
+        """
+        if not self.gateway_tools.session_id:
+            with self.tracer.span("gateway.create_session"):
+                await self.gateway_tools.create_session()
+
+        tool_calls = self.get_tool_calls(action_parameters)
+        if "tool_calls" not in action_parameters:
+            result = await self.execute_tool_call(tool_calls[0])
+            # Return the action_parameters so we can capture tool info in memory
+            return result, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, action_parameters
+
+        results = await asyncio.gather(*(self.execute_tool_call(tool_call) for tool_call in tool_calls),
+                                       return_exceptions=True)
+        # a failed call becomes its own error result instead of discarding the rest of the batch
+        batch = [(f"Tool execution failed: {type(result).__name__}: {result}" if isinstance(result, Exception)
+                  else result, tool_call) for result, tool_call in zip(results, tool_calls)]
+        return batch, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, action_parameters
 
     async def run_process_agent_tool_execution_result_action(self, context: str, available_next_actions: List[ActionType]) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         prompt = self.get_prompt(
             ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT)
 
-        response = await self.llm.generate(context, prompt)
-        response_text, proposed_next_action, next_action_parameters = self.parse_response(
-            response, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT)
-
-        retries = 0
-        while proposed_next_action not in available_next_actions and retries < self.ACTION_MAX_RETRIES:
-            retries += 1
-            response = await self.llm.generate(context, prompt)
-            response_text, proposed_next_action, next_action_parameters = self.parse_response(
-                response, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT)
-
-        if retries == self.ACTION_MAX_RETRIES:
-            raise ValueError(
-                f"Failed to get a valid next action after {self.ACTION_MAX_RETRIES} retries")
-
-        return response_text, proposed_next_action, next_action_parameters
+        return await self.generate_next_action(context, prompt, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, available_next_actions)
 
     async def run_agent_response_action(self, context: str, available_next_actions: List[ActionType]) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
         prompt = self.get_prompt(ActionType.AGENT_RESPONSE)
 
-        response = await self.llm.generate(context, prompt)
-        response_text, proposed_next_action, _ = self.parse_response(
-            response, ActionType.AGENT_RESPONSE)
+        with sampling() as sample:
+            response = await self.generate_response(context, prompt, ActionType.AGENT_RESPONSE, available_next_actions)
+        with self.tracer.span("response.parse", action_type=ActionType.AGENT_RESPONSE.value):
+            response_text, proposed_next_action, _ = self.parse_response(
+                response, ActionType.AGENT_RESPONSE)
+        sample.commit()
 
         return response_text, proposed_next_action, None
 
     async def run_summarize_step(self) -> str:
         prompt = self.get_prompt(ActionType.STEP_SUMMARY)
 
-        response = await self.llm.generate(self.memory.get_context(), prompt)
-        response_text, _, _ = self.parse_response(
-            response, ActionType.STEP_SUMMARY)
+        with self.tracer.span("context.build"):
+            context = await self.get_context()
+        llm = self.llm_for(ActionType.STEP_SUMMARY)
+        with self.tracer.span("llm.generate", action_type=ActionType.STEP_SUMMARY.value, stream=False,
+                              model=getattr(llm, "model_name", ""), context_chars=len(context)), sampling() as sample:
+            response = await llm.generate(context, prompt)
+        with self.tracer.span("response.parse", action_type=ActionType.STEP_SUMMARY.value):
+            response_text, _, _ = self.parse_response(
+                response, ActionType.STEP_SUMMARY)
+        sample.commit()
 
         return response_text
 
@@ -262,9 +487,11 @@ class CoreAgent:
         joined_context = current_context + "\n\n" + "CURRENT BRANCH BACKTRACK SUMMARY: " + \
             branch_backtrack_summary if branch_backtrack_summary else "NO CURRENT BRANCH BACKTRACK SUMMARY"
 
-        response = await self.llm.generate(joined_context, prompt)
+        with sampling() as sample:
+            response = await self.llm_for(ActionType.UPDATE_BRANCH_BACKTRACK_SUMMARY).generate(joined_context, prompt)
         response_text, _, _ = self.parse_response(
             response, ActionType.UPDATE_BRANCH_BACKTRACK_SUMMARY)
+        sample.commit()
 
         return response_text
 
@@ -291,77 +518,109 @@ class CoreAgent:
             return []  # No next actions - exits the loop
 
     async def run_action(self, user_input: str, context: str, action_type: ActionType, action_parameters: Optional[Dict[Any, Any]] = None) -> Tuple[str, ActionType, Optional[Dict[Any, Any]]]:
-        available_next_actions = self.get_available_next_actions(action_type)
-        if action_type == ActionType.PROCESS_USER_INPUT:
-            return await self.run_process_user_input_action(
-                user_input, context, available_next_actions)
-        elif action_type == ActionType.AGENT_PLANNING:
-            return await self.run_agent_planning_action(context, available_next_actions)
-        elif action_type == ActionType.AGENT_TOOL_SEARCH:
-            return await self.run_agent_tool_search_action(action_parameters)
-        elif action_type == ActionType.AGENT_TOOL_EXECUTION:
-            return await self.run_agent_tool_execution_action(
-                action_parameters)
-        elif action_type == ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT:
-            return await self.run_process_agent_tool_search_result_action(context, available_next_actions)
-        elif action_type == ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT:
-            return await self.run_process_agent_tool_execution_result_action(context, available_next_actions)
-        elif action_type == ActionType.AGENT_RESPONSE:
-            return await self.run_agent_response_action(context, available_next_actions)
-        elif action_type == ActionType.AWAIT_USER_INPUT:
-            # Return empty response and same action type
-            return "", ActionType.AWAIT_USER_INPUT, None
-        else:
-            raise ValueError(f"Invalid action type: {action_type}")
-
-    async def run_step(self, user_input: str):
-        print(f"\n{'='*50}")
-        print(f"STARTING AGENT STEP")
-        print(f"{'='*50}")
-
-        # TODO: handle memory updates
-        action_type = ActionType.PROCESS_USER_INPUT
-        previous_action_type = action_type
-        action_count = 0
-        action_parameters = None
-        while action_count < self.MAX_ACTIONS:
-            action_count += 1
-            print(f"\nStep {action_count}/{self.MAX_ACTIONS}")
-            print(f"Current Action: {action_type.value}")
-
-            context = await self.get_context()
-            print(f"Context length: {len(context) if context else 0} chars")
-            print(f"Context: \n{context}")
-
-            result, action_type, action_parameters = await self.run_action(user_input, context, action_type, action_parameters)
-
-            # Extract tool_search_query from action_parameters if present
-            tool_search_query = None
-            if action_parameters and "tool_search_query" in action_parameters:
-                tool_search_query = action_parameters["tool_search_query"]
-
-            await self.memory.add_action(result, previous_action_type,
-                                         action_parameters=action_parameters,
-                                         tool_search_query=tool_search_query)
+        with self.tracer.span("action", action_type=action_type.value):
+            available_next_actions = self.get_available_next_actions(action_type)
+            if action_type == ActionType.PROCESS_USER_INPUT:
+                return await self.run_process_user_input_action(
+                    user_input, context, available_next_actions)
+            elif action_type == ActionType.AGENT_PLANNING:
+                return await self.run_agent_planning_action(context, available_next_actions)
+            elif action_type == ActionType.AGENT_TOOL_SEARCH:
+                early_task = self.take_early_dispatch(action_type, action_parameters)
+                if early_task:
+                    return await early_task
+                return await self.run_agent_tool_search_action(action_parameters)
+            elif action_type == ActionType.AGENT_TOOL_EXECUTION:
+                early_task = self.take_early_dispatch(action_type, action_parameters)
+                if early_task:
+                    return await early_task
+                return await self.run_agent_tool_execution_action(
+                    action_parameters)
+            elif action_type == ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT:
+                return await self.run_process_agent_tool_search_result_action(context, available_next_actions)
+            elif action_type == ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT:
+                return await self.run_process_agent_tool_execution_result_action(context, available_next_actions)
+            elif action_type == ActionType.AGENT_RESPONSE:
+                return await self.run_agent_response_action(context, available_next_actions)
+            elif action_type == ActionType.AWAIT_USER_INPUT:
+                # Return empty response and same action type
+                return "", ActionType.AWAIT_USER_INPUT, None
+            else:
+                raise ValueError(f"Invalid action type: {action_type}")
+
+    async def run_step(self, user_input: str) -> str:
+        """Run actions for one user input until the agent awaits input again, returning its last result"""
+        with self.tracer.span("step"):
+            self.log(f"\n{'='*50}")
+            self.log(f"STARTING AGENT STEP")
+            self.log(f"{'='*50}")
+
+            # TODO: handle memory updates
+            action_type = ActionType.PROCESS_USER_INPUT
             previous_action_type = action_type
-
-            print(f"Result: {result}")
-            print(f"Next Action: {action_type.value}")
-            print(f"Action Parameters: {action_parameters}")
-
-            # Exit immediately if AWAIT_USER_INPUT is triggered
-            if action_type == ActionType.AWAIT_USER_INPUT:
-                print(f"Awaiting user input - stopping step")
-                break
-
-        # print(f"\nRunning summarize step...")
-        summary = await self.run_summarize_step()
-        await self.memory.add_action(summary, ActionType.STEP_SUMMARY)
-        print(f"Step completed!\n")
-        print(f"{'='*50}")
+            action_count = 0
+            action_parameters = None
+            while action_count < self.MAX_ACTIONS:
+                action_count += 1
+                self.log(f"\nStep {action_count}/{self.MAX_ACTIONS}")
+                self.log(f"Current Action: {action_type.value}")
+
+                with self.tracer.span("fast_path", action_type=action_type.value) as span:
+                    shortcut = self.fast_path.match(self.memory, action_type,
+                                                    self.get_available_next_actions(action_type))
+                    span.set("hit", shortcut is not None)
+                if shortcut is not None:
+                    self.log(f"Fast path: skipping the LLM call for {action_type.value}")
+                    result, action_type, action_parameters = shortcut
+                else:
+                    with self.tracer.span("context.build"):
+                        context = await self.get_context()
+                    self.log(f"Context length: {len(context) if context else 0} chars")
+                    self.log(f"Context: \n{context}")
+
+                    result, action_type, action_parameters = await self.run_action(user_input, context, action_type,
+                                                                                   action_parameters)
+
+                # Extract tool_search_query from action_parameters if present
+                tool_search_query = None
+                if action_parameters and "tool_search_query" in action_parameters:
+                    tool_search_query = action_parameters["tool_search_query"]
+
+                with self.tracer.span("memory.write", action_type=previous_action_type.value):
+                    if isinstance(result, list):
+                        # a batch of tool calls, each result is recorded as its own node
+                        for call_result, tool_call in result:
+                            await self.memory.add_action(call_result, previous_action_type, action_parameters=tool_call)
+                    else:
+                        await self.memory.add_action(result, previous_action_type,
+                                                     action_parameters=action_parameters,
+                                                     tool_search_query=tool_search_query)
+                previous_action_type = action_type
+
+                self.log(f"Result: {result}")
+                self.log(f"Next Action: {action_type.value}")
+                self.log(f"Action Parameters: {action_parameters}")
+
+                # Exit immediately if AWAIT_USER_INPUT is triggered
+                if action_type == ActionType.AWAIT_USER_INPUT:
+                    self.log(f"Awaiting user input - stopping step")
+                    break
+
+            self.cancel_early_dispatch()
+            self.fast_path.end_step()
+            # print(f"\nRunning summarize step...")
+            with self.tracer.span("step.summarize"):
+                summary = await self.run_summarize_step()
+            with self.tracer.span("memory.write", action_type=ActionType.STEP_SUMMARY.value):
+                await self.memory.add_action(summary, ActionType.STEP_SUMMARY)
+            self.log(f"Step completed!\n")
+            self.log(f"{'='*50}")
+            return result
 
     async def run(self):
         print("Agent is running. Type 'exit' to quit.")
+        prompt_watch_task = asyncio.create_task(
+            self.prompts.watch()) if self.watch_prompts else None
         while True:
             user_input = input("You: ")
             if user_input.strip().lower() == "exit":
@@ -378,134 +637,214 @@ class CoreAgent:
             await self.run_step(user_input)
 
         self.is_running = False
+        if prompt_watch_task:
+            prompt_watch_task.cancel()
+        if self.memory_agent:
+            await self.memory_agent.close()
+        await self.gateway_tools.aclose()
+        self.blob_store.close()
+        if self.memory.store:
+            self.memory.store.close()
 
 
 class MemoryAgent:
-    """Memory agent that updates the memory based on the context"""
+    """
+    Memory agent that updates the memory based on the context
+    Updates are triggered by DAGMemory reaching a step boundary, not by polling. There is at most
+    one task per kind of update: a repeated request for the same node is coalesced into it and a
+    request for a newer node cancels the superseded one. LLM calls are bounded by a semaphore, and
+    failed updates are kept in `errors` and reported through `on_error` instead of being dropped.
+    """
     CONVERSATION_STATE_UPDATE_INTERVAL = 1
     TODO_LIST_UPDATE_INTERVAL = 1
     CONVERSATION_COMPRESSION_UPDATE_INTERVAL = 5
     ACTION_MAX_RETRIES = 3
+    MAX_CONCURRENT_UPDATES = 2
 
-    def __init__(self, memory: DAGMemory, core_agent: CoreAgent, llm=None):
+    def __init__(self, memory: DAGMemory, core_agent: CoreAgent, llm=None,
+                 max_concurrent_updates: Optional[int] = None,
+                 on_error: Optional[Callable[[ActionType, uuid.UUID, Exception], None]] = None):
         self.memory = memory
-        self.llm = llm or OpenAIProvider()
+        self.llm = llm if llm is not None and not isinstance(llm, str) else create_provider(llm)
         self.core_agent = core_agent
+        self.update_semaphore = asyncio.Semaphore(max_concurrent_updates or self.MAX_CONCURRENT_UPDATES)
+        # update action type -> (node id, task) of its latest scheduled update
+        self.pending: Dict[ActionType, Tuple[uuid.UUID, asyncio.Task]] = {}
+        # update action type -> node its last successful update was written to
+        self.updated_node_ids: Dict[ActionType, uuid.UUID] = {}
+        self.errors: List[Tuple[ActionType, uuid.UUID, Exception]] = []
+        self.on_error = on_error or (lambda action_type, node_id, error: self.core_agent.log(
+            f"Memory update {action_type.value} failed for node {node_id}: {type(error).__name__}: {error}"))
+        self.memory.add_step_listener(self.on_step_boundary)
 
     def get_prompt(self, action_type: ActionType):
-        if action_type == ActionType.UPDATE_TODO_LIST:
-            with open('prompts/coding/update_todo_list_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.UPDATE_CONVERSATION_STATE:
-            with open('prompts/coding/update_conversation_state_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.UPDATE_CONVERSATION_COMPRESSION:
-            with open('prompts/coding/update_conversation_compression_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        elif action_type == ActionType.UPDATE_BRANCH_BACKTRACK_SUMMARY:
-            with open('prompts/coding/update_branch_backtrack_summary_prompt.md', 'r') as f:
-                prompt_content = f.read()
-        else:
-            raise ValueError(
-                f"No prompt available for action type: {action_type}")
-
-        # Inject bash execute tool description at the top of all coding prompts
-        return prompt_content
+        return self.core_agent.prompts.get(action_type, self.core_agent.prompt_set)
+
+    def on_step_boundary(self, step_node: ActionNode):
+        """Schedule the memory updates due at this step"""
+        # step summary nodes carry no node memory, the step's last action does
+        node_id = step_node.parent_id
+        if node_id is None or node_id not in self.memory.nodes:
+            return
+        step_count = self.memory.get_step_count()
+        updates = [
+            (ActionType.UPDATE_TODO_LIST, self.TODO_LIST_UPDATE_INTERVAL, self.update_todo_list),
+            (ActionType.UPDATE_CONVERSATION_STATE, self.CONVERSATION_STATE_UPDATE_INTERVAL,
+             self.update_conversation_state),
+            (ActionType.UPDATE_CONVERSATION_COMPRESSION, self.CONVERSATION_COMPRESSION_UPDATE_INTERVAL,
+             self.update_conversation_compression),
+        ]
+        for action_type, interval, update in updates:
+            if step_count % interval == 0:
+                self.schedule(action_type, node_id, update)
+
+    def schedule(self, action_type: ActionType, node_id: uuid.UUID, update: Callable[[uuid.UUID, str], Any]):
+        pending = self.pending.get(action_type)
+        if pending is not None and not pending[1].done():
+            pending_node_id, task = pending
+            if pending_node_id == node_id:
+                return
+            task.cancel()
+        task = asyncio.create_task(self.run_update(action_type, node_id, update))
+        self.pending[action_type] = (node_id, task)
+
+    async def run_update(self, action_type: ActionType, node_id: uuid.UUID, update: Callable[[uuid.UUID, str], Any]):
+        try:
+            async with self.update_semaphore:
+                # the context is read once the update gets a slot, so a queued update sees the latest memory
+                with self.core_agent.tracer.span("memory.update", action_type=action_type.value):
+                    context = self.memory.get_budgeted_context(self.core_agent.context_token_budget, node_id)
+                    await update(node_id, context)
+            self.updated_node_ids[action_type] = node_id
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors.append((action_type, node_id, e))
+            self.on_error(action_type, node_id, e)
+        finally:
+            if self.pending.get(action_type, (None, None))[1] is asyncio.current_task():
+                del self.pending[action_type]
+
+    def previous_node_id(self, action_type: ActionType, node_id: uuid.UUID) -> Optional[uuid.UUID]:
+        """The node holding the last value of this update on node_id's branch, if any"""
+        previous_node_id = self.updated_node_ids.get(action_type)
+        if previous_node_id is None or previous_node_id not in self.memory.nodes:
+            return None
+        return previous_node_id if self.memory.is_ancestor(previous_node_id, node_id) else None
+
+    async def generate(self, context: str, action_type: ActionType, sample_index: int = 0,
+                       accept: Optional[Callable[[Any], bool]] = None) -> Any:
+        """A response cache only records the response if it parses and `accept` (if given) takes it"""
+        prompt = self.get_prompt(action_type)
+        # routed action types go through the core agent's router, the rest to this agent's llm
+        router = self.core_agent.router
+        llm = router.provider_for(action_type) if action_type in router.routes else self.llm
+        with sampling(sample_index) as sample:
+            response = await llm.generate(context, prompt)
+        response_text, _, _ = self.parse_response(response, action_type)
+        if accept is None or accept(response_text):
+            sample.commit()
+        return response_text
 
     async def generate_todo_list(self, node_id: uuid.UUID, current_context: str) -> TodoMemory:
-        todo_list = await self.memory.get_todo_list(node_id)
-
-        prompt = self.get_prompt(ActionType.UPDATE_TODO_LIST)
+        previous_node_id = self.previous_node_id(ActionType.UPDATE_TODO_LIST, node_id)
+        todo_list = self.memory.get_todo_list(previous_node_id) if previous_node_id else None
 
-        joined_context = current_context + "\n\n" + "CURRENT TODO LIST: " + \
-            todo_list if todo_list else "NO CURRENT TODO LIST"
-
-        response = await self.llm.generate(joined_context, prompt)
-        response_text, _, _ = self.parse_response(
-            response, ActionType.UPDATE_TODO_LIST)
+        joined_context = current_context + "\n\n" + (
+            f"CURRENT TODO LIST: {todo_list.items}" if todo_list else "NO CURRENT TODO LIST")
 
-        return TodoMemory(timestamp=datetime.now(), items=response_text)
+        response_text = await self.generate(joined_context, ActionType.UPDATE_TODO_LIST)
+        return TodoMemory(timestamp=datetime.datetime.now(), items=response_text)
 
-    async def generate_conversation_state(self, node_id: uuid.UUID, current_context: str):
-        conversation_state = await self.memory.get_conversation_state(node_id)
+    async def generate_conversation_state(self, node_id: uuid.UUID, current_context: str) -> ConversationStateMemory:
+        previous_node_id = self.previous_node_id(ActionType.UPDATE_CONVERSATION_STATE, node_id)
+        conversation_state = self.memory.get_conversation_state(previous_node_id) if previous_node_id else None
 
-        prompt = self.get_prompt(ActionType.UPDATE_CONVERSATION_STATE)
-
-        joined_context = current_context + "\n\n" + "CURRENT CONVERSATION STATE: " + \
-            conversation_state if conversation_state else "NO CURRENT CONVERSATION STATE"
-
-        response = await self.llm.generate(joined_context, prompt)
-        response_text, _, _ = self.parse_response(
-            response, ActionType.UPDATE_CONVERSATION_STATE)
+        joined_context = current_context + "\n\n" + (
+            f"CURRENT CONVERSATION STATE: {json.dumps(conversation_state.content, default=str)}"
+            if conversation_state else "NO CURRENT CONVERSATION STATE")
 
         # expect response text to be converted to a dictionary, retry if err
-        retries = 0
-        while not isinstance(response_text, dict) and retries < self.ACTION_MAX_RETRIES:
-            retries += 1
-            response = await self.llm.generate(joined_context, prompt)
-            response_text, _, _ = self.parse_response(
-                response, ActionType.UPDATE_CONVERSATION_STATE)
-
-        if retries == self.ACTION_MAX_RETRIES:
-            raise ValueError(
-                f"Failed to generate a valid conversation state after {self.ACTION_MAX_RETRIES} retries")
-
-        return response_text
-
-    async def generate_conversation_compression(self, node_id: uuid.UUID, current_context: str):
-        conversation_compression = await self.memory.get_conversation_compression(node_id)
-
-        prompt = self.get_prompt(ActionType.UPDATE_CONVERSATION_COMPRESSION)
-
-        joined_context = current_context + "\n\n" + "CURRENT CONVERSATION COMPRESSION: " + \
-            conversation_compression if conversation_compression else "NO CURRENT CONVERSATION COMPRESSION"
-
-        response = await self.llm.generate(joined_context, prompt)
-        response_text, _, _ = self.parse_response(
-            response, ActionType.UPDATE_CONVERSATION_COMPRESSION)
-
-        return response_text
-
-    async def parse_response(self, response: str, action_type: ActionType):
+        for attempt in range(self.ACTION_MAX_RETRIES):
+            try:
+                response_text = await self.generate(joined_context, ActionType.UPDATE_CONVERSATION_STATE,
+                                                    sample_index=attempt,
+                                                    accept=lambda text: isinstance(text, dict))
+            except ResponseNotRecorded:
+                continue
+            if isinstance(response_text, dict):
+                return ConversationStateMemory(timestamp=datetime.datetime.now(), content=response_text)
+
+        raise ValueError(
+            f"Failed to generate a valid conversation state after {self.ACTION_MAX_RETRIES} retries")
+
+    async def generate_conversation_compression(self, node_id: uuid.UUID,
+                                                current_context: str) -> ConversationCompressionMemory:
+        previous_node_id = self.previous_node_id(ActionType.UPDATE_CONVERSATION_COMPRESSION, node_id)
+        conversation_compression = self.memory.get_conversation_compression(
+            previous_node_id) if previous_node_id else None
+
+        joined_context = current_context + "\n\n" + (
+            f"CURRENT CONVERSATION COMPRESSION: {conversation_compression.content}"
+            if conversation_compression else "NO CURRENT CONVERSATION COMPRESSION")
+
+        response_text = await self.generate(joined_context, ActionType.UPDATE_CONVERSATION_COMPRESSION)
+        return ConversationCompressionMemory(timestamp=datetime.datetime.now(), content=response_text)
+
+    def parse_response(self, response: str, action_type: ActionType):
         return self.core_agent.parse_response(response, action_type)
 
-    async def _update_todo_list(self, node_id: uuid.UUID, current_context: str):
+    async def update_todo_list(self, node_id: uuid.UUID, current_context: str):
         todo_list = await self.generate_todo_list(node_id, current_context)
-        await self.memory.set_todo_list(node_id, todo_list)
+        self.memory.set_todo_list(node_id, todo_list)
 
-    async def _update_conversation_state(self, node_id: uuid.UUID, current_context: str):
+    async def update_conversation_state(self, node_id: uuid.UUID, current_context: str):
         conversation_state = await self.generate_conversation_state(node_id, current_context)
-        await self.memory.set_conversation_state(node_id, conversation_state)
+        self.memory.set_conversation_state(node_id, conversation_state)
 
-    async def _update_conversation_compression(self, node_id: uuid.UUID, current_context: str):
+    async def update_conversation_compression(self, node_id: uuid.UUID, current_context: str):
         conversation_compression = await self.generate_conversation_compression(node_id, current_context)
-        await self.memory.set_conversation_compression(node_id, conversation_compression)
+        self.memory.set_conversation_compression(node_id, conversation_compression)
 
-    async def run(self):
-        while self.core_agent.is_running:
-            # Update memory at specified intervals using built-in step counter (non-blocking)
-            step_count = self.memory.get_step_count()
-
-            current_action_node = self.memory.get_current_action_node()
-            current_action_node_id = current_action_node.node_id
-            current_context = self.memory.get_context()
-
-            if step_count % self.TODO_LIST_UPDATE_INTERVAL == 0:
-                asyncio.create_task(
-                    self._update_todo_list(current_action_node_id, current_context))
-
-            if step_count % self.CONVERSATION_STATE_UPDATE_INTERVAL == 0:
-                asyncio.create_task(
-                    self._update_conversation_state(current_action_node_id, current_context))
-
-            if step_count % self.CONVERSATION_COMPRESSION_UPDATE_INTERVAL == 0:
-                asyncio.create_task(
-                    self._update_conversation_compression(current_action_node_id, current_context))
+    async def drain(self):
+        """Wait for every scheduled update to finish"""
+        while True:
+            tasks = [task for _, task in self.pending.values() if not task.done()]
+            if not tasks:
+                return
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-            # steps accumulate slowly, so we dont need to tick too fast
-            await asyncio.sleep(5.0)
+    async def close(self):
+        """Stop listening for step boundaries and cancel the updates still running"""
+        self.memory.remove_step_listener(self.on_step_boundary)
+        tasks = [task for _, task in self.pending.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.pending.clear()
 
 
 if __name__ == "__main__":
-    agent = CoreAgent()
+    load_env()
+    # AGENT_TRACE_FILE=trace.json records timing spans, written on exit (Chrome trace, or OTLP JSON for *.otlp.json)
+    trace_file = os.environ.get("AGENT_TRACE_FILE")
+    # AGENT_LLM_CACHE_DIR=dir records LLM responses there, AGENT_LLM_CACHE_MODE=replay answers only from
+    # them (offline, AGENT_LLM_MODEL names the recorded model) and passthrough bypasses the cache
+    llm = None
+    provider_pool = None
+    cache_dir = os.environ.get("AGENT_LLM_CACHE_DIR")
+    if cache_dir:
+        cache_mode = os.environ.get("AGENT_LLM_CACHE_MODE", "record")
+        response_cache = ResponseCache(cache_dir)
+        llm = CachedProvider(None if cache_mode == "replay" else create_provider(), response_cache,
+                             mode=cache_mode, model_name=os.environ.get("AGENT_LLM_MODEL"))
+        # routed models go through the same cache, and in replay mode are never constructed
+        provider_pool = ProviderPool(lambda name, model_name: CachedProvider(
+            None if cache_mode == "replay" else create_provider(name, model_name=model_name), response_cache,
+            mode=cache_mode, model_name=model_name))
+    # AGENT_MODEL_ROUTES=openai-tiered runs bookkeeping actions on a cheap model and planning on a strong one
+    agent = CoreAgent(llm=llm, tracer=Tracer() if trace_file else None,
+                      model_routes=os.environ.get("AGENT_MODEL_ROUTES") or None, provider_pool=provider_pool)
     asyncio.run(agent.run())
+    if trace_file:
+        print(f"Timing trace saved to {agent.tracer.write(trace_file)}")
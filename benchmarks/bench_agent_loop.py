@@ -0,0 +1,244 @@
+"""
+Offline benchmark of the agent loop's own overhead.
+
+Drives CoreAgent.run_step with a deterministic FakeLLMProvider against a local StubGateway and
+reports, per session size (number of actions in the DAG):
+  - per-ActionType run_action latency percentiles
+  - context build time (DAGMemory.get_context), context size and serialization time (format_action)
+  - memory growth (traced Python allocations, per node)
+  - LLM-driven actions skipped by the fast path (--repeat-tool-calls makes the fake LLM loop on
+    one tool call, which the default rules cut short)
+
+Run from the repo root:
+    python3 benchmarks/bench_agent_loop.py [--sizes 10 100 1000 10000] [--transcript t.jsonl]
+        [--tool-output-chars 50000 [--no-spill]] [--trace trace.json]
+        [--llm-cache dir [--llm-cache-mode record|replay|passthrough]] [--model-routes openai-tiered]
+        [--repeat-tool-calls] [--no-fast-path]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agent import CoreAgent  # noqa: E402
+from gateway_tools import MCPGatewayTools  # noqa: E402
+from llm import ModelRouter, ProviderPool, register_provider  # noqa: E402
+from models import ActionType  # noqa: E402
+from response_cache import CachedProvider, ResponseCache  # noqa: E402
+from tracing import Tracer  # noqa: E402
+from fake_llm import FakeLLMProvider  # noqa: E402
+from stub_gateway import StubGateway  # noqa: E402
+
+
+# relative latency of the fake stand-ins for each model tier of ModelRouter.PRESETS (an assumption)
+MODEL_LATENCY_FACTORS = {ModelRouter.FULL[1]: 3.0, ModelRouter.MINI[1]: 1.0, ModelRouter.NANO[1]: 0.4}
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class BenchmarkAgent(CoreAgent):
+    """CoreAgent that times run_action per action type, get_context and format_action"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.action_timings: Dict[ActionType, List[float]] = defaultdict(list)
+        self.context_timings: List[float] = []
+        self.context_chars: List[int] = []
+        self.serialization_time = 0.0
+        self.serialized_actions = 0
+
+        format_action = self.memory.format_action
+
+        def timed_format_action(action):
+            start = time.perf_counter()
+            try:
+                return format_action(action)
+            finally:
+                self.serialization_time += time.perf_counter() - start
+                self.serialized_actions += 1
+
+        # instance attribute shadows the staticmethod used by DAGMemory.render_action
+        self.memory.format_action = timed_format_action
+
+    async def get_context(self):
+        start = time.perf_counter()
+        try:
+            context = await super().get_context()
+            self.context_chars.append(len(context))
+            return context
+        finally:
+            self.context_timings.append(time.perf_counter() - start)
+
+    async def run_action(self, user_input, context, action_type, action_parameters=None):
+        start = time.perf_counter()
+        try:
+            return await super().run_action(user_input, context, action_type, action_parameters)
+        finally:
+            self.action_timings[action_type].append(time.perf_counter() - start)
+
+
+async def run_session(size: int, gateway: StubGateway, llm: FakeLLMProvider, stream: bool,
+                      cache_tool_results: bool, spill: bool, tracer: Optional[Tracer] = None,
+                      response_cache: Optional[CachedProvider] = None, model_routes: Optional[str] = None,
+                      fast_path: bool = True) -> Dict:
+    agent = BenchmarkAgent(llm=response_cache or llm, gateway_tools=MCPGatewayTools(gateway.url, search_cache=None),
+                           verbose=False, stream_responses=stream, on_response_text=lambda text: None,
+                           cache_tool_results=cache_tool_results,
+                           spill_tool_output_chars=None if spill else sys.maxsize, tracer=tracer,
+                           model_routes=model_routes, provider_pool=ProviderPool(),
+                           fast_path_rules=None if fast_path else [])
+    tracemalloc.start()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    steps = 0
+    while len(agent.memory.nodes) < size:
+        await agent.memory.add_action(f"user request {steps}", ActionType.USER_INPUT)
+        await agent.run_step(f"user request {steps}")
+        steps += 1
+    elapsed = time.perf_counter() - start
+    end_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await agent.gateway_tools.aclose()
+    agent.blob_store.close()
+
+    nodes = len(agent.memory.nodes)
+    return {
+        "nodes": nodes,
+        "steps": steps,
+        "llm_calls": llm.call_count + sum(routed.call_count for routed in agent.router.providers.values()),
+        "model_routes": agent.router.stats() if model_routes else None,
+        "response_cache": response_cache.cache.stats() if response_cache else None,
+        "elapsed": elapsed,
+        "action_timings": agent.action_timings,
+        "context_timings": agent.context_timings,
+        "context_chars": agent.context_chars,
+        "serialization_time": agent.serialization_time,
+        "serialized_actions": agent.serialized_actions,
+        "prompt_cache": llm.prompt_cache_stats.summary(),
+        "tool_result_cache": agent.gateway_tools.result_cache.stats() if cache_tool_results else None,
+        "fast_path": agent.fast_path.stats(),
+        "memory_bytes": end_memory - start_memory,
+        "peak_memory_bytes": peak_memory - start_memory,
+    }
+
+
+def report(result: Dict):
+    print(f"\n=== {result['nodes']} actions, {result['steps']} steps, {result['llm_calls']} LLM calls, "
+          f"{result['elapsed']:.2f}s total ===")
+    print(f"{'action':<38} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for action_type, samples in sorted(result["action_timings"].items(), key=lambda item: item[0].value):
+        ms = [s * 1000 for s in samples]
+        print(f"{action_type.value:<38} {len(ms):>6} {percentile(ms, 50):>9.3f} {percentile(ms, 95):>9.3f} "
+              f"{percentile(ms, 99):>9.3f}")
+    context_ms = [s * 1000 for s in result["context_timings"]]
+    print(f"context build: mean {statistics.mean(context_ms):.3f} ms, p99 {percentile(context_ms, 99):.3f} ms, "
+          f"total {sum(context_ms):.1f} ms")
+    print(f"context size: mean {statistics.mean(result['context_chars']):.0f} chars, "
+          f"max {max(result['context_chars'])} chars")
+    print(f"serialization: {result['serialized_actions']} format_action calls, "
+          f"{result['serialization_time'] * 1000:.1f} ms total")
+    print(f"memory growth: {result['memory_bytes'] / 1024:.1f} KiB "
+          f"({result['memory_bytes'] / max(result['nodes'], 1):.0f} B/node), "
+          f"peak {result['peak_memory_bytes'] / 1024:.1f} KiB")
+    if result["model_routes"]:
+        calls_by_model: Dict[str, int] = defaultdict(int)
+        for chain in result["model_routes"].values():
+            for model_name, counts in chain.items():
+                calls_by_model[model_name] += counts["answered"]
+        print("routed LLM calls per model: " + ", ".join(f"{model_name} {calls}"
+                                                          for model_name, calls in sorted(calls_by_model.items())))
+    if result["response_cache"]:
+        cache = result["response_cache"]
+        print(f"llm response cache: {cache['hits']} hits, {cache['misses']} misses ({cache['hit_rate']:.0%}), "
+              f"{cache['entries']} entries")
+    prompt_cache = result["prompt_cache"]
+    print(f"prompt cache (simulated): {prompt_cache['cached_input_tokens']} of {prompt_cache['input_tokens']} "
+          f"input tokens cached ({prompt_cache['cached_fraction']:.0%})")
+    if result["tool_result_cache"]:
+        cache = result["tool_result_cache"]
+        print(f"tool result cache: {cache['hits']} hits, {cache['misses']} misses ({cache['hit_rate']:.0%})")
+    fast_path = result["fast_path"]
+    print(f"fast path: {fast_path['llm_actions_saved']} of {fast_path['llm_actions_saved'] + fast_path['llm_actions']} "
+          f"LLM-driven actions skipped ({fast_path['saved_fraction']:.0%}, {fast_path['saved_per_step']:.2f} per step)"
+          + "".join(f", {name} {count}" for name, count in fast_path["by_rule"].items()))
+
+
+def report_trace(tracer: Tracer, path: str, size: int):
+    print(f"{'span':<24} {'n':>6} {'mean ms':>9} {'total ms':>10}")
+    for name, stats in sorted(tracer.summary().items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"{name:<24} {stats['count']:>6} {stats['mean_ms']:>9.3f} {stats['total_ms']:>10.1f}")
+    root, ext = os.path.splitext(path)
+    if root.endswith(".otlp"):
+        root, ext = root[:-len(".otlp")], ".otlp" + ext
+    print(f"trace: {tracer.write(f'{root}-{size}{ext}')}")
+
+
+async def main(args):
+    if args.model_routes:
+        # the routed "openai" models are fake stand-ins, slower or faster than --latency per tier
+        register_provider("openai", lambda model_name: FakeLLMProvider(
+            model_name=model_name, latency=args.latency * MODEL_LATENCY_FACTORS.get(model_name, 1.0),
+            tool_calls_per_step=args.tool_calls_per_step, batch_tool_calls=args.batch_tool_calls,
+            repeat_tool_calls=args.repeat_tool_calls))
+    execute_handler = None
+    if args.tool_output_chars:
+        # a large output per tool call, e.g. a `cat` of a big file
+        output = ("x" * 79 + "\n") * (args.tool_output_chars // 80)
+        execute_handler = lambda tool_name, tool_args: output  # noqa: E731
+    async with StubGateway(execute_handler=execute_handler) as gateway:
+        for size in args.sizes:
+            llm_options = {"latency": args.latency, "tool_calls_per_step": args.tool_calls_per_step,
+                           "batch_tool_calls": args.batch_tool_calls, "repeat_tool_calls": args.repeat_tool_calls}
+            llm = FakeLLMProvider.from_transcript(args.transcript, **llm_options) if args.transcript \
+                else FakeLLMProvider(**llm_options)
+            tracer = Tracer() if args.trace else None
+            response_cache = None
+            if args.llm_cache:
+                # the fake LLM is scripted per step, so a replay must repeat the recorded run's options
+                response_cache = CachedProvider(None if args.llm_cache_mode == "replay" else llm,
+                                                ResponseCache(args.llm_cache), mode=args.llm_cache_mode,
+                                                model_name="fake")
+            report(await run_session(size, gateway, llm, args.stream, args.cache_tool_results, not args.no_spill,
+                                     tracer, response_cache, args.model_routes, not args.no_fast_path))
+            if response_cache:
+                response_cache.cache.close()
+            if tracer:
+                report_trace(tracer, args.trace, size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--tool-calls-per-step", type=int, default=2)
+    parser.add_argument("--transcript", default=None, help="JSONL transcript of {action_type, response} to replay")
+    parser.add_argument("--stream", action="store_true", help="use generate_stream instead of generate")
+    parser.add_argument("--batch-tool-calls", action="store_true",
+                        help="request each step's tool calls as one concurrent batch")
+    parser.add_argument("--cache-tool-results", action="store_true",
+                        help="memoise readonly tool results per session")
+    parser.add_argument("--tool-output-chars", type=int, default=0,
+                        help="make every tool call return this many characters")
+    parser.add_argument("--trace", default=None,
+                        help="record timing spans and write them per size (Chrome trace, OTLP JSON for *.otlp.json)")
+    parser.add_argument("--llm-cache", default=None, help="directory of an on-disk LLM response cache")
+    parser.add_argument("--llm-cache-mode", default="record", choices=CachedProvider.MODES)
+    parser.add_argument("--model-routes", default=None, choices=list(ModelRouter.PRESETS),
+                        help="route action types to fake per-tier models (see MODEL_LATENCY_FACTORS)")
+    parser.add_argument("--no-spill", action="store_true",
+                        help="keep large tool outputs inline in memory instead of spilling them to the blob store")
+    parser.add_argument("--repeat-tool-calls", action="store_true",
+                        help="make the fake LLM repeat the same tool call within a step")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every LLM-driven action to the LLM")
+    asyncio.run(main(parser.parse_args()))
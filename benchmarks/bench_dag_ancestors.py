@@ -0,0 +1,110 @@
+"""
+Benchmark of ancestor queries on deep DAGMemory graphs.
+
+Builds a DAG of the given depth with a side branch every `--branch-every` nodes, then compares
+DAGMemory's skip-pointer queries against walking parent pointers one at a time:
+  - k-th ancestor of the current node (random k)
+  - lowest common ancestor of two random branch tips
+  - depth of the current node
+  - get_recent_context(10) on the current branch
+
+Run from the repo root:
+    python3 benchmarks/bench_dag_ancestors.py [--depths 1000 10000 100000] [--queries 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import DAGMemory  # noqa: E402
+from models import ActionType  # noqa: E402
+
+
+def walk_ancestor(memory: DAGMemory, node_id: uuid.UUID, k: int) -> uuid.UUID:
+    for _ in range(k):
+        node_id = memory.nodes[node_id].parent_id
+    return node_id
+
+
+def walk_lowest_common_ancestor(memory: DAGMemory, first_node_id: uuid.UUID, second_node_id: uuid.UUID) -> uuid.UUID:
+    ancestors = {first_node_id, *memory.get_path_to_root(first_node_id)}
+    while second_node_id not in ancestors:
+        second_node_id = memory.nodes[second_node_id].parent_id
+    return second_node_id
+
+
+def walk_depth(memory: DAGMemory, node_id: uuid.UUID) -> int:
+    return len(memory.get_path_to_root(node_id))
+
+
+def walk_recent_context(memory: DAGMemory, max_actions: int) -> str:
+    """The parent-walking version: materialise the whole path, then render its tail"""
+    path = [memory.current_node_id, *memory.get_path_to_root(memory.current_node_id)]
+    return "\n".join(memory.render_action(node_id) for node_id in reversed(path[:max_actions]))
+
+
+async def build(depth: int, branch_every: int) -> Tuple[DAGMemory, List[uuid.UUID]]:
+    memory = DAGMemory()
+    tips = []
+    for i in range(depth):
+        await memory.add_action(f"action {i}", ActionType.AGENT_PLANNING)
+        if branch_every and i % branch_every == branch_every - 1:
+            trunk_id = memory.current_node_id
+            await memory.add_action(f"branch {i}", ActionType.AGENT_PLANNING)
+            tips.append(memory.current_node_id)
+            memory.set_current_node(trunk_id)
+    tips.append(memory.current_node_id)
+    return memory, tips
+
+
+def time_per_query(queries: List[Callable[[], object]]) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        query()
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+async def main(args):
+    random.seed(0)
+    print(f"{'depth':>8} {'query':<22} {'walk us':>12} {'skip us':>10} {'speedup':>9}")
+    for depth in args.depths:
+        memory, tips = await build(depth, args.branch_every)
+        current = memory.current_node_id
+        ks = [random.randrange(depth) for _ in range(args.queries)]
+        pairs = [(random.choice(tips), random.choice(tips)) for _ in range(args.queries)]
+        memory.get_recent_context(10)  # render the recent tail once for both variants
+
+        for ancestor_k in ks:
+            assert memory.get_ancestor(current, ancestor_k) == walk_ancestor(memory, current, ancestor_k)
+        cases = [
+            ("k-th ancestor",
+             [lambda k=k: walk_ancestor(memory, current, k) for k in ks],
+             [lambda k=k: memory.get_ancestor(current, k) for k in ks]),
+            ("lowest common ancestor",
+             [lambda a=a, b=b: walk_lowest_common_ancestor(memory, a, b) for a, b in pairs],
+             [lambda a=a, b=b: memory.get_lowest_common_ancestor(a, b) for a, b in pairs]),
+            ("depth",
+             [lambda: walk_depth(memory, current)] * args.queries,
+             [lambda: memory.get_depth(current)] * args.queries),
+            ("recent context (10)",
+             [lambda: walk_recent_context(memory, 10)] * args.queries,
+             [lambda: memory.get_recent_context(10)] * args.queries),
+        ]
+        for name, walk_queries, skip_queries in cases:
+            walk_us = time_per_query(walk_queries)
+            skip_us = time_per_query(skip_queries)
+            print(f"{depth:>8} {name:<22} {walk_us:>12.1f} {skip_us:>10.2f} {walk_us / skip_us:>8.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--branch-every", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
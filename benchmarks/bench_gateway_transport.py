@@ -0,0 +1,76 @@
+"""
+Per-call latency of MCPGatewayTools against a local stub gateway:
+a fresh httpx client per request (the old behaviour) vs the pooled keep-alive client.
+
+Run from the repo root: python3 benchmarks/bench_gateway_transport.py [--calls N]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gateway_tools import MCPGatewayTools  # noqa: E402
+from stub_gateway import StubGateway  # noqa: E402
+
+
+class FreshClientGatewayTools(MCPGatewayTools):
+    """Opens and tears down a client per request, like MCPGatewayTools did before pooling"""
+
+    async def _with_fresh_client(self, call):
+        async with httpx.AsyncClient() as client:
+            self._client = client
+            self._owns_client = False
+            try:
+                return await call()
+            finally:
+                self._client = None
+
+    async def create_session(self):
+        return await self._with_fresh_client(super().create_session)
+
+    async def execute_tool(self, tool_name: str, **args) -> str:
+        return await self._with_fresh_client(lambda: super(FreshClientGatewayTools, self).execute_tool(tool_name, **args))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def time_calls(tools: MCPGatewayTools, calls: int):
+    await tools.create_session()
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        await tools.execute_tool("bash_execute", command=f"echo {i}", permission="readonly")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main(calls: int):
+    async with StubGateway() as gateway:
+        fresh = await time_calls(FreshClientGatewayTools(gateway.url), calls)
+        fresh_connections = gateway.connection_count
+
+        async with MCPGatewayTools(gateway.url) as pooled_tools:
+            pooled = await time_calls(pooled_tools, calls)
+        pooled_connections = gateway.connection_count - fresh_connections
+
+    print(f"{'transport':<10} {'conns':>6} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, samples, connections in (("fresh", fresh, fresh_connections), ("pooled", pooled, pooled_connections)):
+        print(f"{name:<10} {connections:>6} {statistics.mean(samples):>9.3f} {percentile(samples, 50):>8.3f} "
+              f"{percentile(samples, 95):>8.3f} {percentile(samples, 99):>8.3f}")
+    print(f"speedup (mean): {statistics.mean(fresh) / statistics.mean(pooled):.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=500)
+    asyncio.run(main(parser.parse_args().calls))
@@ -0,0 +1,72 @@
+"""
+Resident memory per DAGMemory node.
+
+Adds N actions (a typical mix of action types, content strings allocated up front so they are not
+counted) and reports the traced allocations per node:
+  - structure: Action, ActionNode, ids, timestamps, node memory and DAGMemory's indexes
+  - rendered: the cached format_action text of the rendered context path on top of that
+
+The structural cost is checked against TARGET_BYTES_PER_NODE.
+
+Run from the repo root:
+    python3 benchmarks/bench_node_memory.py [--nodes 10000 100000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import DAGMemory  # noqa: E402
+from models import ActionType  # noqa: E402
+
+# structural bytes per node, excluding action content and rendered text (was ~1080 with plain dataclasses)
+TARGET_BYTES_PER_NODE = 768
+
+STEP_ACTIONS = [
+    ActionType.USER_INPUT,
+    ActionType.PROCESS_USER_INPUT,
+    ActionType.AGENT_TOOL_EXECUTION,
+    ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,
+    ActionType.AGENT_RESPONSE,
+    ActionType.STEP_SUMMARY,
+]
+
+
+def traced_bytes() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def measure(count: int):
+    contents = [f"content {i}" for i in range(count)]
+    memory = DAGMemory()
+    tracemalloc.start()
+    start = traced_bytes()
+    for i in range(count):
+        action_type = STEP_ACTIONS[i % len(STEP_ACTIONS)]
+        action_parameters = {"tool_name": "bash_execute"} if action_type == ActionType.AGENT_TOOL_EXECUTION else None
+        await memory.add_action(contents[i], action_type, action_parameters=action_parameters)
+    structure = traced_bytes() - start
+    memory.get_context()
+    rendered = traced_bytes() - start - structure
+    tracemalloc.stop()
+
+    per_node = structure / count
+    status = "ok" if per_node <= TARGET_BYTES_PER_NODE else "OVER TARGET"
+    print(f"{count:>8} nodes: structure {per_node:7.0f} B/node (target {TARGET_BYTES_PER_NODE}, {status}), "
+          f"rendered context +{rendered / count:7.0f} B/node")
+
+
+async def main(args):
+    for count in args.nodes:
+        await measure(count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10000, 100000])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""
+Lookup cost of the on-disk LLM response cache.
+
+Fills a ResponseCache with N responses of `--response-chars` each and reports per-operation
+latency for key hashing (on a context of `--context-chars`), hits, misses and inserts, the last
+with a size bound small enough that every insert also evicts.
+
+Run from the repo root:
+    python3 benchmarks/bench_response_cache.py [--entries 1000 10000 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache  # noqa: E402
+
+
+def time_per_call(call: Callable[[int], object], count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        call(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main(args):
+    response = "r" * args.response_chars
+    context = "[12:00:00] AGENT PLANNING: \n " + "c" * args.context_chars
+    print(f"{'entries':>8} {'key us':>8} {'hit us':>8} {'miss us':>8} {'insert+evict us':>16}")
+    for entries in args.entries:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory, max_bytes=entries * args.response_chars)
+            cache.db.execute("BEGIN")
+            for i in range(entries):
+                cache.put(f"key-{i}", response)
+            cache.db.execute("COMMIT")
+
+            key_us = time_per_call(lambda i: cache.key("gpt-5", "system prompt", context), args.queries)
+            hit_us = time_per_call(lambda i: cache.get(f"key-{(i * 7919) % entries}"), args.queries)
+            miss_us = time_per_call(lambda i: cache.get(f"missing-{i}"), args.queries)
+            insert_us = time_per_call(lambda i: cache.put(f"new-{i}", response), args.queries)
+            assert cache.total_bytes <= cache.max_bytes
+            cache.close()
+        print(f"{entries:>8} {key_us:>8.1f} {hit_us:>8.1f} {miss_us:>8.1f} {insert_us:>16.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--response-chars", type=int, default=1000)
+    parser.add_argument("--context-chars", type=int, default=100000)
+    main(parser.parse_args())
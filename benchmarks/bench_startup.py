@@ -0,0 +1,95 @@
+"""
+Startup latency of a short-lived agent process.
+
+Each run is a fresh interpreter (`--child`) that reports:
+  - import: `import agent`
+  - construct: CoreAgent(llm=<provider name>) through the provider registry
+  - first action: run_action(PROCESS_USER_INPUT) with the scripted fake LLM (fake provider only,
+    real providers would need the network)
+  - which provider SDKs / HTTP clients ended up imported
+and the parent adds the whole process wall time, interpreter startup included. Real providers
+get a dummy API key when none is set, constructing a client doesn't contact the API.
+
+Run from the repo root:
+    python3 benchmarks/bench_startup.py [--runs 10] [--providers fake openai gemini]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["openai", "google.genai", "httpx", "dotenv"]
+
+
+def child(provider: str):
+    start = time.perf_counter()
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from agent import CoreAgent
+    from models import ActionType
+    imported = time.perf_counter()
+
+    if provider == "fake":
+        from fake_llm import FakeLLMProvider
+        from llm import register_provider
+        register_provider("fake", FakeLLMProvider)
+    agent = CoreAgent(llm=provider, verbose=False)
+    constructed = time.perf_counter()
+
+    first_action = None
+    if provider == "fake":
+        asyncio.run(agent.run_action("list the files", "", ActionType.PROCESS_USER_INPUT))
+        first_action = time.perf_counter()
+    agent.blob_store.close()
+
+    print(json.dumps({
+        "import": imported - start,
+        "construct": constructed - imported,
+        "first_action": first_action - constructed if first_action else None,
+        "modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def run(provider: str) -> dict:
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-key"),
+           "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench-key")}
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", provider], env=env,
+                            cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main(args):
+    print(f"{'provider':<10} {'process ms':>11} {'import ms':>10} {'construct ms':>13} {'1st action ms':>14}  imported")
+    for provider in args.providers:
+        try:
+            results = [run(provider) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{provider:<10} failed: {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            continue
+
+        def median_ms(key: str) -> str:
+            samples = [result[key] for result in results if result[key] is not None]
+            return f"{statistics.median(samples) * 1000:.1f}" if samples else "-"
+
+        print(f"{provider:<10} {median_ms('process'):>11} {median_ms('import'):>10} {median_ms('construct'):>13} "
+              f"{median_ms('first_action'):>14}  {', '.join(results[-1]['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--providers", nargs="+", default=["fake", "openai", "gemini"])
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+    else:
+        main(args)
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm import PromptCacheStats  # noqa: E402
+from models import ActionType  # noqa: E402
+from prompt_registry import PromptRegistry  # noqa: E402
+
+
+class FakeLLMProvider:
+    """
+    Deterministic stand-in for GeminiProvider/OpenAIProvider
+    The action being run is recognised from its system prompt (via the PromptRegistry), and the
+    reply comes either from a recorded transcript or from a built-in script that drives each step
+    through `tool_calls_per_step` readonly bash_execute calls before responding, one action per call or
+    all of them in one batched action with `batch_tool_calls`. With `repeat_tool_calls` every call
+    is the same one, an agent going in circles.
+    Latency is `latency` seconds per call plus output tokens (~4 chars each) / `tokens_per_second`.
+    Input tokens are reported in `prompt_cache_stats` as an automatic prefix cache would: the prefix
+    shared with the previous call for the same system prompt is cached, in 128 token blocks once it
+    reaches 1024 tokens (OpenAI's rules).
+    """
+
+    MIN_CACHED_PREFIX_TOKENS = 1024
+    CACHED_PREFIX_BLOCK_TOKENS = 128
+
+    def __init__(self, prompt_registry: Optional[PromptRegistry] = None, prompt_set: str = "coding",
+                 latency: float = 0.0, tokens_per_second: Optional[float] = None,
+                 tool_calls_per_step: int = 1, response_chars: int = 400,
+                 transcript: Optional[Dict[ActionType, List[str]]] = None, stream_chunk_chars: int = 16,
+                 batch_tool_calls: bool = False, model_name: str = "fake", repeat_tool_calls: bool = False):
+        registry = prompt_registry or PromptRegistry.default()
+        self.action_types_by_prompt = {prompt: action_type
+                                       for (set_name, action_type), prompt in registry.prompts.items()
+                                       if set_name == prompt_set}
+        self.model_name = model_name
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.tool_calls_per_step = tool_calls_per_step
+        self.batch_tool_calls = batch_tool_calls
+        self.repeat_tool_calls = repeat_tool_calls
+        self.filler = ("lorem ipsum dolor sit amet " * (response_chars // 27 + 1))[:response_chars]
+        self.transcript = transcript
+        self.transcript_positions: Dict[ActionType, int] = defaultdict(int)
+        self.stream_chunk_chars = stream_chunk_chars
+        self.tool_calls_this_step = 0
+        self.call_count = 0
+        self.calls_by_action_type: Dict[ActionType, int] = defaultdict(int)
+        self.prompt_cache_stats = PromptCacheStats()
+        self.previous_prompts: Dict[Optional[str], str] = {}
+
+    @classmethod
+    def from_transcript(cls, path: str, **kwargs) -> "FakeLLMProvider":
+        """
+        Replay a JSONL transcript, one {"action_type": ..., "response": ...} object per line.
+        Responses are replayed in order per action type, cycling when exhausted.
+        """
+        transcript: Dict[ActionType, List[str]] = defaultdict(list)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    transcript[ActionType(record["action_type"])].append(record["response"])
+        return cls(transcript=dict(transcript), **kwargs)
+
+    def scripted_response(self, action_type: ActionType) -> str:
+        if self.transcript is not None and self.transcript.get(action_type):
+            responses = self.transcript[action_type]
+            position = self.transcript_positions[action_type]
+            self.transcript_positions[action_type] = position + 1
+            return responses[position % len(responses)]
+
+        if action_type in (ActionType.PROCESS_USER_INPUT, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT):
+            if action_type == ActionType.PROCESS_USER_INPUT:
+                self.tool_calls_this_step = 0
+            if self.tool_calls_this_step < self.tool_calls_per_step:
+                if self.batch_tool_calls:
+                    tool_calls = [self.tool_call(i) for i in range(1, self.tool_calls_per_step + 1)]
+                    self.tool_calls_this_step = self.tool_calls_per_step
+                    next_action_parameters = {"tool_calls": tool_calls}
+                else:
+                    self.tool_calls_this_step += 1
+                    next_action_parameters = self.tool_call(1 if self.repeat_tool_calls else self.tool_calls_this_step)
+                return json.dumps({
+                    "response": self.filler,
+                    "next_action": "AGENT_TOOL_EXECUTION",
+                    "next_action_parameters": next_action_parameters,
+                })
+            return json.dumps({"response": self.filler, "next_action": "AGENT_RESPONSE"})
+        if action_type in (ActionType.AGENT_PLANNING, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT):
+            return json.dumps({"response": self.filler, "next_action": "AGENT_RESPONSE"})
+        return json.dumps({"response": self.filler})
+
+    @staticmethod
+    def tool_call(index: int) -> Dict:
+        return {
+            "tool_name": "bash_execute",
+            "tool_args": {"command": f"cat file_{index}.py", "working_dir": "/workspace", "permission": "readonly"},
+        }
+
+    @staticmethod
+    def common_prefix_length(first: str, second: str) -> int:
+        # binary search on slice comparisons, much faster than a per-character loop on long prompts
+        low, high = 0, min(len(first), len(second))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if first[:middle] == second[:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def record_usage(self, context: str, system_prompt: Optional[str], response: str):
+        prompt = (system_prompt or "") + context
+        previous = self.previous_prompts.get(system_prompt)
+        self.previous_prompts[system_prompt] = prompt
+        cached_tokens = self.common_prefix_length(previous, prompt) // 4 if previous else 0
+        if cached_tokens < self.MIN_CACHED_PREFIX_TOKENS:
+            cached_tokens = 0
+        cached_tokens -= cached_tokens % self.CACHED_PREFIX_BLOCK_TOKENS
+        self.prompt_cache_stats.record(len(prompt) // 4, cached_tokens, len(response) // 4)
+
+    def action_type_for(self, system_prompt: Optional[str]) -> ActionType:
+        return self.action_types_by_prompt.get(system_prompt, ActionType.DEFAULT)
+
+    def latency_for(self, response: str) -> float:
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += len(response) / 4 / self.tokens_per_second
+        return delay
+
+    async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
+        action_type = self.action_type_for(system_prompt)
+        self.call_count += 1
+        self.calls_by_action_type[action_type] += 1
+        response = self.scripted_response(action_type)
+        self.record_usage(context, system_prompt, response)
+        delay = self.latency_for(response)
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    async def generate_stream(self, context: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        action_type = self.action_type_for(system_prompt)
+        self.call_count += 1
+        self.calls_by_action_type[action_type] += 1
+        response = self.scripted_response(action_type)
+        self.record_usage(context, system_prompt, response)
+        chunks = [response[i:i + self.stream_chunk_chars] for i in range(0, len(response), self.stream_chunk_chars)]
+        delay = self.latency_for(response)
+        for chunk in chunks:
+            if delay:
+                await asyncio.sleep(delay / len(chunks))
+            yield chunk
+
+    def set_generation_config(self, **kwargs):
+        pass
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+
+class StubGateway:
+    """
+    Minimal local stand-in for the MCP gateway (HTTP/1.1 with keep-alive)
+    Serves the endpoints MCPGatewayTools uses with canned responses so benchmarks run offline
+    """
+
+    DEFAULT_TOOLS = [
+        {
+            "name": "bash_execute",
+            "description": "Execute a bash command",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "command": {"type": "string"},
+                    "working_dir": {"type": "string"},
+                    "permission": {"type": "string", "enum": ["readonly", "execute"]},
+                },
+            },
+        }
+    ]
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 tools: Optional[List[Dict[str, Any]]] = None,
+                 execute_handler: Optional[Callable[[str, Dict[str, Any]], str]] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tools = tools if tools is not None else self.DEFAULT_TOOLS
+        self.execute_handler = execute_handler
+        self.request_counts: Dict[str, int] = {}
+        self.connection_count = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "StubGateway":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # idle keep-alive connections would otherwise outlive the server
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            await asyncio.sleep(0)
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def route(self, method: str, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        if method == "POST" and path == "/sessions/create":
+            return {"success": True, "session_id": str(uuid.uuid4())}
+        if method == "POST" and path == "/mcp/search":
+            return {"result": self.tools}
+        if method == "POST" and path == "/mcp/execute":
+            tool_name = body.get("tool_name", "")
+            args = body.get("args", {})
+            if self.execute_handler is not None:
+                return {"result": self.execute_handler(tool_name, args)}
+            return {"result": json.dumps({"content": f"ran {tool_name} with {json.dumps(args, sort_keys=True)}"})}
+        if method == "GET" and path == "/mcp/tools":
+            return {"tools": self.tools}
+        return {"error": f"unknown endpoint {method} {path}"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connection_count += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                raw_body = b""
+                content_length = int(headers.get("content-length", 0))
+                if content_length:
+                    raw_body = await reader.readexactly(content_length)
+                body = json.loads(raw_body) if raw_body else {}
+
+                self.request_counts[path] = self.request_counts.get(path, 0) + 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                payload = json.dumps(self.route(method, path, body)).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n".encode()
+                    + (b"Connection: keep-alive\r\n" if keep_alive else b"Connection: close\r\n")
+                    + b"\r\n" + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
@@ -0,0 +1,77 @@
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+
+class BlobStore:
+    """
+    Content-addressed store for large tool outputs
+    Each blob is written once to <root>/<sha256[:2]>/<sha256> (identical outputs share a file) and read
+    back through a read-only mmap, so fetching a slice of a large output doesn't load the whole file.
+    Without a root the blobs live in a temporary directory that close() removes.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self._owns_root = root is None
+        self.root = root or tempfile.mkdtemp(prefix="dude-blobs-")
+        os.makedirs(self.root, exist_ok=True)
+        # blobs are immutable, so their maps stay open until close()
+        self._maps: Dict[str, mmap.mmap] = {}
+
+    def path(self, digest: str) -> str:
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid blob id: {digest}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, text: str) -> str:
+        """Store text as UTF-8, returning its blob id (the sha256 hex digest)"""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def _map(self, digest: str) -> Optional[mmap.mmap]:
+        blob = self._maps.get(digest)
+        if blob is None:
+            path = self.path(digest)
+            if not os.path.exists(path):
+                raise ValueError(f"Unknown blob: {digest}")
+            if os.path.getsize(path) == 0:
+                return None
+            with open(path, "rb") as f:
+                blob = self._maps[digest] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return blob
+
+    def size(self, digest: str) -> int:
+        """Size of a blob in bytes"""
+        blob = self._map(digest)
+        return len(blob) if blob is not None else 0
+
+    def read(self, digest: str, offset: int = 0, length: Optional[int] = None) -> str:
+        """
+        Read `length` bytes of a blob from `offset` (to the end when length is None)
+        Offsets are byte offsets, a multi-byte character cut at either end is decoded as U+FFFD.
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError(f"Invalid blob slice: offset={offset}, length={length}")
+        blob = self._map(digest)
+        if blob is None:
+            return ""
+        end = len(blob) if length is None else min(len(blob), offset + length)
+        return blob[offset:end].decode("utf-8", errors="replace")
+
+    def close(self):
+        for blob in self._maps.values():
+            blob.close()
+        self._maps.clear()
+        if self._owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
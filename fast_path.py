@@ -0,0 +1,178 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from memory import DAGMemory
+from models import Action, ActionType
+
+
+def trailing_tool_executions(memory: DAGMemory) -> List[Action]:
+    """The tool execution results at the tip of the current branch, one per call of the last batch"""
+    actions = []
+    node_id = memory.current_node_id
+    while node_id is not None:
+        node = memory.nodes[node_id]
+        if node.action.action_type != ActionType.AGENT_TOOL_EXECUTION:
+            break
+        actions.append(node.action)
+        node_id = node.parent_id
+    actions.reverse()
+    return actions
+
+
+def current_step_actions(memory: DAGMemory) -> List[Action]:
+    """The actions since the current step's user input, oldest first"""
+    actions = []
+    node_id = memory.current_node_id
+    while node_id is not None:
+        node = memory.nodes[node_id]
+        if node.step_boundary:
+            break
+        actions.append(node.action)
+        if node.action.action_type == ActionType.USER_INPUT:
+            break
+        node_id = node.parent_id
+    actions.reverse()
+    return actions
+
+
+def is_failed_tool_result(content: Any) -> bool:
+    return not isinstance(content, str) or content.startswith(("Tool execution failed", "No gateway session"))
+
+
+class FastPathRule:
+    """A deterministic transition: given memory, the (result text, next action, parameters) to use instead of an LLM call"""
+
+    name = "rule"
+    action_types: Tuple[ActionType, ...] = ()
+
+    def match(self, memory: DAGMemory) -> Optional[Tuple[str, ActionType, Optional[Dict[str, Any]]]]:
+        raise NotImplementedError("Subclasses must implement match")
+
+
+class NoToolsFoundRule(FastPathRule):
+    """A tool search that found nothing leaves no tool to execute, so go straight back to planning"""
+
+    name = "no_tools_found"
+    action_types = (ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT,)
+
+    def match(self, memory: DAGMemory):
+        action = memory.nodes[memory.current_node_id].action if memory.current_node_id else None
+        if action is None or action.action_type != ActionType.AGENT_TOOL_SEARCH:
+            return None
+        if not isinstance(action.content, str) or not action.content.startswith("No tools found for query:"):
+            return None
+        return (f"{action.content}. There is no tool to execute for it, planning without one.",
+                ActionType.AGENT_PLANNING, None)
+
+
+class RepeatedToolCallRule(FastPathRule):
+    """
+    The last tool execution repeated the previous one of this step call for call with the same
+    results, nothing ran in between that could change them, so the agent is going in circles:
+    respond with what it has instead of asking the LLM again. A repeat after a different call
+    (`ls build/`, a failed `make`, `ls build/`) still goes to the LLM, which has to react to it.
+    """
+
+    name = "repeated_tool_call"
+    action_types = (ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,)
+
+    @staticmethod
+    def call_key(action: Action) -> Tuple[Any, str, Any]:
+        return action.tool_name, repr(sorted((action.tool_args or {}).items())), action.content
+
+    def match(self, memory: DAGMemory):
+        latest = trailing_tool_executions(memory)
+        if not latest:
+            return None
+        # the tool execution batch before the latest one in this step, the processing of it sits in between
+        earlier_actions = current_step_actions(memory)[:-len(latest)]
+        while earlier_actions and earlier_actions[-1].action_type != ActionType.AGENT_TOOL_EXECUTION:
+            earlier_actions.pop()
+        previous = []
+        while earlier_actions and earlier_actions[-1].action_type == ActionType.AGENT_TOOL_EXECUTION:
+            previous.append(earlier_actions.pop())
+        if not previous or set(map(self.call_key, latest)) != set(map(self.call_key, previous)):
+            return None
+        calls = ", ".join(str(action.tool_name) for action in latest)
+        return (f"Repeated {calls} with the same result as earlier in this step, responding with what is known.",
+                ActionType.AGENT_RESPONSE, None)
+
+
+class TrivialReadonlyResultRule(FastPathRule):
+    """
+    The last tool execution only ran introspection commands (pwd, whoami, ...) that succeeded, their
+    output is the answer, so respond without processing it. Not a default rule: an agent that runs
+    `pwd` to orient itself before the real work would stop early.
+    """
+
+    name = "trivial_readonly_result"
+    action_types = (ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,)
+    TRIVIAL_COMMANDS = frozenset({"pwd", "whoami", "hostname", "uname", "id", "date"})
+
+    def match(self, memory: DAGMemory):
+        latest = trailing_tool_executions(memory)
+        if not latest:
+            return None
+        for action in latest:
+            args = action.tool_args or {}
+            command = str(args.get("command", "")).split()
+            if action.tool_name != "bash_execute" or args.get("permission", "readonly") != "readonly" \
+                    or len(command) == 0 or command[0] not in self.TRIVIAL_COMMANDS \
+                    or any(character in args.get("command", "") for character in ";&|`$><") \
+                    or is_failed_tool_result(action.content) or not action.content.strip():
+                return None
+        return ("\n".join(f"{action.tool_args['command']}: {action.content.strip()}" for action in latest),
+                ActionType.AGENT_RESPONSE, None)
+
+
+class FastPath:
+    """
+    Deterministic transitions consulted by run_step before each LLM-driven action
+    The first rule that matches supplies the action's result and next action, and the LLM call is
+    skipped. Skipped calls are counted per rule, and steps are counted for the per step average.
+    """
+
+    LLM_ACTION_TYPES = frozenset({
+        ActionType.PROCESS_USER_INPUT,
+        ActionType.AGENT_PLANNING,
+        ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT,
+        ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,
+        ActionType.AGENT_RESPONSE,
+    })
+
+    @staticmethod
+    def default_rules() -> List[FastPathRule]:
+        return [NoToolsFoundRule(), RepeatedToolCallRule()]
+
+    def __init__(self, rules: Optional[List[FastPathRule]] = None):
+        self.rules = self.default_rules() if rules is None else rules
+        self.saved_by_rule: Counter = Counter()
+        self.llm_actions = 0
+        self.steps = 0
+
+    def match(self, memory: DAGMemory, action_type: ActionType,
+              available_next_actions: List[ActionType]) -> Optional[Tuple[str, ActionType, Optional[Dict[str, Any]]]]:
+        if action_type not in self.LLM_ACTION_TYPES:
+            return None
+        for rule in self.rules:
+            if action_type not in rule.action_types:
+                continue
+            shortcut = rule.match(memory)
+            if shortcut is not None and shortcut[1] in available_next_actions:
+                self.saved_by_rule[rule.name] += 1
+                return shortcut
+        self.llm_actions += 1
+        return None
+
+    def end_step(self):
+        self.steps += 1
+
+    def stats(self) -> Dict[str, Any]:
+        saved = sum(self.saved_by_rule.values())
+        return {
+            "steps": self.steps,
+            "llm_actions": self.llm_actions,
+            "llm_actions_saved": saved,
+            "saved_fraction": saved / (saved + self.llm_actions) if saved + self.llm_actions else 0.0,
+            "saved_per_step": saved / self.steps if self.steps else 0.0,
+            "by_rule": dict(self.saved_by_rule),
+        }
@@ -1,106 +1,395 @@
 import asyncio
 import json
-from typing import Dict, Any, List
-import httpx
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Any, FrozenSet, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class ToolSearchCache:
+    """
+    TTL + LRU cache of gateway tool search results keyed on a normalised query
+    Queries are folded to a set of lowercase, stopword-free tokens, so "Run a shell command" and
+    "shell command run" share an entry. With a similarity_threshold, a miss falls back to the
+    cached query with the highest token-set (Jaccard) similarity above the threshold.
+    """
+
+    STOPWORDS = frozenset({
+        "a", "an", "and", "any", "for", "from", "i", "in", "into", "is", "it", "me", "my", "of",
+        "on", "or", "some", "that", "the", "this", "to", "tool", "tools", "with",
+    })
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600.0, similarity_threshold: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # (gateway_url, query tokens) -> (expiry, result)
+        self.entries: "OrderedDict[Tuple[str, FrozenSet[str]], Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize_query(cls, query: str) -> FrozenSet[str]:
+        tokens = re.findall(r"[a-z0-9_]+", query.lower())
+        kept = frozenset(token for token in tokens if token not in cls.STOPWORDS)
+        # a query made only of stopwords still needs a usable key
+        return kept or frozenset(tokens)
+
+    def get(self, gateway_url: str, query: str) -> Optional[str]:
+        tokens = self.normalize_query(query)
+        key = self._find_key(gateway_url, tokens)
+        if key is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key][1]
+
+    def put(self, gateway_url: str, query: str, result: str):
+        key = (gateway_url, self.normalize_query(query))
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _find_key(self, gateway_url: str, tokens: FrozenSet[str]) -> Optional[Tuple[str, FrozenSet[str]]]:
+        now = time.monotonic()
+        key = (gateway_url, tokens)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                return key
+            del self.entries[key]
+
+        if self.similarity_threshold is None or not tokens:
+            return None
+
+        best_key, best_score = None, self.similarity_threshold
+        for candidate_key, (expiry, _) in list(self.entries.items()):
+            if expiry <= now:
+                del self.entries[candidate_key]
+                continue
+            candidate_url, candidate_tokens = candidate_key
+            if candidate_url != gateway_url or not candidate_tokens:
+                continue
+            score = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+            if score >= best_score:
+                best_key, best_score = candidate_key, score
+        return best_key
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by every MCPGatewayTools in the process unless one is given its own cache
+SHARED_TOOL_SEARCH_CACHE = ToolSearchCache()
+
+
+def is_readonly_bash_execute(args: Dict[str, Any]) -> bool:
+    return args.get("permission", "readonly") == "readonly"
+
+
+def is_cacheable_bash_execute(args: Dict[str, Any]) -> bool:
+    """Readonly commands, minus the ones whose output changes on its own (clocks, process and disk stats)"""
+    if not is_readonly_bash_execute(args):
+        return False
+    words = set(re.findall(r"[A-Za-z0-9_.-]+", str(args.get("command", ""))))
+    return not words & ToolResultCache.VOLATILE_COMMANDS
+
+
+class ToolResultCache:
+    """
+    Per-session LRU cache of idempotent tool results keyed on (tool name, canonical args, working_dir)
+    Only calls an `idempotent` predicate accepts are cached, by default readonly bash_execute. Calls
+    that are not `readonly` either may have changed what those reads return, so they drop every
+    entry whose working_dir is the same as, inside or above their own (or all entries when they have
+    no working_dir).
+    """
+
+    VOLATILE_COMMANDS = frozenset({"date", "ps", "top", "df", "du", "uptime", "free", "who", "w", "last"})
+    DEFAULT_IDEMPOTENT = {"bash_execute": is_cacheable_bash_execute}
+    DEFAULT_READONLY = {"bash_execute": is_readonly_bash_execute}
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0,
+                 idempotent: Optional[Dict[str, Callable[[Dict[str, Any]], bool]]] = None,
+                 readonly: Optional[Dict[str, Callable[[Dict[str, Any]], bool]]] = None):
+        self.max_entries = max_entries
+        # reads also go stale through edits made outside the agent, so entries still expire
+        self.ttl = ttl
+        self.idempotent = self.DEFAULT_IDEMPOTENT if idempotent is None else idempotent
+        self.readonly = self.DEFAULT_READONLY if readonly is None else readonly
+        # (tool name, canonical args, working_dir) -> (expiry, result)
+        self.entries: "OrderedDict[Tuple[str, str, Optional[str]], Tuple[float, str]]" = OrderedDict()
+        # bumped by every invalidation, a call that raced one doesn't store its result
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def working_dir(args: Dict[str, Any]) -> Optional[str]:
+        working_dir = args.get("working_dir")
+        return os.path.normpath(working_dir) if working_dir else None
+
+    def key(self, tool_name: str, args: Dict[str, Any]) -> Tuple[str, str, Optional[str]]:
+        canonical_args = json.dumps({name: value for name, value in args.items() if name != "working_dir"},
+                                    sort_keys=True, default=str)
+        return tool_name, canonical_args, self.working_dir(args)
+
+    def is_cacheable(self, tool_name: str, args: Dict[str, Any]) -> bool:
+        predicate = self.idempotent.get(tool_name)
+        return predicate is not None and predicate(args)
+
+    def is_readonly(self, tool_name: str, args: Dict[str, Any]) -> bool:
+        predicate = self.readonly.get(tool_name)
+        return predicate is not None and predicate(args)
+
+    def get(self, tool_name: str, args: Dict[str, Any]) -> Optional[str]:
+        key = self.key(tool_name, args)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, tool_name: str, args: Dict[str, Any], result: str, generation: int):
+        if generation != self.generation:
+            return
+        key = self.key(tool_name, args)
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, args: Dict[str, Any]):
+        """Drop the entries a state-changing call in args' working_dir may have affected"""
+        self.generation += 1
+        self.invalidations += 1
+        working_dir = self.working_dir(args)
+        if working_dir is None:
+            self.entries.clear()
+            return
+        for key in list(self.entries):
+            cached_dir = key[2]
+            if cached_dir is None or cached_dir == working_dir \
+                    or cached_dir.startswith(working_dir.rstrip(os.sep) + os.sep) \
+                    or working_dir.startswith(cached_dir.rstrip(os.sep) + os.sep):
+                del self.entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.generation += 1
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
 
 
 class MCPGatewayTools:
     """
     Simple MCP Gateway tool access
     Reference https://github.com/oliverye7/mcp-gateway for details on how to use the MCP Gateway.
+
+    Requests share one pooled, keep-alive httpx client. Use `async with MCPGatewayTools() as tools:`
+    or call `aclose()` when done to release the pooled connections.
     """
 
-    def __init__(self, gateway_url: str = "http://localhost:8080"):
+    DEFAULT_TIMEOUTS = {
+        "create_session": 10.0,
+        "search_tools": 30.0,
+        "execute_tool": 60.0,
+        "list_tools": 10.0,
+    }
+
+    def __init__(self, gateway_url: str = "http://localhost:8080",
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 http2: bool = False,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 client: Optional["httpx.AsyncClient"] = None,
+                 search_cache: Optional[ToolSearchCache] = SHARED_TOOL_SEARCH_CACHE,
+                 result_cache: Optional[ToolResultCache] = None):
         self.gateway_url = gateway_url
         self.session_id = None
+        self.timeouts = {**self.DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.limits = {"max_connections": max_connections,
+                       "max_keepalive_connections": max_keepalive_connections,
+                       "keepalive_expiry": keepalive_expiry}
+        self.http2 = http2
+        # a client passed in is shared (e.g. across sessions) and is not closed by aclose()
+        self._client = client
+        self._owns_client = client is None
+        # pass search_cache=None to always hit the gateway
+        self.search_cache = search_cache
+        # opt-in, and per session: tool results depend on the session's files
+        self.result_cache = result_cache
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        """Pooled client, created (and httpx imported) on first use"""
+        if self._client is None or self._client.is_closed:
+            import httpx
+            self._client = httpx.AsyncClient(limits=httpx.Limits(**self.limits), http2=self.http2)
+            self._owns_client = True
+        return self._client
+
+    async def aclose(self):
+        """Close the pooled client if this instance owns it"""
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
 
     async def create_session(self):
         """Create gateway session"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{self.gateway_url}/sessions/create")
-            result = response.json()
-            if result.get("success"):
-                self.session_id = result["session_id"]
-                return f"Created gateway session: {self.session_id}"
-            else:
-                return f"Failed to create session: {result}"
+        response = await self.client.post(f"{self.gateway_url}/sessions/create",
+                                          timeout=self.timeouts["create_session"])
+        result = response.json()
+        if result.get("success"):
+            self.session_id = result["session_id"]
+            return f"Created gateway session: {self.session_id}"
+        else:
+            return f"Failed to create session: {result}"
 
     async def search_tools(self, query: str) -> str:
         """Search for tools"""
         if not self.session_id:
             return "No gateway session - call create_session first"
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            headers = {"X-Session-ID": self.session_id}
-            response = await client.post(
-                f"{self.gateway_url}/mcp/search",
-                json={"query": query},
-                headers=headers
-            )
-            result = response.json()
+        if self.search_cache is not None:
+            cached_tools = self.search_cache.get(self.gateway_url, query)
+            if cached_tools is not None:
+                return cached_tools or f"No tools found for query: {query}"
 
-            if "result" in result:
-                if isinstance(result["result"], list):
-                    tools = result["result"]
-                else:
-                    tools = []
-
-                if tools:
-                    # Return the full tool specifications as JSON string
-                    # The gateway returns complete tool specs with descriptions and input schemas
-                    return json.dumps(tools)
-                else:
-                    return f"No tools found for query: {query}"
+        headers = {"X-Session-ID": self.session_id}
+        response = await self.client.post(
+            f"{self.gateway_url}/mcp/search",
+            json={"query": query},
+            headers=headers,
+            timeout=self.timeouts["search_tools"]
+        )
+        result = response.json()
+
+        if "result" in result:
+            if isinstance(result["result"], list):
+                tools = result["result"]
+            else:
+                tools = []
+
+            # The gateway returns complete tool specs with descriptions and input schemas
+            tools_json = json.dumps(tools) if tools else ""
+            if self.search_cache is not None:
+                # empty results are cached too, the message is rebuilt for each query
+                self.search_cache.put(self.gateway_url, query, tools_json)
+
+            if tools:
+                # Return the full tool specifications as JSON string
+                return tools_json
             else:
-                return f"Search failed: {result}"
+                return f"No tools found for query: {query}"
+        else:
+            return f"Search failed: {result}"
 
     async def execute_tool(self, tool_name: str, **args) -> str:
-        """Execute a tool"""
+        """Execute a tool, answering idempotent calls from the result cache when there is one"""
         if not self.session_id:
             return "No gateway session - call create_session first"
 
-        async with httpx.AsyncClient() as client:
+        cache = self.result_cache
+        cacheable = cache is not None and cache.is_cacheable(tool_name, args)
+        invalidates = cache is not None and not cacheable and not cache.is_readonly(tool_name, args)
+        if cacheable:
+            cached = cache.get(tool_name, args)
+            if cached is not None:
+                return cached
+            generation = cache.generation
+        elif invalidates:
+            # reads running alongside this call must not store what they saw
+            cache.generation += 1
+
+        try:
             headers = {"X-Session-ID": self.session_id}
-            response = await client.post(
+            response = await self.client.post(
                 f"{self.gateway_url}/mcp/execute",
                 json={"tool_name": tool_name, "args": args},
                 headers=headers,
-                timeout=60.0
+                timeout=self.timeouts["execute_tool"]
             )
             result = response.json()
+        finally:
+            if invalidates:
+                cache.invalidate(args)
 
-            if "result" in result:
-                if isinstance(result["result"], str):
-                    try:
-                        parsed = json.loads(result["result"])
-                        return str(parsed.get("content", parsed))
-                    except json.JSONDecodeError:
-                        return result["result"]
-                else:
-                    return str(result["result"])
+        if "result" in result:
+            if isinstance(result["result"], str):
+                try:
+                    parsed = json.loads(result["result"])
+                    output = str(parsed.get("content", parsed))
+                except json.JSONDecodeError:
+                    output = result["result"]
             else:
-                return f"Tool execution failed: {result}"
+                output = str(result["result"])
+        else:
+            return f"Tool execution failed: {result}"
+
+        if cacheable:
+            cache.put(tool_name, args, output, generation)
+        return output
 
     async def list_tools(self) -> str:
         """List all available tools"""
         if not self.session_id:
             return "No gateway session - call create_session first"
 
-        async with httpx.AsyncClient() as client:
-            headers = {"X-Session-ID": self.session_id}
-            response = await client.get(
-                f"{self.gateway_url}/mcp/tools",
-                headers=headers
-            )
-            result = response.json()
-            tools = result.get("tools", [])
+        headers = {"X-Session-ID": self.session_id}
+        response = await self.client.get(
+            f"{self.gateway_url}/mcp/tools",
+            headers=headers,
+            timeout=self.timeouts["list_tools"]
+        )
+        result = response.json()
+        tools = result.get("tools", [])
 
-            if tools:
-                tool_list = []
-                for tool in tools:
-                    name = tool.get("name", "Unknown")
-                    desc = tool.get("description", "No description")
-                    tool_list.append(f"- {name}: {desc}")
-                return f"Available tools ({len(tools)}):\n" + "\n".join(tool_list)
-            else:
-                return "No tools available"
+        if tools:
+            tool_list = []
+            for tool in tools:
+                name = tool.get("name", "Unknown")
+                desc = tool.get("description", "No description")
+                tool_list.append(f"- {name}: {desc}")
+            return f"Available tools ({len(tools)}):\n" + "\n".join(tool_list)
+        else:
+            return "No tools available"
@@ -1,80 +1,463 @@
-from typing import Dict, Any, Optional, List
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Any, Optional, List, Tuple, Union
+import asyncio
+import hashlib
 import os
-from google import genai
-from google.genai import types
-import openai
+import time
+from models import ActionType
+
+_env_loaded = False
+
+
+def load_env():
+    """Load API keys from a .env file once, dotenv is only imported when a provider needs a key"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def prefix_hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class PromptCacheStats:
+    """Cached vs uncached input tokens per call, as reported by the provider"""
+
+    def __init__(self, max_calls: int = 1000):
+        # the newest calls as {"input_tokens", "cached_input_tokens", "output_tokens"}
+        self.calls: Deque[Dict[str, int]] = deque(maxlen=max_calls)
+        self.call_count = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, input_tokens: Optional[int], cached_input_tokens: Optional[int], output_tokens: Optional[int]):
+        call = {"input_tokens": input_tokens or 0, "cached_input_tokens": cached_input_tokens or 0,
+                "output_tokens": output_tokens or 0}
+        self.calls.append(call)
+        self.call_count += 1
+        self.input_tokens += call["input_tokens"]
+        self.cached_input_tokens += call["cached_input_tokens"]
+        self.output_tokens += call["output_tokens"]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "calls": self.call_count,
+            "input_tokens": self.input_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "uncached_input_tokens": self.input_tokens - self.cached_input_tokens,
+            "cached_fraction": self.cached_input_tokens / self.input_tokens if self.input_tokens else 0.0,
+            "output_tokens": self.output_tokens,
+        }
 
 
 class GeminiProvider:
-    """Gemini LLM provider for chat completions"""
+    """
+    Gemini LLM provider for chat completions
+    A system prompt large enough to be cached explicitly is uploaded once as a cached content and
+    later calls reference its handle instead of resending it. Smaller ones, and the context that
+    follows, rely on Gemini's implicit prefix caching, which the stable system prompt + append-only
+    context ordering keeps eligible.
+    """
+
+    # explicit caches below this many input tokens are rejected by the API
+    MIN_CACHED_CONTENT_TOKENS = 2048
+    CACHED_CONTENT_TTL = 600.0
+    # a failed cache creation (rate limit, server error, timeout) is retried after this many seconds
+    CACHED_CONTENT_RETRY_AFTER = 60.0
 
-    def __init__(self, model_name: str = "gemini-2.5-pro", api_key: Optional[str] = None):
+    def __init__(self, model_name: str = "gemini-2.5-pro", api_key: Optional[str] = None,
+                 max_concurrent_requests: int = 8, cache_system_prompts: bool = True):
         self.model_name = model_name
+        if not api_key:
+            load_env()
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
 
         if not self.api_key:
             raise ValueError(
                 "Gemini API key is required. Set GEMINI_API_KEY environment variable.")
 
+        # the SDK is only imported once this provider is selected
+        from google import genai
+        from google.genai import types
+        self.types = types
         self.client = genai.Client(api_key=self.api_key)
         self.generation_config = None
+        # bounds in-flight requests so background memory updates can't starve the core loop
+        self.request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.cache_system_prompts = cache_system_prompts
+        # system prompt hash -> (cached content name, expiry), or (None, retry time) after a failed creation.
+        # None for prompts too small to ever be cached
+        self.cached_contents: Dict[str, Optional[Tuple[Optional[str], float]]] = {}
+        self.cache_lock = asyncio.Lock()
+        self.prompt_cache_stats = PromptCacheStats()
+        # CoreAgent replaces this with its own log for a provider it created
+        self.log: Callable[[str], None] = print
+
+    async def get_cached_content(self, system_prompt: str) -> Optional[str]:
+        """The cached content handle holding this system prompt, created on first use"""
+        key = prefix_hash(self.model_name, system_prompt)
+        entry = self.cached_contents.get(key, ())
+        if entry is None or (entry and entry[0] is None and entry[1] > time.monotonic()):
+            return None
+        async with self.cache_lock:
+            entry = self.cached_contents.get(key)
+            if entry is not None:
+                name, expiry = entry
+                if name is None and expiry > time.monotonic():
+                    return None
+                # renewed a minute early, so a handle never expires between lookup and use
+                if name is not None and expiry > time.monotonic() + 60:
+                    return name
+            # ~4 characters per token
+            if len(system_prompt) / 4 < self.MIN_CACHED_CONTENT_TOKENS:
+                self.cached_contents[key] = None
+                return None
+            try:
+                cached_content = await self.client.aio.caches.create(
+                    model=self.model_name,
+                    config=self.types.CreateCachedContentConfig(
+                        system_instruction=system_prompt,
+                        ttl=f"{int(self.CACHED_CONTENT_TTL)}s"))
+            except Exception as e:
+                self.log(f"Not caching system prompt for {self.model_name} for the next "
+                         f"{self.CACHED_CONTENT_RETRY_AFTER:.0f}s: {type(e).__name__}: {e}")
+                self.cached_contents[key] = (None, time.monotonic() + self.CACHED_CONTENT_RETRY_AFTER)
+                return None
+            self.cached_contents[key] = (cached_content.name, time.monotonic() + self.CACHED_CONTENT_TTL)
+            return cached_content.name
+
+    async def build_config(self, system_prompt: Optional[str]):
+        if not system_prompt:
+            return None
+        cached_content = await self.get_cached_content(system_prompt) if self.cache_system_prompts else None
+        if cached_content:
+            return self.types.GenerateContentConfig(cached_content=cached_content)
+        return self.types.GenerateContentConfig(system_instruction=system_prompt)
+
+    def record_usage(self, usage_metadata):
+        if usage_metadata is not None:
+            self.prompt_cache_stats.record(usage_metadata.prompt_token_count,
+                                           usage_metadata.cached_content_token_count,
+                                           usage_metadata.candidates_token_count)
 
     async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
         """Generate a response from the model"""
-        config = None
-        if system_prompt:
-            config = types.GenerateContentConfig(
-                system_instruction=system_prompt)
+        config = await self.build_config(system_prompt)
 
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=context,
-            config=config
-        )
+        async with self.request_semaphore:
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=context,
+                config=config
+            )
 
+        self.record_usage(response.usage_metadata)
         return response.text
 
+    async def generate_stream(self, context: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream the response from the model as text chunks"""
+        config = await self.build_config(system_prompt)
+
+        async with self.request_semaphore:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.model_name,
+                contents=context,
+                config=config
+            )
+            usage_metadata = None
+            async for chunk in stream:
+                # every chunk carries the usage so far, the last one the totals
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                if chunk.text:
+                    yield chunk.text
+            self.record_usage(usage_metadata)
+
     def set_generation_config(self, **kwargs):
         """Update generation configuration"""
         if kwargs:
-            self.generation_config = types.GenerateContentConfig(**kwargs)
+            self.generation_config = self.types.GenerateContentConfig(**kwargs)
         else:
             self.generation_config = None
 
 
 class OpenAIProvider:
-    """OpenAI LLM provider for chat completions"""
+    """
+    OpenAI LLM provider for chat completions
+    OpenAI caches prompt prefixes automatically. Requests put the stable system prompt first and
+    the append-only context after it, and carry a prompt_cache_key per system prompt so calls
+    sharing that prefix are routed to the same cache.
+    """
 
     # gpt-5-2025-08-07
     # gpt-5-mini-2025-08-07
-    def __init__(self, model_name: str = "gpt-5-nano-2025-08-07", api_key: Optional[str] = None):
+    def __init__(self, model_name: str = "gpt-5-nano-2025-08-07", api_key: Optional[str] = None,
+                 max_concurrent_requests: int = 8, prompt_cache_key_prefix: Optional[str] = "dude"):
         self.model_name = model_name
+        if not api_key:
+            load_env()
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
 
         if not self.api_key:
             raise ValueError(
                 "OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
 
-        self.client = openai.OpenAI(api_key=self.api_key)
+        import openai
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
         self.generation_config = {}
+        self.request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # None sends no prompt_cache_key
+        self.prompt_cache_key_prefix = prompt_cache_key_prefix
+        self.prompt_cache_stats = PromptCacheStats()
 
-    async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
-        """Generate a response from the model"""
+    def build_messages(self, context: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
         messages = []
 
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
 
         messages.append({"role": "user", "content": context})
+        return messages
+
+    def build_request_options(self, system_prompt: Optional[str]) -> Dict[str, Any]:
+        options = dict(self.generation_config)
+        if self.prompt_cache_key_prefix is not None:
+            # sent through extra_body so SDK versions without the parameter accept it
+            options["extra_body"] = {
+                **options.get("extra_body", {}),
+                "prompt_cache_key": f"{self.prompt_cache_key_prefix}-{prefix_hash(self.model_name, system_prompt or '')}",
+            }
+        return options
+
+    def record_usage(self, usage):
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.prompt_cache_stats.record(usage.prompt_tokens, getattr(details, "cached_tokens", None),
+                                           usage.completion_tokens)
 
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            **self.generation_config
-        )
+    async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
+        """Generate a response from the model"""
+        messages = self.build_messages(context, system_prompt)
 
+        async with self.request_semaphore:
+            response = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                **self.build_request_options(system_prompt)
+            )
+
+        self.record_usage(response.usage)
         return response.choices[0].message.content
 
+    async def generate_stream(self, context: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream the response from the model as text chunks"""
+        messages = self.build_messages(context, system_prompt)
+
+        async with self.request_semaphore:
+            stream = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self.build_request_options(system_prompt)
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                # the usage comes in a last chunk without choices
+                if getattr(chunk, "usage", None):
+                    self.record_usage(chunk.usage)
+
     def set_generation_config(self, **kwargs):
         """Update generation configuration"""
         self.generation_config = kwargs
+
+
+# provider name -> factory taking the provider's keyword arguments (model_name, api_key, ...)
+PROVIDERS: Dict[str, Callable[..., Any]] = {
+    "openai": OpenAIProvider,
+    "gemini": GeminiProvider,
+}
+DEFAULT_PROVIDER = "openai"
+
+
+def register_provider(name: str, factory: Callable[..., Any]):
+    PROVIDERS[name] = factory
+
+
+def create_provider(name: Optional[str] = None, **kwargs) -> Any:
+    """Construct the provider registered under `name`, importing only that provider's SDK"""
+    if name is None:
+        load_env()
+        name = os.getenv("AGENT_LLM_PROVIDER") or DEFAULT_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}. Registered providers: {', '.join(sorted(PROVIDERS))}")
+    return PROVIDERS[name](**kwargs)
+
+
+class FallbackProvider:
+    """
+    Tries a chain of providers in order, moving on to the next one when a call raises or takes
+    longer than `timeout` seconds. A stream only falls back before its first chunk, after that
+    the chunks already yielded can't be taken back.
+    """
+
+    def __init__(self, providers: List[Any], timeout: Optional[float] = None,
+                 log: Optional[Callable[[str], None]] = None):
+        if not providers:
+            raise ValueError("FallbackProvider needs at least one provider")
+        self.providers = providers
+        self.timeout = timeout
+        # failover notices, silent unless the owner (e.g. a verbose CoreAgent) passes its logger
+        self.log: Callable[[str], None] = log or (lambda message: None)
+        # calls answered by each provider of the chain, and calls that failed over from it
+        self.answered = [0] * len(providers)
+        self.failed = [0] * len(providers)
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.providers[0], "model_name", "")
+
+    def on_failure(self, index: int, error: BaseException):
+        self.failed[index] += 1
+        next_provider = self.providers[index + 1] if index + 1 < len(self.providers) else None
+        target = f"falling back to {getattr(next_provider, 'model_name', next_provider)}" if next_provider \
+            else "no fallback left"
+        reason = f"timed out after {self.timeout}s" if isinstance(error, asyncio.TimeoutError) \
+            else f"failed ({type(error).__name__}: {error})"
+        self.log(f"LLM call to {getattr(self.providers[index], 'model_name', self.providers[index])} {reason}, {target}")
+
+    async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
+        for index, provider in enumerate(self.providers):
+            try:
+                response = await asyncio.wait_for(provider.generate(context, system_prompt), self.timeout)
+            except Exception as e:
+                self.on_failure(index, e)
+                if index + 1 == len(self.providers):
+                    raise
+                continue
+            self.answered[index] += 1
+            return response
+
+    async def generate_stream(self, context: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        for index, provider in enumerate(self.providers):
+            stream = provider.generate_stream(context, system_prompt)
+            try:
+                first_chunk = await asyncio.wait_for(stream.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                self.answered[index] += 1
+                return
+            except Exception as e:
+                await stream.aclose()
+                self.on_failure(index, e)
+                if index + 1 == len(self.providers):
+                    raise
+                continue
+            self.answered[index] += 1
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+            return
+
+    def set_generation_config(self, **kwargs):
+        for provider in self.providers:
+            provider.set_generation_config(**kwargs)
+
+
+class ProviderPool:
+    """
+    Providers created once per (provider name, model name) and shared by every ModelRouter using
+    the pool, so all sessions of a process calling one model share its client and request semaphore.
+    `factory(name, model_name)` builds a provider, by default create_provider with `provider_kwargs`;
+    pass one to wrap each provider, e.g. in a response cache.
+    """
+
+    def __init__(self, factory: Optional[Callable[[str, str], Any]] = None, **provider_kwargs):
+        self.factory = factory or (lambda name, model_name: create_provider(name, model_name=model_name,
+                                                                            **provider_kwargs))
+        self.providers: Dict[Tuple[str, str], Any] = {}
+
+    def get(self, name: str, model_name: str) -> Any:
+        key = (name, model_name)
+        if key not in self.providers:
+            self.providers[key] = self.factory(name, model_name)
+        return self.providers[key]
+
+
+# routers built without a pool share this one
+PROVIDER_POOL = ProviderPool()
+
+# a provider instance, a (provider name, model name) pair or "provider:model"
+ProviderSpec = Union[Any, Tuple[str, str], str]
+
+
+class ModelRouter:
+    """
+    Routes each ActionType to its own provider/model chain
+    Every route falls back to the default provider last, and actions without a route use the
+    default provider directly. Providers named by (provider, model) come from a ProviderPool
+    (PROVIDER_POOL unless given), so routes and routers share them and their request semaphore.
+    """
+
+    NANO = ("openai", "gpt-5-nano-2025-08-07")
+    MINI = ("openai", "gpt-5-mini-2025-08-07")
+    FULL = ("openai", "gpt-5-2025-08-07")
+    # bookkeeping on the cheapest model, decisions on the strongest, each falling back a tier
+    PRESETS: Dict[str, Dict[ActionType, List[ProviderSpec]]] = {
+        "openai-tiered": {
+            ActionType.AGENT_PLANNING: [FULL, MINI],
+            ActionType.PROCESS_USER_INPUT: [MINI, NANO],
+            ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT: [MINI, NANO],
+            ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT: [MINI, NANO],
+            ActionType.AGENT_RESPONSE: [MINI, NANO],
+            ActionType.STEP_SUMMARY: [NANO],
+            ActionType.UPDATE_TODO_LIST: [NANO],
+            ActionType.UPDATE_CONVERSATION_STATE: [NANO],
+            ActionType.UPDATE_CONVERSATION_COMPRESSION: [NANO],
+            ActionType.UPDATE_BRANCH_BACKTRACK_SUMMARY: [NANO],
+        },
+    }
+
+    def __init__(self, default_provider: Any,
+                 routes: Optional[Union[str, Dict[Union[ActionType, str], List[ProviderSpec]]]] = None,
+                 timeout: Optional[float] = None, pool: Optional[ProviderPool] = None,
+                 log: Optional[Callable[[str], None]] = None):
+        self.default_provider = default_provider
+        self.timeout = timeout
+        self.pool = pool or PROVIDER_POOL
+        if isinstance(routes, str):
+            if routes not in self.PRESETS:
+                raise ValueError(f"Unknown model routes preset: {routes}. Presets: {', '.join(self.PRESETS)}")
+            routes = self.PRESETS[routes]
+        # the pool's providers this router's routes use
+        self.providers: Dict[Tuple[str, str], Any] = {}
+        default_model = getattr(default_provider, "model_name", None)
+        self.routes: Dict[ActionType, FallbackProvider] = {}
+        for action_type, chain in (routes or {}).items():
+            providers = [self.resolve(spec) for spec in chain]
+            if not any(provider is default_provider or getattr(provider, "model_name", None) == default_model
+                       for provider in providers):
+                providers.append(default_provider)
+            self.routes[ActionType(action_type)] = FallbackProvider(providers, timeout, log)
+
+    def resolve(self, spec: ProviderSpec) -> Any:
+        if isinstance(spec, str):
+            if ":" not in spec:
+                raise ValueError(f"Provider spec must be 'provider:model', got {spec}")
+            spec = tuple(spec.split(":", 1))
+        if isinstance(spec, tuple):
+            self.providers[spec] = self.pool.get(*spec)
+            return self.providers[spec]
+        return spec
+
+    def provider_for(self, action_type: ActionType) -> Any:
+        return self.routes.get(action_type, self.default_provider)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Per routed action type, calls answered and failed over per model of its chain"""
+        return {action_type.value: {getattr(provider, "model_name", str(provider)):
+                                    {"answered": route.answered[i], "failed": route.failed[i]}
+                                    for i, provider in enumerate(route.providers)}
+                for action_type, route in self.routes.items()}
@@ -1,9 +1,18 @@
-from dataclasses import asdict
+from dataclasses import asdict, replace
 import json
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 import uuid
 from models import Action, ActionNode, ActionType, NodeMemory, NodeMemoryEntry, NodeMemoryType, TodoMemory, ConversationStateMemory, BranchBacktrackSummaryMemory, ConversationCompressionMemory
+from memory_store import DAGMemoryStore, action_from_dict, action_to_dict, node_from_dict, node_memory_entry_from_dict, node_memory_entry_to_dict, node_to_dict
+
+# rough average for English text and JSON across the GPT and Gemini tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate, no tokenizer round trip"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
 
 
 class BaseMemory:
@@ -28,18 +37,147 @@ class BaseMemory:
         """Helper function to format an action for display"""
         timestamp = action.timestamp.strftime("%H:%M:%S")
         action_name = action.action_type.value.replace('_', ' ').upper()
-        full_action = json.dumps(asdict(action), indent=2, default=str)
+        fields = asdict(action)
+        # DAGMemory keeps empty dicts as None, render them as {} like LinearMemory does
+        fields["metadata"] = fields["metadata"] or {}
+        fields["action_parameters"] = fields["action_parameters"] or {}
+        full_action = json.dumps(fields, indent=2, default=str)
         return f"[{timestamp}] {action_name}: \n {full_action}"
 
 
+class RenderedPath:
+    """
+    Rendered root-to-node path kept as a list of per-node chunks (a simple rope)
+    The joined text is only built when asked for, the budgeted context reads the chunks directly
+    """
+
+    def __init__(self):
+        self.node_ids: List[uuid.UUID] = []
+        self.positions: Dict[uuid.UUID, int] = {}
+        self.chunks: List[str] = []
+        # positions of the step boundary (STEP_SUMMARY) nodes on the path, in order
+        self.step_boundaries: List[int] = []
+        self._text: Optional[str] = ""
+
+    def tip(self) -> Optional[uuid.UUID]:
+        return self.node_ids[-1] if self.node_ids else None
+
+    def append(self, node_id: uuid.UUID, chunk: str, step_boundary: bool = False):
+        if step_boundary:
+            self.step_boundaries.append(len(self.node_ids))
+        self.positions[node_id] = len(self.node_ids)
+        self.node_ids.append(node_id)
+        self.chunks.append(chunk)
+        self._text = None
+
+    def truncate(self, length: int):
+        """Keep only the first `length` nodes of the path"""
+        if length >= len(self.node_ids):
+            return
+        for node_id in self.node_ids[length:]:
+            del self.positions[node_id]
+        del self.node_ids[length:]
+        del self.chunks[length:]
+        while self.step_boundaries and self.step_boundaries[-1] >= length:
+            self.step_boundaries.pop()
+        self._text = None
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "\n".join(self.chunks)
+        return self._text
+
+    def clear(self):
+        self.truncate(0)
+        self._text = ""
+
+
 class DAGMemory(BaseMemory):
     # THIS DAG SHOULD NEVER BE PRUNED
     """DAG based memory generated serially, but allows for branching and backtracking"""
 
-    def __init__(self):
+    def __init__(self, store: Optional[DAGMemoryStore] = None, node_memory_history_limit: Optional[int] = None):
         self.nodes: Dict[uuid.UUID, ActionNode] = {}
         self.current_node_id: Optional[uuid.UUID] = None
         self.root_node_id: Optional[uuid.UUID] = None
+        # format_action output per node, and the rendered path from the root to the current node.
+        # Only update_node invalidates them: a node's action must not be mutated in place, replace it through update_node
+        self.rendered_actions: Dict[uuid.UUID, str] = {}
+        self.rendered_path = RenderedPath()
+        # nodes that have had a conversation compression set, searched for the latest one on a path
+        self.compression_node_ids = set()
+        self.reset_indexes()
+        # when set, a node's memory history is compacted to its newest entries as it grows past twice this
+        self.node_memory_history_limit = node_memory_history_limit
+        # optional append-only log, every mutation is recorded once applied, before the method returns
+        self.store = store
+        # called with the STEP_SUMMARY node whenever add_action reaches a step boundary
+        self.step_listeners: List[Callable[[ActionNode], None]] = []
+
+    @classmethod
+    def restore(cls, store: DAGMemoryStore, node_memory_history_limit: Optional[int] = None) -> "DAGMemory":
+        """Rebuild a DAGMemory from its store's latest snapshot and log, and keep logging to it"""
+        # replay applies the logged compactions, the limit only applies to new entries
+        memory = cls.replay(store, node_memory_history_limit=node_memory_history_limit)
+        memory.store = store
+        return memory
+
+    @classmethod
+    def replay(cls, store: DAGMemoryStore, before: Optional[int] = None,
+               node_memory_history_limit: Optional[int] = None) -> "DAGMemory":
+        """A detached DAGMemory replayed from the store's log, up to the segment `before` if given"""
+        memory = cls(node_memory_history_limit=node_memory_history_limit)
+        uuids = {}
+        snapshot = store.read_snapshot(before)
+        if snapshot:
+            for node_data in snapshot["nodes"]:
+                memory.apply_record({"op": "add_node", "node": node_data}, uuids)
+            memory.current_node_id = uuid.UUID(snapshot["current_node_id"]) if snapshot["current_node_id"] else None
+            memory.root_node_id = uuid.UUID(snapshot["root_node_id"]) if snapshot["root_node_id"] else None
+        for record in store.read_records(before):
+            memory.apply_record(record, uuids)
+        return memory
+
+    @classmethod
+    def replay_for_snapshot(cls, store: DAGMemoryStore, before: int):
+        memory = cls.replay(store, before)
+        return list(memory.nodes.values()), memory.current_node_id, memory.root_node_id
+
+    def log_mutation(self, record: dict):
+        if self.store is None:
+            return
+        self.store.append(record)
+        if self.store.should_snapshot():
+            # built from the log in a background thread, this memory keeps changing meanwhile
+            self.store.start_snapshot(type(self).replay_for_snapshot)
+
+    def apply_record(self, record: dict, uuids: Optional[Dict[str, uuid.UUID]] = None):
+        """Replay one logged mutation"""
+        op = record["op"]
+        if op == "add_node":
+            node = node_from_dict(record["node"], uuids)
+            self.insert_node(node)
+            if node.action_node_memory and node.action_node_memory.conversation_compression:
+                self.compression_node_ids.add(node.node_id)
+        elif op == "update_action":
+            node_id = uuid.UUID(record["node_id"])
+            self.reindex_action_type(node_id, action_from_dict(record["action"]))
+            self.nodes[node_id].action = action_from_dict(record["action"])
+            self.invalidate_rendered_action(node_id)
+        elif op == "add_node_memory_entry":
+            node_id = uuid.UUID(record["node_id"])
+            entry = node_memory_entry_from_dict(record["entry"])
+            self.nodes[node_id].action_node_memory.append(entry)
+            if entry.conversation_compression:
+                self.compression_node_ids.add(node_id)
+        elif op == "compact_node_memory":
+            self.nodes[uuid.UUID(record["node_id"])].action_node_memory.compact(record["keep"])
+        elif op == "set_current_node":
+            self.current_node_id = uuid.UUID(record["node_id"])
+        elif op == "clear":
+            self.clear()
+        else:
+            raise ValueError(f"Unknown memory log record: {op}")
 
     async def add_action(self,
                          content: str, action_type: ActionType = ActionType.DEFAULT,
@@ -47,7 +185,7 @@ class DAGMemory(BaseMemory):
                          metadata: dict = None, action_parameters: dict = None,
                          tool_search_query: str = None,
                          parent_id: Optional[uuid.UUID] = None,
-                         node_memory: Optional[NodeMemory] = None
+                         node_memory: Optional[NodeMemoryEntry] = None
                          ) -> Action:
         """Add an action to memory DAG."""
         if parent_id is None:
@@ -76,8 +214,9 @@ class DAGMemory(BaseMemory):
             tool_name=tool_name,
             tool_args=tool_args,
             tool_result=tool_result,
-            metadata=metadata or {},
-            action_parameters=action_parameters or {},
+            # empty dicts are kept as None, two of them per node are a sizeable share of a small node
+            metadata=metadata or None,
+            action_parameters=action_parameters or None,
             tool_search_query=tool_search_query
         )
 
@@ -93,35 +232,145 @@ class DAGMemory(BaseMemory):
                 step_boundary=True
             )
         else:
+            action_node_memory = NodeMemory()
+            if node_memory:
+                action_node_memory.append(node_memory)
             node = ActionNode(
                 action=action,
                 parent_id=parent_id,
                 children_ids=[],
                 node_id=uuid.uuid4(),
-                action_node_memory=NodeMemory(
-                    node_memory=[node_memory] if node_memory else []),
+                action_node_memory=action_node_memory,
                 step_boundary=False,
                 step_summary=None
             )
 
+        self.insert_node(node)
+        self.log_mutation({"op": "add_node", "node": node_to_dict(node)})
+        if node.step_boundary:
+            for listener in list(self.step_listeners):
+                listener(node)
+        return action
+
+    def add_step_listener(self, listener: Callable[[ActionNode], None]):
+        self.step_listeners.append(listener)
+
+    def remove_step_listener(self, listener: Callable[[ActionNode], None]):
+        if listener in self.step_listeners:
+            self.step_listeners.remove(listener)
+
+    def insert_node(self, node: ActionNode):
+        """Link a new node under its parent, make it current and index it"""
         self.nodes[node.node_id] = node
         if self.root_node_id is None:
             self.root_node_id = node.node_id
 
         # implements branching
-        if parent_id and parent_id in self.nodes:
-            self.nodes[parent_id].children_ids.append(node.node_id)
+        parent = self.nodes.get(node.parent_id) if node.parent_id else None
+        if parent is not None:
+            parent.children_ids.append(node.node_id)
+            self.leaf_node_ids.pop(parent.node_id, None)
+            if len(parent.children_ids) == 2:
+                self.branch_node_ids[parent.node_id] = None
+        if parent is not None:
+            node.depth = parent.depth + 1
+            # skew-binary skip pointer: jump twice as far when the parent's two jumps are the same length
+            jump = self.nodes[parent.jump_id]
+            jump_jump = self.nodes[jump.jump_id]
+            if parent.depth - jump.depth == jump.depth - jump_jump.depth:
+                node.jump_id = jump_jump.node_id
+            else:
+                node.jump_id = parent.node_id
+        else:
+            node.depth = 0
+            node.jump_id = node.node_id
+        self.leaf_node_ids[node.node_id] = None
+        self.node_ids_by_action_type.setdefault(node.action.action_type, {})[node.node_id] = None
+        if node.step_boundary:
+            self.step_node_ids.append(node.node_id)
 
         self.current_node_id = node.node_id
-        return action
+
+    def reset_indexes(self):
+        """
+        Secondary indexes kept up to date as nodes are inserted, so step, leaf and branch queries
+        don't scan every node. Dicts with None values are used as insertion-ordered sets.
+        Depth and the skip pointer (Myers' jump pointers, ancestor and LCA queries take O(log depth)
+        hops) are stored on the nodes themselves.
+        Nodes are never removed and moving the current node doesn't change the DAG, so insert_node
+        (and update_node for action type changes) are the only places that maintain them.
+        """
+        self.step_node_ids: List[uuid.UUID] = []
+        self.leaf_node_ids: Dict[uuid.UUID, None] = {}
+        self.branch_node_ids: Dict[uuid.UUID, None] = {}
+        self.node_ids_by_action_type: Dict[ActionType, Dict[uuid.UUID, None]] = {}
+
+    def reindex_action_type(self, node_id: uuid.UUID, action: Action):
+        previous_type = self.nodes[node_id].action.action_type
+        if action.action_type != previous_type:
+            self.node_ids_by_action_type[previous_type].pop(node_id, None)
+            self.node_ids_by_action_type.setdefault(action.action_type, {})[node_id] = None
 
     def get_step_nodes(self) -> List[ActionNode]:
         """Get all step nodes in the action DAG"""
-        steps = []
-        for node in self.nodes.values():
-            if node.step_boundary:
-                steps.append(node)
-        return steps
+        return [self.nodes[node_id] for node_id in self.step_node_ids]
+
+    def get_node_ids_by_action_type(self, action_type: ActionType) -> List[uuid.UUID]:
+        """Get the ids of all nodes of an action type"""
+        return list(self.node_ids_by_action_type.get(action_type, ()))
+
+    def get_depth(self, node_id: uuid.UUID) -> int:
+        """Get the number of ancestors of a node"""
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        return self.nodes[node_id].depth
+
+    def get_ancestor_at_depth(self, node_id: uuid.UUID, depth: int) -> uuid.UUID:
+        """Get the ancestor of a node at a given depth (the root is at depth 0)"""
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        nodes = self.nodes
+        node = nodes[node_id]
+        if depth < 0 or depth > node.depth:
+            raise ValueError(f"Node {node_id} has no ancestor at depth {depth}")
+        while node.depth > depth:
+            jump = nodes[node.jump_id]
+            node = jump if jump.depth >= depth else nodes[node.parent_id]
+        return node.node_id
+
+    def get_ancestor(self, node_id: uuid.UUID, k: int) -> uuid.UUID:
+        """Get the k-th ancestor of a node (k=1 is its parent)"""
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        return self.get_ancestor_at_depth(node_id, self.nodes[node_id].depth - k)
+
+    def is_ancestor(self, ancestor_id: uuid.UUID, node_id: uuid.UUID) -> bool:
+        """Whether ancestor_id is node_id or one of its ancestors"""
+        if ancestor_id not in self.nodes or node_id not in self.nodes:
+            raise ValueError("Nodes not found")
+        depth = self.nodes[ancestor_id].depth
+        return depth <= self.nodes[node_id].depth and self.get_ancestor_at_depth(node_id, depth) == ancestor_id
+
+    def get_lowest_common_ancestor(self, first_node_id: uuid.UUID, second_node_id: uuid.UUID) -> Optional[uuid.UUID]:
+        """Get the deepest node both nodes descend from, i.e. the branch point between them"""
+        if first_node_id not in self.nodes or second_node_id not in self.nodes:
+            raise ValueError("Nodes not found")
+        depth = min(self.nodes[first_node_id].depth, self.nodes[second_node_id].depth)
+        first_node_id = self.get_ancestor_at_depth(first_node_id, depth)
+        second_node_id = self.get_ancestor_at_depth(second_node_id, depth)
+        # at equal depths the skip pointers have equal lengths, so both sides can jump together
+        while first_node_id != second_node_id:
+            if self.nodes[first_node_id].depth == 0:
+                # separate roots, e.g. nodes added after clear() under a stale parent
+                return None
+            first_jump = self.nodes[first_node_id].jump_id
+            second_jump = self.nodes[second_node_id].jump_id
+            if first_jump != second_jump:
+                first_node_id, second_node_id = first_jump, second_jump
+            else:
+                first_node_id = self.nodes[first_node_id].parent_id
+                second_node_id = self.nodes[second_node_id].parent_id
+        return first_node_id
 
     def get_current_action_node(self) -> ActionNode:
         """Get the current action node"""
@@ -145,72 +394,120 @@ class DAGMemory(BaseMemory):
         actions.reverse()
         return actions
 
-    def update_node(self, node_id: uuid.UUID, action: Action, node_memory: Optional[NodeMemory] = None) -> Action:
-        """Update a node in the action DAG"""
+    def update_node(self, node_id: uuid.UUID, action: Action, node_memory: Optional[NodeMemoryEntry] = None) -> Action:
+        """
+        Update a node in the action DAG
+        The only way to change a node's action: it is reindexed, logged and re-rendered here, an
+        action mutated in place keeps its stale rendering. Pass a new Action, not the node's own.
+        """
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
+        self.reindex_action_type(node_id, action)
         self.nodes[node_id].action = action
+        self.log_mutation({"op": "update_action", "node_id": str(node_id), "action": action_to_dict(action)})
         if node_memory:
-            self.nodes[node_id].action_node_memory.node_memory.append(
-                node_memory)
+            self.append_node_memory_entry(node_id, node_memory)
+        self.invalidate_rendered_action(node_id)
         return action
 
+    def append_node_memory_entry(self, node_id: uuid.UUID, node_memory_entry: NodeMemoryEntry):
+        action_node_memory = self.nodes[node_id].action_node_memory
+        if not action_node_memory:
+            raise ValueError(f"Node {node_id} has no action node memory")
+        action_node_memory.append(node_memory_entry)
+        self.log_mutation({"op": "add_node_memory_entry", "node_id": str(node_id),
+                           "entry": node_memory_entry_to_dict(node_memory_entry)})
+        if self.node_memory_history_limit is not None and \
+                action_node_memory.length > 2 * self.node_memory_history_limit:
+            self.compact_node_memory(node_id, self.node_memory_history_limit)
+
+    def compact_node_memory(self, node_id: uuid.UUID, keep: int):
+        """Drop all but the newest `keep` memory entries of a node, older ones are folded into one base entry"""
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        action_node_memory = self.nodes[node_id].action_node_memory
+        if not action_node_memory:
+            raise ValueError(f"Node {node_id} has no action node memory")
+        action_node_memory.compact(keep)
+        self.log_mutation({"op": "compact_node_memory", "node_id": str(node_id), "keep": keep})
+
+    def render_action(self, node_id: uuid.UUID) -> str:
+        """Get the formatted action for a node, formatting it only once"""
+        rendered = self.rendered_actions.get(node_id)
+        if rendered is None:
+            rendered = self.format_action(self.nodes[node_id].action)
+            self.rendered_actions[node_id] = rendered
+        return rendered
+
+    def invalidate_rendered_action(self, node_id: uuid.UUID):
+        """Drop the cached rendering of a node after its action changed"""
+        self.rendered_actions.pop(node_id, None)
+        position = self.rendered_path.positions.get(node_id)
+        if position is not None:
+            self.rendered_path.truncate(position)
+
+    def sync_rendered_path(self, node_id: uuid.UUID) -> RenderedPath:
+        """
+        Move the rendered path so it ends at node_id
+        Only the nodes below the deepest ancestor already on the path are rendered, so extending the
+        current branch formats one node and backtracking reuses the shared ancestor prefix
+        """
+        path = self.rendered_path
+        if path.tip() == node_id:
+            return path
+
+        missing = []
+        current_id = node_id
+        visited = set()
+        while current_id is not None and current_id not in path.positions:
+            if current_id in visited:
+                raise ValueError(f"Cycle detected in DAG traversal")
+            visited.add(current_id)
+            if current_id not in self.nodes:
+                raise ValueError(f"Parent node {current_id} not found")
+            missing.append(current_id)
+            current_id = self.nodes[current_id].parent_id
+
+        path.truncate(0 if current_id is None else path.positions[current_id] + 1)
+        for missing_id in reversed(missing):
+            path.append(missing_id, self.render_action(missing_id), self.nodes[missing_id].step_boundary)
+        return path
+
     def set_todo_list(self, node_id: uuid.UUID, todo_list: TodoMemory) -> bool:
         """Set the todo list for a given node"""
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
-        current_node_memory = self.nodes[node_id].action_node_memory
-        if not current_node_memory:
-            raise ValueError(f"Node {node_id} has no action node memory")
-        node_memory_entry = NodeMemoryEntry(
+        self.append_node_memory_entry(node_id, NodeMemoryEntry(
             updated_field=NodeMemoryType.TODO,
             timestamp=datetime.now(),
             todo=todo_list,
-            conversation_state=current_node_memory.node_memory[-1].conversation_state,
-            branch_backtrack_summary=current_node_memory.node_memory[-1].branch_backtrack_summary,
-        )
-        current_node_memory.node_memory.append(
-            node_memory_entry)
+        ))
         return True
 
     def set_conversation_compression(self, node_id: uuid.UUID, conversation_compression: ConversationCompressionMemory) -> bool:
         """Set the conversation compression for a given node"""
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
-        current_node_memory = self.nodes[node_id].action_node_memory
-        if not current_node_memory:
-            raise ValueError(f"Node {node_id} has no action node memory")
-        node_memory_entry = NodeMemoryEntry(
+        self.append_node_memory_entry(node_id, NodeMemoryEntry(
             updated_field=NodeMemoryType.CONVERSATION_COMPRESSION,
             timestamp=datetime.now(),
             conversation_compression=conversation_compression,
-            todo=current_node_memory.node_memory[-1].todo,
-            conversation_state=current_node_memory.node_memory[-1].conversation_state,
-            branch_backtrack_summary=current_node_memory.node_memory[-1].branch_backtrack_summary,
-        )
-        current_node_memory.node_memory.append(
-            node_memory_entry)
+        ))
+        self.compression_node_ids.add(node_id)
         return True
 
     def set_conversation_state(self, node_id: uuid.UUID, conversation_state: ConversationStateMemory) -> bool:
         """Set the conversation state for a given node"""
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
-        current_node_memory = self.nodes[node_id].action_node_memory
-        if not current_node_memory:
-            raise ValueError(f"Node {node_id} has no action node memory")
-        node_memory_entry = NodeMemoryEntry(
+        self.append_node_memory_entry(node_id, NodeMemoryEntry(
             updated_field=NodeMemoryType.CONVERSATION_STATE,
             timestamp=datetime.now(),
             conversation_state=conversation_state,
-            todo=current_node_memory.node_memory[-1].todo,
-            branch_backtrack_summary=current_node_memory.node_memory[-1].branch_backtrack_summary,
-        )
-        current_node_memory.node_memory.append(
-            node_memory_entry)
+        ))
         return True
 
-    def get_node_memory_history_for_node(self, node_id: uuid.UUID) -> List[NodeMemory]:
+    def get_node_memory_history_for_node(self, node_id: uuid.UUID) -> NodeMemory:
         """Get the node memory history for a given node"""
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
@@ -226,9 +523,7 @@ class DAGMemory(BaseMemory):
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
         action_node_memory = self.nodes[node_id].action_node_memory
-        if not action_node_memory:
-            raise ValueError(f"Node {node_id} has no action node memory")
-        return action_node_memory.node_memory[-1].todo if action_node_memory.node_memory[-1].todo else None
+        return action_node_memory.todo if action_node_memory else None
 
     def get_conversation_state(self, node_id: Optional[uuid.UUID] = None) -> Optional[ConversationStateMemory]:
         """Get the conversation state for a given node"""
@@ -237,7 +532,16 @@ class DAGMemory(BaseMemory):
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
         action_node_memory = self.nodes[node_id].action_node_memory
-        return action_node_memory.node_memory[-1].conversation_state if action_node_memory.node_memory[-1].conversation_state else None
+        return action_node_memory.conversation_state if action_node_memory else None
+
+    def get_conversation_compression(self, node_id: Optional[uuid.UUID] = None) -> Optional[ConversationCompressionMemory]:
+        """Get the conversation compression for a given node"""
+        if node_id is None:
+            node_id = self.current_node_id
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        action_node_memory = self.nodes[node_id].action_node_memory
+        return action_node_memory.conversation_compression if action_node_memory else None
 
     def get_branch_backtrack_summary(self, node_id: Optional[uuid.UUID] = None) -> Optional[BranchBacktrackSummaryMemory]:
         """Get the branch backtrack summary for a given node"""
@@ -246,16 +550,25 @@ class DAGMemory(BaseMemory):
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
         action_node_memory = self.nodes[node_id].action_node_memory
-        return action_node_memory.node_memory[-1].branch_backtrack_summary if action_node_memory.node_memory[-1].branch_backtrack_summary else None
+        return action_node_memory.branch_backtrack_summary if action_node_memory else None
 
-    def get_current_node_memory(self, node_id: Optional[uuid.UUID] = None) -> Optional[NodeMemory]:
-        """Get the current node memory for a given node"""
+    def get_current_node_memory(self, node_id: Optional[uuid.UUID] = None) -> Optional[NodeMemoryEntry]:
+        """Get the current node memory for a given node, the latest entry with every field's latest value"""
         if node_id is None:
             node_id = self.current_node_id
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
         action_node_memory = self.nodes[node_id].action_node_memory
-        return action_node_memory.node_memory[-1] if action_node_memory.node_memory[-1] else None
+        if not action_node_memory or action_node_memory.latest_entry is None:
+            return None
+        return NodeMemoryEntry(
+            updated_field=action_node_memory.latest_entry.updated_field,
+            timestamp=action_node_memory.latest_entry.timestamp,
+            conversation_state=action_node_memory.conversation_state,
+            branch_backtrack_summary=action_node_memory.branch_backtrack_summary,
+            todo=action_node_memory.todo,
+            conversation_compression=action_node_memory.conversation_compression,
+        )
 
     def get_node_by_id(self, node_id: uuid.UUID) -> ActionNode:
         """Get a node by its ID"""
@@ -276,19 +589,11 @@ class DAGMemory(BaseMemory):
 
     def get_all_branch_node_ids(self) -> List[uuid.UUID]:
         """Get all branches in the action DAG"""
-        branches = []
-        for node in self.nodes.values():
-            if len(node.children_ids) > 1:
-                branches.append(node.node_id)
-        return branches
+        return list(self.branch_node_ids)
 
     def get_all_leaf_node_ids(self) -> List[uuid.UUID]:
         """Get all leaf nodes in the action DAG"""
-        leaves = []
-        for node in self.nodes.values():
-            if len(node.children_ids) == 0:
-                leaves.append(node.node_id)
-        return leaves
+        return list(self.leaf_node_ids)
 
     # effectively git checkout
     def set_current_node(self, node_id: uuid.UUID) -> uuid.UUID:
@@ -296,6 +601,7 @@ class DAGMemory(BaseMemory):
         if node_id not in self.nodes:
             raise ValueError(f"Node {node_id} not found")
         self.current_node_id = node_id
+        self.log_mutation({"op": "set_current_node", "node_id": str(node_id)})
         return node_id
 
     def backtrack(self, node_id: uuid.UUID, notes: str) -> uuid.UUID:
@@ -314,8 +620,7 @@ class DAGMemory(BaseMemory):
             raise ValueError("Notes are required!")
 
         action = self.nodes[node_id].action
-        action.metadata["notes"] = notes
-        self.update_node(node_id, action)
+        self.update_node(node_id, replace(action, metadata={**(action.metadata or {}), "notes": notes}))
         self.set_current_node(node_id)
         return node_id
 
@@ -327,26 +632,21 @@ class DAGMemory(BaseMemory):
         """
         if starting_node_id not in self.nodes or ending_node_id not in self.nodes:
             raise ValueError("Nodes not found")
-        context = []
-        current_node = self.nodes[starting_node_id]
-        visited = set()
-
-        while current_node.node_id != ending_node_id:
-            if current_node.node_id in visited:
-                raise ValueError(f"Cycle detected in DAG traversal")
-            visited.add(current_node.node_id)
-            context.append(current_node.action)
-
-            if current_node.parent_id is None:
-                raise ValueError(
-                    f"Node {ending_node_id} is not reachable from {starting_node_id}")
-            if current_node.parent_id not in self.nodes:
-                raise ValueError(
-                    f"Parent node {current_node.parent_id} not found")
-
-            current_node = self.nodes[current_node.parent_id]
-        context.append(current_node.action)
-        return "\n".join([self.format_action(action) for action in reversed(context)])
+        if not self.is_ancestor(ending_node_id, starting_node_id):
+            raise ValueError(
+                f"Node {ending_node_id} is not reachable from {starting_node_id}")
+
+        # both ends on the rendered path (the usual case) is a slice of its chunks
+        positions = self.rendered_path.positions
+        if starting_node_id in positions and ending_node_id in positions:
+            return "\n".join(self.rendered_path.chunks[positions[ending_node_id]:positions[starting_node_id] + 1])
+
+        context = [starting_node_id]
+        current_node_id = starting_node_id
+        while current_node_id != ending_node_id:
+            current_node_id = self.nodes[current_node_id].parent_id
+            context.append(current_node_id)
+        return "\n".join([self.render_action(node_id) for node_id in reversed(context)])
 
     def get_current_context(self) -> str:
         """Get context of the current node"""
@@ -354,20 +654,93 @@ class DAGMemory(BaseMemory):
             return ""
         if self.root_node_id is None:
             return ""
-        return self.get_context_between_nodes(self.current_node_id, self.root_node_id)
+        if self.current_node_id not in self.nodes:
+            raise ValueError("Nodes not found")
+        return self.sync_rendered_path(self.current_node_id).text()
 
     def get_context(self) -> str:
         """Get full context as a string"""
         return self.get_current_context()
 
+    def get_budgeted_context(self, token_budget: int, node_id: Optional[uuid.UUID] = None) -> str:
+        """
+        Get the context of a node bounded to roughly `token_budget` tokens
+        Only the current step (everything after the last step boundary) is sent as raw actions.
+        Older steps are replaced by the latest conversation compression on the path plus the stored
+        summaries of the steps after it. When that is still too long the current step keeps its
+        opening user input and its newest actions, and the oldest step summaries are dropped.
+        """
+        if node_id is None:
+            node_id = self.current_node_id
+        if node_id is None:
+            return ""
+        if node_id not in self.nodes:
+            raise ValueError(f"Node {node_id} not found")
+        path = self.sync_rendered_path(node_id)
+        step_start = path.step_boundaries[-1] + 1 if path.step_boundaries else 0
+        remaining = token_budget
+
+        # current step: the opening user input, then as many of the newest actions as fit
+        step_chunks = path.chunks[step_start:]
+        head = step_chunks[:1]
+        remaining -= sum(estimate_tokens(chunk) for chunk in head)
+        tail = []
+        for chunk in reversed(step_chunks[1:]):
+            cost = estimate_tokens(chunk)
+            if cost > remaining:
+                break
+            tail.append(chunk)
+            remaining -= cost
+        omitted_actions = len(step_chunks) - len(head) - len(tail)
+
+        # latest compression on the path, it stands in for every step up to its node
+        compression_position = -1
+        compression = None
+        for compression_node_id in self.compression_node_ids:
+            position = path.positions.get(compression_node_id)
+            if position is not None and position > compression_position:
+                compression_position = position
+                compression = self.get_conversation_compression(compression_node_id)
+        compression_chunk = None
+        if compression is not None:
+            compression_chunk = f"[CONVERSATION COMPRESSION]: \n {compression.content}"
+            cost = estimate_tokens(compression_chunk)
+            if cost <= remaining:
+                remaining -= cost
+            else:
+                compression_chunk = None
+
+        # summaries of the older steps not covered by the compression, newest first
+        summary_positions = [position for position in path.step_boundaries if position > compression_position]
+        summaries = []
+        for position in reversed(summary_positions):
+            cost = estimate_tokens(path.chunks[position])
+            if cost > remaining:
+                break
+            summaries.append(path.chunks[position])
+            remaining -= cost
+        omitted_summaries = len(summary_positions) - len(summaries)
+
+        context = []
+        if compression_chunk:
+            context.append(compression_chunk)
+        if omitted_summaries:
+            context.append(f"[{omitted_summaries} earlier step summaries omitted]")
+        context.extend(reversed(summaries))
+        context.extend(head)
+        if omitted_actions:
+            context.append(f"[{omitted_actions} earlier actions of this step omitted]")
+        context.extend(reversed(tail))
+        return "\n".join(context)
+
     def get_recent_context(self, max_actions: int = 10) -> str:
-        """Get recent context (most recent actions first)"""
-        if self.current_node_id is None:
+        """Get context of the last max_actions actions on the current branch"""
+        if self.current_node_id is None or max_actions <= 0:
             return ""
         if self.root_node_id is None:
             return ""
-        recent_root_node_id = self.get_path_to_root(
-            self.current_node_id)[-max_actions]
+        recent_root_node_id = self.get_ancestor(
+            self.current_node_id, min(max_actions - 1, self.nodes[self.current_node_id].depth))
         return self.get_context_between_nodes(self.current_node_id, recent_root_node_id)
 
     def get_conversation_length(self) -> int:
@@ -385,17 +758,22 @@ class DAGMemory(BaseMemory):
             return 0
         if self.root_node_id is None:
             return 0
-        return len(self.get_path_to_root(self.current_node_id))
+        return self.nodes[self.current_node_id].depth
 
     def get_step_count(self) -> int:
         """Get the number of steps in the conversation"""
-        return len(self.get_step_nodes())
+        return len(self.step_node_ids)
 
     def clear(self):
         """Clear all memory"""
         self.nodes = {}
         self.current_node_id = None
         self.root_node_id = None
+        self.rendered_actions = {}
+        self.rendered_path.clear()
+        self.compression_node_ids = set()
+        self.reset_indexes()
+        self.log_mutation({"op": "clear"})
 
 
 class LinearMemory(BaseMemory):
@@ -0,0 +1,291 @@
+import json
+import mmap
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from models import (Action, ActionNode, ActionType, NodeMemory, NodeMemoryEntry, NodeMemoryType, TodoItem,
+                    TodoMemory, TodoStatus, ConversationStateMemory, ConversationCompressionMemory,
+                    BranchBacktrackSummaryMemory)
+
+
+def _uuid_or_none(value: Optional[str]) -> Optional[uuid.UUID]:
+    return uuid.UUID(value) if value else None
+
+
+def _str_or_none(value: Optional[uuid.UUID]) -> Optional[str]:
+    return str(value) if value else None
+
+
+def action_to_dict(action: Action) -> Dict[str, Any]:
+    return {
+        "id": action.id,
+        "action_type": action.action_type.value,
+        "timestamp": action.timestamp.isoformat(),
+        "content": action.content,
+        "tool_name": action.tool_name,
+        "tool_args": action.tool_args,
+        "tool_result": action.tool_result,
+        "metadata": action.metadata,
+        "action_parameters": action.action_parameters,
+        "tool_search_query": action.tool_search_query,
+    }
+
+
+def action_from_dict(data: Dict[str, Any]) -> Action:
+    return Action(
+        id=data["id"],
+        action_type=ActionType(data["action_type"]),
+        timestamp=datetime.fromisoformat(data["timestamp"]),
+        content=data["content"],
+        tool_name=data.get("tool_name"),
+        tool_args=data.get("tool_args"),
+        tool_result=data.get("tool_result"),
+        metadata=data.get("metadata"),
+        action_parameters=data.get("action_parameters"),
+        tool_search_query=data.get("tool_search_query"),
+    )
+
+
+def node_memory_entry_to_dict(entry: NodeMemoryEntry) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "updated_field": entry.updated_field.value,
+        "timestamp": entry.timestamp.isoformat(),
+    }
+    if entry.todo is not None:
+        items = entry.todo.items
+        if isinstance(items, list):
+            items = [{"timestamp": item.timestamp.isoformat(), "content": item.content, "status": item.status.value}
+                     if isinstance(item, TodoItem) else item for item in items]
+        data["todo"] = {"timestamp": entry.todo.timestamp.isoformat(), "items": items}
+    if entry.conversation_state is not None:
+        data["conversation_state"] = {"timestamp": entry.conversation_state.timestamp.isoformat(),
+                                      "content": entry.conversation_state.content}
+    if entry.conversation_compression is not None:
+        data["conversation_compression"] = {"timestamp": entry.conversation_compression.timestamp.isoformat(),
+                                            "content": entry.conversation_compression.content}
+    if entry.branch_backtrack_summary is not None:
+        summary = entry.branch_backtrack_summary
+        data["branch_backtrack_summary"] = {
+            "timestamp": summary.timestamp.isoformat(),
+            "backtrack_branch_point_node_id": _str_or_none(summary.backtrack_branch_point_node_id),
+            "backtrack_from_node_id": _str_or_none(summary.backtrack_from_node_id),
+            "content": summary.content,
+        }
+    return data
+
+
+def node_memory_entry_from_dict(data: Dict[str, Any]) -> NodeMemoryEntry:
+    entry = NodeMemoryEntry(updated_field=NodeMemoryType(data["updated_field"]),
+                            timestamp=datetime.fromisoformat(data["timestamp"]))
+    if "todo" in data:
+        items = data["todo"]["items"]
+        if isinstance(items, list):
+            items = [TodoItem(timestamp=datetime.fromisoformat(item["timestamp"]), content=item["content"],
+                              status=TodoStatus(item["status"]))
+                     if isinstance(item, dict) and "status" in item else item for item in items]
+        entry.todo = TodoMemory(timestamp=datetime.fromisoformat(data["todo"]["timestamp"]), items=items)
+    if "conversation_state" in data:
+        entry.conversation_state = ConversationStateMemory(
+            timestamp=datetime.fromisoformat(data["conversation_state"]["timestamp"]),
+            content=data["conversation_state"]["content"])
+    if "conversation_compression" in data:
+        entry.conversation_compression = ConversationCompressionMemory(
+            timestamp=datetime.fromisoformat(data["conversation_compression"]["timestamp"]),
+            content=data["conversation_compression"]["content"])
+    if "branch_backtrack_summary" in data:
+        summary = data["branch_backtrack_summary"]
+        entry.branch_backtrack_summary = BranchBacktrackSummaryMemory(
+            timestamp=datetime.fromisoformat(summary["timestamp"]),
+            backtrack_branch_point_node_id=_uuid_or_none(summary["backtrack_branch_point_node_id"]),
+            backtrack_from_node_id=_uuid_or_none(summary["backtrack_from_node_id"]),
+            content=summary["content"])
+    return entry
+
+
+def node_to_dict(node: ActionNode) -> Dict[str, Any]:
+    """Serialize a node without its children, which are rebuilt from parent ids in insertion order"""
+    return {
+        "node_id": str(node.node_id),
+        "parent_id": _str_or_none(node.parent_id),
+        "action": action_to_dict(node.action),
+        "node_memory": None if node.action_node_memory is None else
+        [node_memory_entry_to_dict(entry) for entry in node.action_node_memory.history()],
+        "step_boundary": node.step_boundary,
+        "step_summary": node.step_summary,
+    }
+
+
+def node_from_dict(data: Dict[str, Any], uuids: Optional[Dict[str, uuid.UUID]] = None) -> ActionNode:
+    """Deserialize a node. `uuids` interns parsed ids across calls, every parent id was parsed once as a node id"""
+    if uuids is None:
+        uuids = {}
+    node_id = uuids[data["node_id"]] = uuid.UUID(data["node_id"])
+    parent_id = data["parent_id"]
+    if parent_id:
+        parent_id = uuids.get(parent_id) or uuid.UUID(parent_id)
+    node_memory = None
+    if data.get("node_memory") is not None:
+        node_memory = NodeMemory()
+        for entry in data["node_memory"]:
+            node_memory.append(node_memory_entry_from_dict(entry))
+    return ActionNode(
+        action=action_from_dict(data["action"]),
+        parent_id=parent_id or None,
+        node_id=node_id,
+        children_ids=[],
+        action_node_memory=node_memory,
+        step_boundary=data["step_boundary"],
+        step_summary=data["step_summary"],
+    )
+
+
+class DAGMemoryStore:
+    """
+    Append-only on-disk log for DAGMemory
+    Every mutation is appended as one JSON line to the current segment-<n>.jsonl file once DAGMemory
+    has applied it, before the method returns. Every `snapshot_interval` records the segment is
+    sealed and a background thread replays the sealed log into a full snapshot-<n>.json, written
+    atomically, then deletes the segments it covers, so a reload reads one snapshot plus a short
+    log tail and the event loop never waits on a snapshot. Segments are read through mmap and a
+    torn last line (crash mid-write) is ignored.
+    """
+
+    SEGMENT_PATTERN = re.compile(r"segment-(\d+)\.jsonl$")
+    SNAPSHOT_PATTERN = re.compile(r"snapshot-(\d+)\.json$")
+
+    def __init__(self, directory: str, snapshot_interval: int = 5000, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        # fsync after every record survives power loss, not just process crashes, at a large write cost
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.segment_seq = max(self._list(self.SEGMENT_PATTERN) + self._list(self.SNAPSHOT_PATTERN) + [0])
+        self.records_since_snapshot = 0
+        self._segment_file = None
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+    def _list(self, pattern: re.Pattern) -> List[int]:
+        seqs = []
+        for filename in os.listdir(self.directory):
+            match = pattern.match(filename)
+            if match:
+                seqs.append(int(match.group(1)))
+        return sorted(seqs)
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"segment-{seq:08d}.jsonl")
+
+    def _snapshot_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{seq:08d}.json")
+
+    def append(self, record: Dict[str, Any]):
+        """Durably append one mutation record"""
+        if self._segment_file is None:
+            self._segment_file = open(self._segment_path(self.segment_seq), "a", encoding="utf-8")
+        self._segment_file.write(json.dumps(record, default=str) + "\n")
+        self._segment_file.flush()
+        if self.fsync:
+            os.fsync(self._segment_file.fileno())
+        self.records_since_snapshot += 1
+
+    def should_snapshot(self) -> bool:
+        # one snapshot at a time, the log keeps growing until the running one is done
+        return self.records_since_snapshot >= self.snapshot_interval and not self.snapshot_running()
+
+    def snapshot_running(self) -> bool:
+        return self._snapshot_thread is not None and self._snapshot_thread.is_alive()
+
+    def seal(self) -> int:
+        """Start a new segment, returns the sequence number of the snapshot covering the sealed ones"""
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+        self.segment_seq += 1
+        self.records_since_snapshot = 0
+        return self.segment_seq
+
+    def start_snapshot(self, replay: Callable[["DAGMemoryStore", int], Tuple[List[ActionNode], Optional[uuid.UUID],
+                                                                          Optional[uuid.UUID]]]):
+        """
+        Seal the current segment and snapshot the log up to it in a background thread
+        `replay(store, seq)` rebuilds the nodes, current and root node ids from the log before seq,
+        it only reads sealed files, never the caller's live memory.
+        """
+        seq = self.seal()
+
+        def run():
+            self.write_snapshot(seq, *replay(self, seq))
+
+        self._snapshot_thread = threading.Thread(target=run, name=f"snapshot-{seq:08d}", daemon=True)
+        self._snapshot_thread.start()
+
+    def wait_for_snapshot(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
+    def write_snapshot(self, seq: int, nodes: List[ActionNode], current_node_id: Optional[uuid.UUID],
+                       root_node_id: Optional[uuid.UUID]):
+        """Write the snapshot covering the segments before seq and drop the log it supersedes"""
+        snapshot = {
+            "current_node_id": _str_or_none(current_node_id),
+            "root_node_id": _str_or_none(root_node_id),
+            "nodes": [node_to_dict(node) for node in nodes],
+        }
+        tmp_path = self._snapshot_path(seq) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._snapshot_path(seq))
+
+        for old_seq in self._list(self.SEGMENT_PATTERN):
+            if old_seq < seq:
+                os.remove(self._segment_path(old_seq))
+        for old_seq in self._list(self.SNAPSHOT_PATTERN):
+            if old_seq < seq:
+                os.remove(self._snapshot_path(old_seq))
+
+    def read_snapshot(self, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        snapshots = [seq for seq in self._list(self.SNAPSHOT_PATTERN) if before is None or seq < before]
+        if not snapshots:
+            return None
+        with open(self._snapshot_path(snapshots[-1]), "rb") as f:
+            return json.loads(f.read())
+
+    def read_records(self, before: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Replay the log records written after the latest snapshot, in order
+        With `before`, only the sealed segments before it (a background snapshot's view), which
+        don't count towards the next snapshot.
+        """
+        snapshots = [seq for seq in self._list(self.SNAPSHOT_PATTERN) if before is None or seq < before]
+        first_seq = snapshots[-1] if snapshots else 0
+        for seq in self._list(self.SEGMENT_PATTERN):
+            if seq < first_seq or (before is not None and seq >= before):
+                continue
+            path = self._segment_path(seq)
+            if os.path.getsize(path) == 0:
+                continue
+            torn_at = None
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for line in iter(mapped.readline, b""):
+                    if not line.endswith(b"\n"):
+                        torn_at = mapped.tell() - len(line)
+                        break
+                    if before is None:
+                        self.records_since_snapshot += 1
+                    yield json.loads(line)
+            if torn_at is not None:
+                # cut the partial record left by a crash so new appends start on a clean line
+                with open(path, "r+b") as f:
+                    f.truncate(torn_at)
+
+    def close(self):
+        self.wait_for_snapshot()
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
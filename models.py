@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple
 import uuid
@@ -29,6 +29,7 @@ class ActionType(Enum):
 class NodeMemoryType(Enum):
     CONVERSATION_STATE = "CONVERSATION_STATE"
     BRANCH_BACKTRACK_SUMMARY = "BRANCH_BACKTRACK_SUMMARY"
+    CONVERSATION_COMPRESSION = "CONVERSATION_COMPRESSION"
     TODO = "TODO"
 
 
@@ -40,26 +41,32 @@ class TodoStatus(Enum):
     FAILED = "FAILED"
 
 
-@dataclass
+@dataclass(slots=True)
 class TodoItem:
     timestamp: datetime
     content: str
     status: TodoStatus
 
 
-@dataclass
+@dataclass(slots=True)
 class TodoMemory:
     timestamp: datetime
     items: List[TodoItem]
 
 
-@dataclass
+@dataclass(slots=True)
 class ConversationStateMemory:
     timestamp: datetime
     content: Dict[str, Any]
 
 
-@dataclass
+@dataclass(slots=True)
+class ConversationCompressionMemory:
+    timestamp: datetime
+    content: str
+
+
+@dataclass(slots=True)
 class BranchBacktrackSummaryMemory:
     timestamp: datetime
     # where the backtrack moved the active node to
@@ -68,21 +75,82 @@ class BranchBacktrackSummaryMemory:
     content: str
 
 
-@dataclass
+# slots: no per-instance __dict__, these are created for every node of long sessions
+@dataclass(slots=True)
 class NodeMemoryEntry:
+    """One update of a node's memory, normally only the updated field is set"""
     updated_field: NodeMemoryType
     timestamp: datetime
     conversation_state: Optional[ConversationStateMemory] = None
     branch_backtrack_summary: Optional[BranchBacktrackSummaryMemory] = None
     todo: Optional[TodoMemory] = None
+    conversation_compression: Optional[ConversationCompressionMemory] = None
+    # the entry before this one in the node's history
+    previous: Optional["NodeMemoryEntry"] = field(default=None, repr=False, compare=False)
 
 
-@dataclass
-class NodeMemory:
-    node_memory: List[NodeMemoryEntry]
+NODE_MEMORY_FIELDS = ("todo", "conversation_state", "conversation_compression", "branch_backtrack_summary")
 
 
-@dataclass
+@dataclass(slots=True)
+class NodeMemory:
+    """
+    History of a node's memory as a chain of delta entries, newest first
+    The latest value of every field is kept alongside, so lookups never walk the history
+    """
+    latest_entry: Optional[NodeMemoryEntry] = None
+    length: int = 0
+    todo: Optional[TodoMemory] = None
+    conversation_state: Optional[ConversationStateMemory] = None
+    conversation_compression: Optional[ConversationCompressionMemory] = None
+    branch_backtrack_summary: Optional[BranchBacktrackSummaryMemory] = None
+
+    def append(self, entry: NodeMemoryEntry):
+        """Add an entry, every field set on it becomes the latest value of that field"""
+        entry.previous = self.latest_entry
+        self.latest_entry = entry
+        self.length += 1
+        for name in NODE_MEMORY_FIELDS:
+            value = getattr(entry, name)
+            if value is not None:
+                setattr(self, name, value)
+
+    def history(self) -> List[NodeMemoryEntry]:
+        """All entries, oldest first"""
+        entries = []
+        entry = self.latest_entry
+        while entry is not None:
+            entries.append(entry)
+            entry = entry.previous
+        entries.reverse()
+        return entries
+
+    def compact(self, keep: int):
+        """Keep the newest `keep` entries and fold everything older into one base entry holding its state"""
+        if self.length <= keep + 1:
+            return
+        last_kept = None
+        entry = self.latest_entry
+        for _ in range(keep):
+            last_kept, entry = entry, entry.previous
+        # entry is now the newest dropped one, rebuild the state as of that entry
+        state = {name: None for name in NODE_MEMORY_FIELDS}
+        dropped = entry
+        while dropped is not None:
+            for name in NODE_MEMORY_FIELDS:
+                value = getattr(dropped, name)
+                if state[name] is None and value is not None:
+                    state[name] = value
+            dropped = dropped.previous
+        base = NodeMemoryEntry(updated_field=entry.updated_field, timestamp=entry.timestamp, **state)
+        if last_kept is None:
+            self.latest_entry = base
+        else:
+            last_kept.previous = base
+        self.length = keep + 1
+
+
+@dataclass(slots=True)
 class Action:
     """Represents a single action taken in a conversation"""
     id: str
@@ -97,7 +165,7 @@ class Action:
     tool_search_query: Optional[str] = None  # Query used for tool search
 
 
-@dataclass
+@dataclass(slots=True)
 class ActionNode:
     """ Represents a node in the action DAG """
     action: Action
@@ -107,3 +175,6 @@ class ActionNode:
     action_node_memory: Optional[NodeMemory] = None
     step_boundary: bool = False
     step_summary: Optional[str] = None  # only on step boundaries
+    # maintained by DAGMemory: number of ancestors, and a skip pointer to an ancestor for O(log n) queries
+    depth: int = 0
+    jump_id: Optional[uuid.UUID] = None
@@ -0,0 +1,126 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+from models import ActionType
+
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+
+class PromptRegistry:
+    """
+    In-memory prompt store, loaded once from prompts/<prompt_set>/
+    Prompts are compiled per (prompt_set, ActionType) up front, with the tool descriptions of the
+    set already joined in front of the agent action prompts, so serving a prompt never touches disk.
+    """
+
+    PROMPT_FILES = {
+        ActionType.PROCESS_USER_INPUT: "process_user_input_prompt.md",
+        ActionType.AGENT_RESPONSE: "agent_response_prompt.md",
+        ActionType.AGENT_PLANNING: "agent_planning_prompt.md",
+        ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT: "process_tool_search_result_prompt.md",
+        ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT: "process_tool_execution_result_prompt.md",
+        ActionType.STEP_SUMMARY: "step_summary_prompt.md",
+        ActionType.UPDATE_TODO_LIST: "update_todo_list_prompt.md",
+        ActionType.UPDATE_CONVERSATION_STATE: "update_conversation_state_prompt.md",
+        ActionType.UPDATE_CONVERSATION_COMPRESSION: "update_conversation_compression_prompt.md",
+        ActionType.UPDATE_BRANCH_BACKTRACK_SUMMARY: "update_branch_backtrack_summary_prompt.md",
+    }
+    TOOL_DESCRIPTION_FILES = ["bash_execute_tool_description.md"]
+    # memory bookkeeping prompts don't get the tool descriptions injected
+    TOOL_DESCRIPTION_ACTION_TYPES = {
+        ActionType.PROCESS_USER_INPUT,
+        ActionType.AGENT_RESPONSE,
+        ActionType.AGENT_PLANNING,
+        ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT,
+        ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,
+        ActionType.STEP_SUMMARY,
+    }
+
+    _default: Optional["PromptRegistry"] = None
+
+    def __init__(self, prompts_dir: str = PROMPTS_DIR):
+        self.prompts_dir = prompts_dir
+        self.prompts: Dict[Tuple[str, ActionType], str] = {}
+        self.tool_descriptions: Dict[str, str] = {}
+        self.file_mtimes: Dict[str, float] = {}
+        self.load()
+
+    @classmethod
+    def default(cls) -> "PromptRegistry":
+        """Process-wide registry over the bundled prompts directory"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def prompt_sets(self) -> List[str]:
+        return sorted(entry for entry in os.listdir(self.prompts_dir)
+                      if os.path.isdir(os.path.join(self.prompts_dir, entry)))
+
+    def load(self):
+        """(Re)load and compile every prompt set"""
+        prompts = {}
+        tool_descriptions = {}
+        file_mtimes = {}
+        for prompt_set in self.prompt_sets():
+            set_dir = os.path.join(self.prompts_dir, prompt_set)
+
+            descriptions = []
+            for filename in self.TOOL_DESCRIPTION_FILES:
+                content = self._read(os.path.join(set_dir, filename), file_mtimes)
+                if content is not None:
+                    descriptions.append(content)
+            tool_description = "\n".join(descriptions)
+            tool_descriptions[prompt_set] = tool_description
+
+            for action_type, filename in self.PROMPT_FILES.items():
+                content = self._read(os.path.join(set_dir, filename), file_mtimes)
+                if content is None:
+                    continue
+                if tool_description and action_type in self.TOOL_DESCRIPTION_ACTION_TYPES:
+                    content = tool_description + "\n" + content
+                prompts[(prompt_set, action_type)] = content
+
+        self.prompts = prompts
+        self.tool_descriptions = tool_descriptions
+        self.file_mtimes = file_mtimes
+
+    @staticmethod
+    def _read(path: str, file_mtimes: Dict[str, float]) -> Optional[str]:
+        if not os.path.isfile(path):
+            return None
+        file_mtimes[path] = os.path.getmtime(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def get(self, action_type: ActionType, prompt_set: str = "coding") -> str:
+        """Get the compiled system prompt for an action type"""
+        prompt = self.prompts.get((prompt_set, action_type))
+        if prompt is None:
+            raise ValueError(
+                f"No prompt available for action type: {action_type} in prompt set: {prompt_set}")
+        return prompt
+
+    def get_tool_description(self, prompt_set: str = "coding") -> str:
+        return self.tool_descriptions.get(prompt_set, "")
+
+    def has_changed(self) -> bool:
+        """Check whether any prompt file was added, removed or modified since the last load"""
+        seen = set()
+        for prompt_set in self.prompt_sets():
+            set_dir = os.path.join(self.prompts_dir, prompt_set)
+            for filename in self.TOOL_DESCRIPTION_FILES + list(self.PROMPT_FILES.values()):
+                path = os.path.join(set_dir, filename)
+                if not os.path.isfile(path):
+                    continue
+                seen.add(path)
+                if self.file_mtimes.get(path) != os.path.getmtime(path):
+                    return True
+        return seen != set(self.file_mtimes)
+
+    async def watch(self, interval: float = 2.0):
+        """Hot reload: poll the prompt files and reload when they change. Run as a background task."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.has_changed():
+                self.load()
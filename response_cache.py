@@ -0,0 +1,216 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+
+class ResponseNotRecorded(ValueError):
+    """Replay mode has no response for a request"""
+
+
+class ResponseCache:
+    """
+    On-disk LLM response cache, content addressed by sha256(model, system prompt, context)
+    Responses live in one sqlite database (a primary key lookup takes microseconds) and are evicted
+    least recently used first once they take more than `max_bytes`. Timestamps are masked out of
+    the context before hashing by default, so a replayed conversation maps to the same keys even
+    though every action is stamped with the time it ran.
+    """
+
+    # the two timestamps format_action writes per action. Separate patterns with a literal first
+    # character let the regex engine skip ahead, a generic date pattern is ~20x slower on long contexts
+    TIMESTAMP_PATTERNS = [
+        (re.compile(r"\[\d\d:\d\d:\d\d\]"), "[<timestamp>]"),
+        (re.compile(r'"timestamp": "[^"]*"'), '"timestamp": "<timestamp>"'),
+    ]
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024, ignore_timestamps: bool = True):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.ignore_timestamps = ignore_timestamps
+        # autocommit, WAL and no fsync per write: a crash can lose the newest entries, never corrupt the index
+        self.db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, model: str, system_prompt: Optional[str], context: str, sample_index: int = 0) -> str:
+        if self.ignore_timestamps:
+            for pattern, replacement in self.TIMESTAMP_PATTERNS:
+                context = pattern.sub(replacement, context)
+        digest = hashlib.sha256()
+        for part in (model, system_prompt or "", context):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        # retries and speculative samples of a request each get their own response, the first
+        # sample keeps the key it had before samples were numbered
+        if sample_index:
+            digest.update(f"sample {sample_index}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str):
+        size = len(response.encode("utf-8"))
+        previous = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.db.execute("INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                        (key, response, size, time.time()))
+        self.total_bytes += size - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used responses until the cache fits in max_bytes"""
+        freed = []
+        excess = self.total_bytes - self.max_bytes
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if excess <= 0:
+                break
+            freed.append((key,))
+            excess -= size
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", freed)
+        self.evictions += len(freed)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0],
+            "bytes": self.total_bytes,
+        }
+
+    def clear(self):
+        self.db.execute("DELETE FROM responses")
+        self.total_bytes = 0
+
+    def close(self):
+        self.db.close()
+
+
+class CacheSample:
+    """
+    One sample of a request, made current with `sampling` around the provider call
+    CachedProvider keys the sample by its index and holds a new response back until the caller has
+    parsed and accepted it and calls commit(), so a malformed response is never recorded.
+    """
+
+    def __init__(self, index: int = 0):
+        self.index = index
+        self.pending: List[Tuple[ResponseCache, str, str]] = []
+
+    def commit(self):
+        for cache, key, response in self.pending:
+            cache.put(key, response)
+        self.pending.clear()
+
+
+CURRENT_SAMPLE: ContextVar[Optional[CacheSample]] = ContextVar("current_sample", default=None)
+
+
+@contextmanager
+def sampling(index: int = 0) -> Iterator[CacheSample]:
+    sample = CacheSample(index)
+    token = CURRENT_SAMPLE.set(sample)
+    try:
+        yield sample
+    finally:
+        CURRENT_SAMPLE.reset(token)
+
+
+class CachedProvider:
+    """
+    Wraps an LLM provider with a ResponseCache
+      - record: answer from the cache, call the provider and store its response on a miss
+      - replay: answer only from the cache, a miss is an error, no provider needed (offline runs)
+      - passthrough: always call the provider, the cache is not touched
+    Inside `sampling`, responses are keyed by sample index and stored only on commit, outside it
+    they are stored as soon as the provider returns.
+    Other attributes (set_generation_config, prompt_cache_stats, ...) are the wrapped provider's.
+    """
+
+    MODES = ("record", "replay", "passthrough")
+
+    def __init__(self, provider=None, cache: Optional[ResponseCache] = None, mode: str = "record",
+                 model_name: Optional[str] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}. Expected one of {', '.join(self.MODES)}")
+        if provider is None and mode != "replay":
+            raise ValueError(f"A provider is required in {mode} mode")
+        if cache is None and mode != "passthrough":
+            raise ValueError(f"A response cache is required in {mode} mode")
+        # part of the key, so a replay without a provider has to name the recorded model
+        model_name = model_name or getattr(provider, "model_name", None)
+        if model_name is None:
+            raise ValueError("model_name is required when the provider doesn't have one")
+        self.provider = provider
+        self.cache = cache
+        self.mode = mode
+        self.model_name = model_name
+
+    def __getattr__(self, name: str):
+        # only reached for attributes CachedProvider doesn't define itself
+        provider = self.__dict__.get("provider")
+        if provider is None:
+            raise AttributeError(name)
+        return getattr(provider, name)
+
+    def lookup(self, context: str, system_prompt: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        if self.mode == "passthrough":
+            return None, None
+        sample = CURRENT_SAMPLE.get()
+        key = self.cache.key(self.model_name, system_prompt, context, sample.index if sample else 0)
+        response = self.cache.get(key)
+        if response is None and self.mode == "replay":
+            raise ResponseNotRecorded(f"No recorded response for this request (key {key}) in replay mode")
+        return key, response
+
+    def store(self, key: str, response: str):
+        sample = CURRENT_SAMPLE.get()
+        if sample is None:
+            self.cache.put(key, response)
+        else:
+            sample.pending.append((self.cache, key, response))
+
+    async def generate(self, context: str, system_prompt: Optional[str] = None) -> str:
+        key, response = self.lookup(context, system_prompt)
+        if response is not None:
+            return response
+        response = await self.provider.generate(context, system_prompt)
+        if key is not None:
+            self.store(key, response)
+        return response
+
+    async def generate_stream(self, context: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        key, response = self.lookup(context, system_prompt)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        async for chunk in self.provider.generate_stream(context, system_prompt):
+            chunks.append(chunk)
+            yield chunk
+        # a stream abandoned half way is not recorded
+        if key is not None:
+            self.store(key, "".join(chunks))
@@ -0,0 +1,269 @@
+"""
+Multi-session agent server: hosts many CoreAgent sessions on one event loop.
+
+Protocol: newline-delimited JSON over TCP. Each request may carry a "request_id" that is echoed
+back on every message it produces.
+    {"type": "open", "session_id": optional}        -> {"type": "opened", "session_id"}
+    {"type": "input", "session_id", "text"}         -> {"type": "response_text", "text"}* (streamed)
+                                                       {"type": "step_done", "response"}
+    {"type": "close", "session_id"}                 -> {"type": "closed", "session_id"}
+    errors                                          -> {"type": "error", "error"}
+
+Session ids are UUIDs issued by the server on open. A client only names one to reopen a session
+logged under memory_root. A session belongs to the connection that opened it: input and close
+from other connections are answered as for an unknown session, and it is closed when its
+connection goes away.
+
+Every session has its own DAGMemory and gateway session, but all sessions share one LLM provider
+per model (whose semaphore is that model's process-wide concurrency limit, routed models come from
+the server's ProviderPool) and one pooled gateway HTTP client. A
+session runs one step at a time and queues at most `max_pending_inputs` more; inputs beyond
+that are rejected instead of buffered without bound.
+
+Run: python3 server.py [--host 127.0.0.1] [--port 8765]
+"""
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Callable, Dict, Optional
+import httpx
+from agent import CoreAgent
+from gateway_tools import MCPGatewayTools
+from llm import ProviderPool, create_provider
+from models import ActionType
+
+
+class Connection:
+    """One client connection, serialising messages as JSON lines"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    def send(self, message: Dict[str, Any]):
+        if not self.writer.is_closing():
+            self.writer.write((json.dumps(message) + "\n").encode())
+
+    async def flush(self):
+        """Wait for the socket buffer to drain, so slow clients slow their own session only"""
+        if not self.writer.is_closing():
+            await self.writer.drain()
+
+
+class AgentSession:
+    """A CoreAgent plus a bounded queue of pending inputs, processed one step at a time"""
+
+    def __init__(self, session_id: str, agent: CoreAgent, max_pending_inputs: int,
+                 connection: Optional[Connection] = None):
+        self.session_id = session_id
+        self.agent = agent
+        # the connection that opened the session, the only one that may use it
+        self.connection = connection
+        self.inputs: asyncio.Queue = asyncio.Queue(maxsize=max_pending_inputs)
+        self.worker = asyncio.create_task(self.run())
+
+    def submit(self, text: str, reply: Callable[[Dict[str, Any]], None], flush) -> bool:
+        """Queue an input, returning False when the session is already at capacity"""
+        try:
+            self.inputs.put_nowait((text, reply, flush))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        while True:
+            text, reply, flush = await self.inputs.get()
+            self.agent.on_response_text = lambda chunk: reply(
+                {"type": "response_text", "text": chunk})
+            try:
+                await self.agent.memory.add_action(text, ActionType.USER_INPUT)
+                response = await self.agent.run_step(text)
+                reply({"type": "step_done", "response": response})
+            except Exception as e:
+                reply({"type": "error", "error": f"{type(e).__name__}: {e}"})
+            finally:
+                self.inputs.task_done()
+            await flush()
+
+    async def close(self):
+        self.worker.cancel()
+        self.agent.is_running = False
+        self.agent.cancel_early_dispatch()
+        if self.agent.memory_agent:
+            await self.agent.memory_agent.close()
+        await self.agent.gateway_tools.aclose()
+        self.agent.blob_store.close()
+        if self.agent.memory.store:
+            self.agent.memory.store.close()
+
+
+class AgentServer:
+    """Asyncio server hosting concurrent agent sessions that share LLM and gateway clients"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, llm=None, provider: Optional[str] = None,
+                 gateway_url: str = "http://localhost:8080",
+                 max_concurrent_llm_calls: int = 64,
+                 max_gateway_connections: int = 200,
+                 max_pending_inputs: int = 4,
+                 memory_root: Optional[str] = None,
+                 agent_options: Optional[Dict[str, Any]] = None):
+        self.host = host
+        self.port = port
+        self.llm = llm or create_provider(provider, max_concurrent_requests=max_concurrent_llm_calls)
+        # models routed to by agent_options["model_routes"], created once for all sessions
+        self.provider_pool = ProviderPool(max_concurrent_requests=max_concurrent_llm_calls)
+        self.gateway_url = gateway_url
+        self.gateway_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_gateway_connections,
+                                                                    max_keepalive_connections=max_gateway_connections))
+        self.max_pending_inputs = max_pending_inputs
+        # with a memory_root each session is durably logged under memory_root/<session_id> and can be reopened
+        self.memory_root = memory_root
+        self.agent_options = {"stream_responses": True, **(agent_options or {})}
+        self.sessions: Dict[str, AgentSession] = {}
+        self.connections = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> "AgentServer":
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        print(f"Agent server listening on {self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for connection in list(self.connections):
+                connection.writer.close()
+            await self._server.wait_closed()
+            await asyncio.sleep(0)
+            self._server = None
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        await self.gateway_client.aclose()
+
+    @staticmethod
+    def parse_session_id(session_id: Any) -> str:
+        """The canonical form of a client supplied session id, which has to be a UUID"""
+        try:
+            return str(uuid.UUID(session_id))
+        except (ValueError, TypeError, AttributeError):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+
+    def session_memory_dir(self, session_id: str) -> Optional[str]:
+        if not self.memory_root:
+            return None
+        memory_root = os.path.realpath(self.memory_root)
+        memory_dir = os.path.realpath(os.path.join(memory_root, session_id))
+        if os.path.dirname(memory_dir) != memory_root:
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return memory_dir
+
+    def open_session(self, session_id: Optional[str] = None, connection: Optional[Connection] = None) -> AgentSession:
+        """Open a new session, or reopen session_id (logged under memory_root) for the connection"""
+        session_id = str(uuid.uuid4()) if session_id is None else self.parse_session_id(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            if session.connection is not connection:
+                raise ValueError(f"Session {session_id} is open on another connection")
+            return session
+        memory_dir = self.session_memory_dir(session_id)
+        agent = CoreAgent(llm=self.llm,
+                          gateway_tools=MCPGatewayTools(self.gateway_url, client=self.gateway_client),
+                          memory_dir=memory_dir,
+                          provider_pool=self.provider_pool,
+                          verbose=False,
+                          **self.agent_options)
+        session = AgentSession(session_id, agent, self.max_pending_inputs, connection)
+        self.sessions[session_id] = session
+        return session
+
+    def get_session(self, session_id: Any, connection: Optional[Connection]) -> Optional[AgentSession]:
+        """The session if it exists and belongs to the connection"""
+        session = self.sessions.get(session_id) if isinstance(session_id, str) else None
+        if session is None or session.connection is not connection:
+            return None
+        return session
+
+    async def close_session(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        await session.close()
+        return True
+
+    async def handle_message(self, message: Dict[str, Any], connection: Connection):
+        request_id = message.get("request_id")
+
+        def reply(payload: Dict[str, Any]):
+            if request_id is not None:
+                payload["request_id"] = request_id
+            connection.send(payload)
+
+        message_type = message.get("type")
+        if message_type == "open":
+            try:
+                session = self.open_session(message.get("session_id"), connection)
+            except ValueError as e:
+                reply({"type": "error", "error": str(e)})
+                return
+            reply({"type": "opened", "session_id": session.session_id})
+        elif message_type == "input":
+            session = self.get_session(message.get("session_id"), connection)
+            if session is None:
+                reply({"type": "error", "error": f"Unknown session: {message.get('session_id')}"})
+            elif not session.submit(message.get("text", ""), reply, connection.flush):
+                reply({"type": "error", "error": "Session is busy, too many pending inputs"})
+        elif message_type == "close":
+            session = self.get_session(message.get("session_id"), connection)
+            closed = session is not None and await self.close_session(session.session_id)
+            reply({"type": "closed" if closed else "error", "session_id": message.get("session_id")})
+        else:
+            reply({"type": "error", "error": f"Unknown message type: {message_type}"})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = Connection(writer)
+        self.connections.add(connection)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError as e:
+                    connection.send({"type": "error", "error": f"Invalid JSON: {e}"})
+                    continue
+                await self.handle_message(message, connection)
+                await connection.flush()
+        except ConnectionResetError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+            for session in [session for session in self.sessions.values() if session.connection is connection]:
+                await self.close_session(session.session_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-session agent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gateway-url", default="http://localhost:8080")
+    parser.add_argument("--provider", default=None, help="registered LLM provider name (default: openai)")
+    parser.add_argument("--max-concurrent-llm-calls", type=int, default=64)
+    parser.add_argument("--max-pending-inputs", type=int, default=4)
+    parser.add_argument("--memory-root", default=None)
+    args = parser.parse_args()
+
+    server = AgentServer(host=args.host, port=args.port, provider=args.provider, gateway_url=args.gateway_url,
+                         max_concurrent_llm_calls=args.max_concurrent_llm_calls,
+                         max_pending_inputs=args.max_pending_inputs,
+                         memory_root=args.memory_root)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,161 @@
+import json
+from typing import Any, Dict, Optional
+
+
+class IncrementalResponseParser:
+    """
+    Incremental scanner for a streamed JSON action response
+    Feed it completion chunks as they arrive. Each top-level field of the response object is
+    decoded into `fields` as soon as its value is complete, and the string value currently being
+    streamed (e.g. "response") can be read while it is still partial.
+    Anything before the first "{" (such as a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        # top-level object state: "key" -> "colon" -> "value" -> "comma" -> "key" ...
+        self._expect = "key"
+        self._value_start: Optional[int] = None
+        self._value_kind: Optional[str] = None  # "string" | "container" | "scalar"
+        self._emitted: Dict[str, int] = {}
+        # the open string value decoded so far: its start in the buffer, the raw offset decoded up to, the text
+        self._partial_start: Optional[int] = None
+        self._partial_end = 0
+        self._partial_text = ""
+
+    def feed(self, chunk: str):
+        """Scan a new chunk of the completion"""
+        self.buffer += chunk
+        buffer = self.buffer
+        for i in range(self._pos, len(buffer)):
+            if self.done:
+                break
+            ch = buffer[i]
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._expect == "key":
+                            self._key = json.loads(buffer[self._key_start:i + 1])
+                            self._expect = "colon"
+                        elif self._value_kind == "string":
+                            self._finish_value(i + 1)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._expect == "key":
+                        self._key_start = i
+                    elif self._expect == "value":
+                        self._start_value(i, "string")
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._start_value(i, "container")
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 1 and self._value_kind == "scalar":
+                    self._finish_value(i)
+                self._depth -= 1
+                if self._depth == 1 and self._value_kind == "container":
+                    self._finish_value(i + 1)
+                elif self._depth == 0:
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ",":
+                    if self._value_kind == "scalar":
+                        self._finish_value(i)
+                    self._expect = "key"
+                elif self._expect == "value" and not ch.isspace():
+                    self._start_value(i, "scalar")
+        self._pos = len(buffer)
+
+    def _start_value(self, start: int, kind: str):
+        self._value_start = start
+        self._value_kind = kind
+        self._expect = "comma"
+
+    def _finish_value(self, end: int):
+        raw = self.buffer[self._value_start:end].strip()
+        try:
+            self.fields[self._key] = json.loads(raw)
+        except json.JSONDecodeError:
+            # leave malformed values to the full parse once the completion is done
+            pass
+        self._value_start = None
+        self._value_kind = None
+
+    def has(self, key: str) -> bool:
+        return key in self.fields
+
+    def partial_string(self, key: str) -> Optional[str]:
+        """Decoded value of a string field, including the part streamed so far if still open"""
+        if key in self.fields:
+            value = self.fields[key]
+            return value if isinstance(value, str) else None
+        if self._key != key or self._value_kind != "string":
+            return None
+        if self._partial_start != self._value_start:
+            self._partial_start = self._value_start
+            self._partial_end = self._value_start + 1
+            self._partial_text = ""
+        # only the raw text streamed since the last call is decoded
+        end = self._decodable_end(self._partial_end)
+        if end > self._partial_end:
+            try:
+                self._partial_text += json.loads('"' + self.buffer[self._partial_end:end] + '"')
+                self._partial_end = end
+            except json.JSONDecodeError:
+                # leave malformed values to the full parse once the completion is done
+                pass
+        return self._partial_text
+
+    def _decodable_end(self, start: int) -> int:
+        """Offset up to which the buffer holds whole characters, holding back an escape sequence still arriving"""
+        buffer = self.buffer
+        end = len(buffer)
+        i = buffer.find("\\", start)
+        while i != -1:
+            if i + 1 >= end:
+                return i
+            if buffer[i + 1] != "u":
+                i = buffer.find("\\", i + 2)
+                continue
+            if i + 6 > end:
+                return i
+            # an escaped high surrogate decodes to one character with its low half (\udcxx)
+            if buffer[i + 2:i + 4].lower() in ("d8", "d9", "da", "db") and i + 12 > end:
+                return i
+            i = buffer.find("\\", i + 6)
+        return end
+
+    def take_string_delta(self, key: str) -> str:
+        """Text of a string field streamed since the last call"""
+        value = self.partial_string(key)
+        if not value:
+            return ""
+        emitted = self._emitted.get(key, 0)
+        self._emitted[key] = len(value)
+        return value[emitted:]
@@ -0,0 +1,169 @@
+import asyncio
+import random
+import re
+import uuid
+from dataclasses import replace
+
+import pytest
+
+from memory import DAGMemory, LinearMemory
+from models import ActionType
+
+
+def linear_memory(length):
+    memory = DAGMemory()
+
+    async def add():
+        for i in range(length):
+            await memory.add_action(f"action {i}", ActionType.AGENT_PLANNING)
+
+    asyncio.run(add())
+    return memory
+
+
+def contents(context):
+    return re.findall(r'"content": "([^"]*)"', context)
+
+
+def test_recent_context_counts_back_from_the_current_node():
+    memory = linear_memory(5)
+    assert contents(memory.get_recent_context(1)) == ["action 4"]
+    assert contents(memory.get_recent_context(3)) == ["action 2", "action 3", "action 4"]
+    # a path shorter than max_actions is returned whole
+    assert contents(memory.get_recent_context(5)) == [f"action {i}" for i in range(5)]
+    assert contents(memory.get_recent_context(10)) == [f"action {i}" for i in range(5)]
+
+
+def test_recent_context_follows_the_current_branch():
+    memory = linear_memory(5)
+    branch_point = memory.get_ancestor(memory.current_node_id, 3)
+    asyncio.run(memory.add_action("branch", ActionType.AGENT_PLANNING, parent_id=branch_point))
+    assert contents(memory.get_recent_context(3)) == ["action 0", "action 1", "branch"]
+    memory.set_current_node(branch_point)
+    assert contents(memory.get_recent_context(1)) == ["action 1"]
+
+
+def test_recent_context_of_no_actions_is_empty():
+    memory = linear_memory(5)
+    assert memory.get_recent_context(0) == ""
+    assert memory.get_recent_context(-1) == ""
+
+
+def test_context_renders_like_linear_memory():
+    dag_memory, linear = DAGMemory(), LinearMemory()
+    actions = [
+        ("hello", ActionType.USER_INPUT, None, None),
+        ("plan", ActionType.AGENT_PLANNING, {}, {"notes": "x"}),
+        ("ran", ActionType.AGENT_TOOL_EXECUTION, {"tool_name": "bash_execute", "tool_args": {"command": "ls"}}, None),
+    ]
+
+    async def add():
+        for content, action_type, action_parameters, metadata in actions:
+            node_action = await dag_memory.add_action(content, action_type, action_parameters=action_parameters,
+                                                      metadata=metadata)
+            linear_action = await linear.add_action(content, action_type, action_parameters=action_parameters,
+                                                    metadata=metadata)
+            node_action.timestamp = linear_action.timestamp
+
+    asyncio.run(add())
+    assert dag_memory.get_context() == linear.get_context()
+    assert '"metadata": null' not in dag_memory.get_context()
+    assert '"action_parameters": null' not in dag_memory.get_context()
+
+
+def naive_ancestors(memory, node_id):
+    """node_id and its ancestors, walking parent ids"""
+    path = [node_id]
+    while memory.nodes[path[-1]].parent_id in memory.nodes:
+        path.append(memory.nodes[path[-1]].parent_id)
+    return path
+
+
+def random_tree(rng, size):
+    """Long chains with branches off random nodes, and a few separate roots"""
+    memory = DAGMemory()
+
+    async def add():
+        for i in range(size):
+            parent_id = None
+            if memory.nodes and rng.random() < 0.1:
+                parent_id = rng.choice(list(memory.nodes))
+            elif memory.nodes and rng.random() < 0.01:
+                # a parent that isn't in the DAG starts a new root
+                parent_id = uuid.uuid4()
+            await memory.add_action(f"action {i}", ActionType.AGENT_PLANNING, parent_id=parent_id)
+
+    asyncio.run(add())
+    return memory
+
+
+def test_lowest_common_ancestor_of_a_node_with_itself_and_the_root():
+    memory = linear_memory(40)
+    root_id, node_id = memory.root_node_id, memory.current_node_id
+    assert memory.get_lowest_common_ancestor(node_id, node_id) == node_id
+    assert memory.get_lowest_common_ancestor(root_id, root_id) == root_id
+    assert memory.get_lowest_common_ancestor(node_id, root_id) == root_id
+    assert memory.get_lowest_common_ancestor(root_id, node_id) == root_id
+    assert memory.is_ancestor(root_id, node_id) and not memory.is_ancestor(node_id, root_id)
+    assert memory.get_ancestor(node_id, 0) == node_id
+    assert memory.get_ancestor(node_id, 39) == root_id
+
+
+def test_lowest_common_ancestor_of_separate_roots_is_none():
+    memory = linear_memory(3)
+    asyncio.run(memory.add_action("new root", ActionType.AGENT_PLANNING, parent_id=uuid.uuid4()))
+    assert memory.get_lowest_common_ancestor(memory.current_node_id, memory.root_node_id) is None
+    assert not memory.is_ancestor(memory.root_node_id, memory.current_node_id)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_skip_pointer_queries_match_parent_walks(seed):
+    rng = random.Random(seed)
+    memory = random_tree(rng, 400)
+    node_ids = list(memory.nodes)
+    for _ in range(300):
+        node_id, other_id = rng.choice(node_ids), rng.choice(node_ids)
+        path = naive_ancestors(memory, node_id)
+        other_path = naive_ancestors(memory, other_id)
+
+        assert memory.get_depth(node_id) == len(path) - 1
+        k = rng.randrange(len(path))
+        assert memory.get_ancestor(node_id, k) == path[k]
+        assert memory.get_ancestor_at_depth(node_id, len(path) - 1 - k) == path[k]
+        with pytest.raises(ValueError):
+            memory.get_ancestor(node_id, len(path))
+        assert memory.is_ancestor(other_id, node_id) == (other_id in path)
+        common = [ancestor_id for ancestor_id in path if ancestor_id in set(other_path)]
+        assert memory.get_lowest_common_ancestor(node_id, other_id) == (common[0] if common else None)
+
+
+def fresh_context(memory):
+    """The current context formatted from scratch, bypassing the render caches"""
+    path = reversed(naive_ancestors(memory, memory.current_node_id))
+    return "\n".join(memory.format_action(memory.nodes[node_id].action) for node_id in path)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cached_context_matches_a_fresh_render(seed):
+    rng = random.Random(seed)
+    memory = linear_memory(20)
+
+    async def branch():
+        for i in range(40):
+            await memory.add_action(f"branch {i}", ActionType.AGENT_PLANNING,
+                                    parent_id=rng.choice(list(memory.nodes)) if rng.random() < 0.3 else None)
+
+    asyncio.run(branch())
+    for i in range(200):
+        node_id = rng.choice(list(memory.nodes))
+        op = rng.randrange(3)
+        if op == 0:
+            memory.set_current_node(node_id)
+        elif op == 1:
+            memory.backtrack(node_id, f"notes {i}")
+        else:
+            action = memory.nodes[node_id].action
+            memory.update_node(node_id, replace(action, action_type=rng.choice(list(ActionType)),
+                                                content=f"updated {i}",
+                                                metadata={"i": i} if rng.random() < 0.5 else None))
+        assert memory.get_current_context() == fresh_context(memory)
@@ -0,0 +1,93 @@
+import asyncio
+
+from fast_path import FastPath, RepeatedToolCallRule, TrivialReadonlyResultRule
+from memory import DAGMemory
+from models import ActionType
+
+AFTER_EXECUTION = [ActionType.AGENT_PLANNING, ActionType.AGENT_RESPONSE, ActionType.AGENT_TOOL_EXECUTION]
+AFTER_SEARCH = [ActionType.AGENT_PLANNING, ActionType.AGENT_TOOL_EXECUTION, ActionType.AGENT_RESPONSE]
+
+
+def bash(command):
+    return {"tool_name": "bash_execute", "tool_args": {"command": command, "permission": "readonly"}}
+
+
+def memory_with(*actions):
+    """A step made of (content, action type, action parameters) entries"""
+    memory = DAGMemory()
+
+    async def add():
+        await memory.add_action("summary of an older step", ActionType.STEP_SUMMARY)
+        await memory.add_action("do the thing", ActionType.USER_INPUT)
+        for content, action_type, parameters in actions:
+            await memory.add_action(content, action_type, action_parameters=parameters)
+
+    asyncio.run(add())
+    return memory
+
+
+def executed(command, output):
+    return [("processing", ActionType.PROCESS_USER_INPUT, None), (output, ActionType.AGENT_TOOL_EXECUTION, bash(command))]
+
+
+def test_no_tools_found_goes_back_to_planning():
+    memory = memory_with(("searching", ActionType.PROCESS_USER_INPUT, None),
+                         ("No tools found for query: frobnicate", ActionType.AGENT_TOOL_SEARCH, None))
+    shortcut = FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT, AFTER_SEARCH)
+    assert shortcut[1] == ActionType.AGENT_PLANNING
+
+
+def test_search_with_results_goes_to_the_llm():
+    memory = memory_with(("searching", ActionType.PROCESS_USER_INPUT, None),
+                         ("bash_execute: run commands", ActionType.AGENT_TOOL_SEARCH, None))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_SEARCH_RESULT, AFTER_SEARCH) is None
+
+
+def test_back_to_back_repeat_responds():
+    memory = memory_with(*executed("ls build/", "a.o"), *executed("ls build/", "a.o"))
+    fast_path = FastPath()
+    shortcut = fast_path.match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION)
+    assert shortcut[1] == ActionType.AGENT_RESPONSE
+    assert fast_path.stats()["by_rule"] == {RepeatedToolCallRule.name: 1}
+
+
+def test_repeat_after_another_call_goes_to_the_llm():
+    memory = memory_with(*executed("ls build/", "a.o"), *executed("make", "error: b.c missing"),
+                         *executed("ls build/", "a.o"))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION) is None
+
+
+def test_repeat_with_a_different_result_goes_to_the_llm():
+    memory = memory_with(*executed("ls build/", "a.o"), *executed("ls build/", "a.o b.o"))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION) is None
+
+
+def test_repeat_of_a_previous_step_goes_to_the_llm():
+    memory = memory_with(*executed("ls build/", "a.o"), ("done", ActionType.AGENT_RESPONSE, None),
+                         ("summary", ActionType.STEP_SUMMARY, None), ("again", ActionType.USER_INPUT, None),
+                         *executed("ls build/", "a.o"))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION) is None
+
+
+def test_trivial_readonly_rule_is_opt_in():
+    memory = memory_with(*executed("pwd", "/workspace\n"))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION) is None
+    shortcut = FastPath([TrivialReadonlyResultRule()]).match(
+        memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT, AFTER_EXECUTION)
+    assert shortcut == ("pwd: /workspace", ActionType.AGENT_RESPONSE, None)
+
+
+def test_shortcut_to_an_unavailable_action_is_not_taken():
+    memory = memory_with(*executed("ls build/", "a.o"), *executed("ls build/", "a.o"))
+    assert FastPath().match(memory, ActionType.PROCESS_AGENT_TOOL_EXECUTION_RESULT,
+                            [ActionType.AGENT_PLANNING]) is None
+
+
+def test_stats_are_running_totals():
+    fast_path = FastPath([])
+    memory = memory_with()
+    for _ in range(1000):
+        fast_path.match(memory, ActionType.PROCESS_USER_INPUT, AFTER_EXECUTION)
+        fast_path.end_step()
+    assert fast_path.stats() == {"steps": 1000, "llm_actions": 1000, "llm_actions_saved": 0, "saved_fraction": 0.0,
+                                 "saved_per_step": 0.0, "by_rule": {}}
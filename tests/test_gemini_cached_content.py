@@ -0,0 +1,61 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+import llm
+from llm import GeminiProvider
+
+
+class FlakyCaches:
+    """caches.create that fails the first `failures` times"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    async def create(self, model, config):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+        return types.SimpleNamespace(name=f"cachedContents/{self.calls}")
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    # just enough of the google-genai SDK to construct the provider
+    genai = types.ModuleType("google.genai")
+    genai.types = types.SimpleNamespace(CreateCachedContentConfig=lambda **kwargs: kwargs)
+    genai.Client = lambda api_key: types.SimpleNamespace(aio=types.SimpleNamespace(caches=FlakyCaches(1)))
+    google = types.ModuleType("google")
+    google.genai = genai
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.genai", genai)
+    provider = GeminiProvider(api_key="test-key")
+    provider.logged = []
+    provider.log = provider.logged.append
+    return provider
+
+
+def test_failed_creation_is_retried_after_a_while(provider, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    system_prompt = "x" * (GeminiProvider.MIN_CACHED_CONTENT_TOKENS * 4)
+
+    assert asyncio.run(provider.get_cached_content(system_prompt)) is None
+    assert len(provider.logged) == 1 and "RuntimeError: 429" in provider.logged[0]
+    # no new attempt until the retry time
+    assert asyncio.run(provider.get_cached_content(system_prompt)) is None
+    assert provider.client.aio.caches.calls == 1
+
+    now[0] += GeminiProvider.CACHED_CONTENT_RETRY_AFTER + 1
+    assert asyncio.run(provider.get_cached_content(system_prompt)) == "cachedContents/2"
+    assert asyncio.run(provider.get_cached_content(system_prompt)) == "cachedContents/2"
+    assert provider.client.aio.caches.calls == 2
+
+
+def test_small_prompts_are_never_sent_for_caching(provider):
+    assert asyncio.run(provider.get_cached_content("short prompt")) is None
+    assert asyncio.run(provider.get_cached_content("short prompt")) is None
+    assert provider.client.aio.caches.calls == 0
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import pytest
+
+from agent import CoreAgent, MemoryAgent
+from models import ActionType
+from prompt_registry import PromptRegistry
+
+
+class ScriptedLLM:
+    """Answers each action, recognised from its system prompt, without tools: every step responds directly"""
+
+    model_name = "scripted"
+
+    def __init__(self, prompt_set: str = "coding"):
+        self.action_types_by_prompt = {prompt: action_type
+                                       for (set_name, action_type), prompt in PromptRegistry.default().prompts.items()
+                                       if set_name == prompt_set}
+        self.calls = []
+
+    async def generate(self, context, system_prompt=None):
+        action_type = self.action_types_by_prompt[system_prompt]
+        self.calls.append(action_type)
+        if action_type == ActionType.PROCESS_USER_INPUT:
+            return json.dumps({"response": "answering directly", "next_action": "AGENT_RESPONSE"})
+        if action_type == ActionType.UPDATE_CONVERSATION_STATE:
+            return json.dumps({"response": {"user_goal": "say hello", "last_outcome": "greeted"}})
+        return json.dumps({"response": f"{action_type.value} text"})
+
+
+@pytest.mark.parametrize("prompt_set", PromptRegistry.default().prompt_sets())
+def test_every_action_type_has_a_prompt(prompt_set):
+    registry = PromptRegistry.default()
+    for action_type in PromptRegistry.PROMPT_FILES:
+        assert registry.get(action_type, prompt_set)
+
+
+def test_step_with_memory_agent_writes_every_update():
+    llm = ScriptedLLM()
+    agent = CoreAgent(llm=llm, update_memory=True, verbose=False, on_response_text=lambda text: None)
+
+    async def run():
+        # the compression update runs every CONVERSATION_COMPRESSION_UPDATE_INTERVAL steps
+        for step in range(MemoryAgent.CONVERSATION_COMPRESSION_UPDATE_INTERVAL):
+            await agent.memory.add_action(f"hello {step}", ActionType.USER_INPUT)
+            await agent.run_step(f"hello {step}")
+            await agent.memory_agent.drain()
+        await agent.memory_agent.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        agent.blob_store.close()
+
+    assert agent.memory_agent.errors == []
+    node_id = agent.memory.nodes[agent.memory.current_node_id].parent_id
+    assert agent.memory.get_todo_list(node_id).items == "UPDATE_TODO_LIST text"
+    assert agent.memory.get_conversation_state(node_id).content == {"user_goal": "say hello",
+                                                                    "last_outcome": "greeted"}
+    assert agent.memory.get_conversation_compression(node_id).content == "UPDATE_CONVERSATION_COMPRESSION text"
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import random
+import threading
+from datetime import datetime
+
+import pytest
+
+from memory import DAGMemory
+from memory_store import DAGMemoryStore, node_to_dict
+from models import (ActionType, ConversationCompressionMemory, ConversationStateMemory, TodoItem, TodoMemory,
+                    TodoStatus)
+
+ACTION_TYPES = [ActionType.USER_INPUT, ActionType.AGENT_PLANNING, ActionType.AGENT_TOOL_EXECUTION,
+                ActionType.AGENT_RESPONSE, ActionType.STEP_SUMMARY]
+
+
+def memory_state(memory):
+    """Everything a restore has to bring back, indexes included"""
+    return {
+        "root": memory.root_node_id,
+        "current": memory.current_node_id,
+        "nodes": [node_to_dict(node) for node in memory.nodes.values()],
+        "skip_pointers": [(node.depth, node.jump_id) for node in memory.nodes.values()],
+        "children": [node.children_ids for node in memory.nodes.values()],
+        "steps": memory.step_node_ids,
+        "leaves": list(memory.leaf_node_ids),
+        "branches": list(memory.branch_node_ids),
+        "by_action_type": {action_type: list(ids) for action_type, ids in memory.node_ids_by_action_type.items() if ids},
+        "compressions": memory.compression_node_ids,
+    }
+
+
+def restored(directory):
+    return DAGMemory.restore(DAGMemoryStore(str(directory)))
+
+
+def add_actions(memory, count, start=0):
+    async def add():
+        for i in range(start, start + count):
+            await memory.add_action(f"action {i}", ActionType.AGENT_PLANNING)
+
+    asyncio.run(add())
+
+
+def set_random_field(memory, rng, node_id, i):
+    field = rng.randrange(3)
+    if field == 0:
+        memory.set_todo_list(node_id, TodoMemory(timestamp=datetime.now(), items=[
+            TodoItem(timestamp=datetime.now(), content=f"todo {i}", status=TodoStatus.PENDING)]))
+    elif field == 1:
+        memory.set_conversation_state(node_id, ConversationStateMemory(timestamp=datetime.now(), content={"i": i}))
+    else:
+        memory.set_conversation_compression(node_id, ConversationCompressionMemory(
+            timestamp=datetime.now(), content=f"compressed {i}"))
+
+
+def mutate(memory, rng, count):
+    """Apply `count` random mutations through DAGMemory's public methods"""
+
+    async def run():
+        for i in range(count):
+            node_ids = list(memory.nodes)
+            with_memory = [node_id for node_id in node_ids if memory.nodes[node_id].action_node_memory]
+            op = rng.random()
+            if not node_ids or op < 0.4:
+                parent_id = rng.choice(node_ids) if node_ids and rng.random() < 0.3 else None
+                action_type = rng.choice(ACTION_TYPES)
+                parameters = {"tool_name": "bash_execute", "tool_args": {"command": f"ls {i}"}} \
+                    if action_type == ActionType.AGENT_TOOL_EXECUTION else None
+                await memory.add_action(f"action {i}", action_type, action_parameters=parameters,
+                                        metadata={"i": i} if rng.random() < 0.2 else None, parent_id=parent_id)
+            elif op < 0.5:
+                memory.set_current_node(rng.choice(node_ids))
+            elif op < 0.55:
+                memory.backtrack(rng.choice(node_ids), f"notes {i}")
+            elif op < 0.9 and with_memory:
+                set_random_field(memory, rng, rng.choice(with_memory), i)
+            elif op < 0.98 and with_memory:
+                memory.compact_node_memory(rng.choice(with_memory), rng.randrange(4))
+            elif op >= 0.98:
+                memory.clear()
+
+    asyncio.run(run())
+
+
+def test_restore_without_snapshot_replays_the_log(tmp_path):
+    memory = DAGMemory(store=DAGMemoryStore(str(tmp_path), snapshot_interval=10 ** 6))
+    add_actions(memory, 5)
+    memory.set_current_node(memory.root_node_id)
+    memory.store.close()
+
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("snapshot-")]
+    assert memory_state(restored(tmp_path)) == memory_state(memory)
+
+
+@pytest.mark.parametrize("tail", [0, 1, 3])
+def test_restore_replays_the_log_after_a_snapshot(tmp_path, tail):
+    # 4 records reach the interval: the snapshot holds them, the tail goes to the next segment
+    memory = DAGMemory(store=DAGMemoryStore(str(tmp_path), snapshot_interval=4))
+    add_actions(memory, 4 + tail)
+    memory.store.close()
+
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("snapshot-")) == ["snapshot-00000001.json"]
+    assert memory_state(restored(tmp_path)) == memory_state(memory)
+
+
+def test_snapshot_is_written_in_the_background_from_the_sealed_log(tmp_path, monkeypatch):
+    release = threading.Event()
+    replay_for_snapshot = DAGMemory.replay_for_snapshot
+
+    def blocked_replay(store, before):
+        release.wait(5)
+        return replay_for_snapshot(store, before)
+
+    monkeypatch.setattr(DAGMemory, "replay_for_snapshot", staticmethod(blocked_replay))
+    memory = DAGMemory(store=DAGMemoryStore(str(tmp_path), snapshot_interval=4))
+    # the 4th record starts the snapshot, the mutations after it don't wait for it
+    add_actions(memory, 10)
+    assert memory.store.snapshot_running()
+    release.set()
+    memory.store.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["segment-00000001.jsonl", "snapshot-00000001.json"]
+    snapshot = memory.store.read_snapshot()
+    assert [node["action"]["content"] for node in snapshot["nodes"]] == [f"action {i}" for i in range(4)]
+    assert memory_state(restored(tmp_path)) == memory_state(memory)
+
+
+def test_restore_ignores_a_torn_last_record(tmp_path):
+    memory = DAGMemory(store=DAGMemoryStore(str(tmp_path)))
+    add_actions(memory, 3)
+    expected = memory_state(memory)
+    memory.set_current_node(memory.root_node_id)
+    memory.store.close()
+    segment = tmp_path / "segment-00000000.jsonl"
+    segment.write_bytes(segment.read_bytes()[:-5])
+
+    memory = restored(tmp_path)
+    assert memory_state(memory) == expected
+    # the torn record is cut off, so the next one starts on a clean line
+    add_actions(memory, 1, start=3)
+    memory.store.close()
+    assert memory_state(restored(tmp_path)) == memory_state(memory)
+
+
+@pytest.mark.parametrize("keep", [0, 2])
+def test_restore_replays_compactions(tmp_path, keep):
+    memory = DAGMemory(store=DAGMemoryStore(str(tmp_path), snapshot_interval=10 ** 6))
+    add_actions(memory, 2)
+    rng = random.Random(keep)
+    for i in range(6):
+        set_random_field(memory, rng, memory.root_node_id, i)
+    memory.compact_node_memory(memory.root_node_id, keep)
+    memory.store.close()
+
+    memory_restored = restored(tmp_path)
+    assert memory_restored.get_node_memory_history_for_node(memory.root_node_id).length == keep + 1
+    assert memory_state(memory_restored) == memory_state(memory)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_restore_matches_memory(tmp_path, seed):
+    rng = random.Random(seed)
+    store = DAGMemoryStore(str(tmp_path), snapshot_interval=rng.randrange(3, 40))
+    memory = DAGMemory(store=store, node_memory_history_limit=rng.choice([None, 2, 4]))
+    mutate(memory, rng, 200)
+    store.close()
+
+    memory_restored = restored(tmp_path)
+    assert memory_state(memory_restored) == memory_state(memory)
+    assert memory_restored.get_current_context() == memory.get_current_context()
+
+    # the restored memory keeps logging to the store, a second restore picks up where it left off
+    mutate(memory_restored, rng, 100)
+    memory_restored.store.close()
+    assert memory_state(restored(tmp_path)) == memory_state(memory_restored)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from agent import CoreAgent
+from llm import PROVIDERS, ModelRouter, ProviderPool, register_provider
+from models import ActionType
+from response_cache import CachedProvider, ResponseCache
+
+
+class EchoProvider:
+    created = []
+
+    def __init__(self, model_name: str = "echo-default"):
+        self.model_name = model_name
+        EchoProvider.created.append(model_name)
+
+    async def generate(self, context, system_prompt=None):
+        return f"{self.model_name}: {context}"
+
+
+@pytest.fixture(autouse=True)
+def echo_provider():
+    EchoProvider.created = []
+    register_provider("echo", EchoProvider)
+    yield
+    PROVIDERS.pop("echo")
+
+
+ROUTES = {ActionType.AGENT_PLANNING: ["echo:big", "echo:small"], ActionType.STEP_SUMMARY: ["echo:small"]}
+
+
+def test_sessions_sharing_a_pool_share_routed_providers():
+    pool = ProviderPool()
+    agents = [CoreAgent(llm=EchoProvider(), model_routes=ROUTES, provider_pool=pool, verbose=False)
+              for _ in range(3)]
+    for agent in agents:
+        agent.blob_store.close()
+
+    assert EchoProvider.created.count("big") == 1
+    assert EchoProvider.created.count("small") == 1
+    first, second, _ = agents
+    assert first.router.providers[("echo", "small")] is second.router.providers[("echo", "small")]
+    assert first.llm_for(ActionType.AGENT_PLANNING).providers[0] is pool.get("echo", "big")
+
+
+def test_routers_without_a_pool_share_the_module_pool():
+    first = ModelRouter(EchoProvider(), ROUTES)
+    second = ModelRouter(EchoProvider(), ROUTES)
+    assert first.providers[("echo", "big")] is second.providers[("echo", "big")]
+
+
+def test_replay_pool_answers_routed_actions_from_the_cache_without_providers(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    record_pool = ProviderPool(lambda name, model_name: CachedProvider(
+        PROVIDERS[name](model_name=model_name), cache, mode="record"))
+    recorded = asyncio.run(ModelRouter(EchoProvider(), ROUTES, pool=record_pool)
+                           .provider_for(ActionType.AGENT_PLANNING).generate("plan", "prompt"))
+    EchoProvider.created = []
+
+    replay_pool = ProviderPool(lambda name, model_name: CachedProvider(
+        None, cache, mode="replay", model_name=model_name))
+    default = CachedProvider(None, cache, mode="replay", model_name="echo-default")
+    router = ModelRouter(default, ROUTES, pool=replay_pool)
+    assert asyncio.run(router.provider_for(ActionType.AGENT_PLANNING).generate("plan", "prompt")) == recorded
+    assert EchoProvider.created == []
+    cache.close()
+
+
+class FailingProvider:
+    model_name = "failing"
+
+    async def generate(self, context, system_prompt=None):
+        raise RuntimeError("503")
+
+
+def test_failover_notices_go_to_the_agent_log(capsys):
+    routes = {ActionType.AGENT_PLANNING: [FailingProvider()]}
+    quiet = CoreAgent(llm=EchoProvider(), model_routes=routes, verbose=False)
+    quiet.blob_store.close()
+    assert asyncio.run(quiet.llm_for(ActionType.AGENT_PLANNING).generate("plan")) == "echo-default: plan"
+    assert capsys.readouterr().out == ""
+
+    logged = []
+    router = ModelRouter(EchoProvider(), routes, log=logged.append)
+    asyncio.run(router.provider_for(ActionType.AGENT_PLANNING).generate("plan"))
+    assert logged == ["LLM call to failing failed (RuntimeError: 503), falling back to echo-default"]
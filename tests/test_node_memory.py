@@ -0,0 +1,123 @@
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from memory import DAGMemory
+from models import (ActionType, BranchBacktrackSummaryMemory, ConversationCompressionMemory, ConversationStateMemory,
+                    NODE_MEMORY_FIELDS, NodeMemoryEntry, NodeMemoryType, TodoMemory)
+
+UPDATED_FIELDS = {
+    "todo": NodeMemoryType.TODO,
+    "conversation_state": NodeMemoryType.CONVERSATION_STATE,
+    "conversation_compression": NodeMemoryType.CONVERSATION_COMPRESSION,
+    "branch_backtrack_summary": NodeMemoryType.BRANCH_BACKTRACK_SUMMARY,
+}
+
+
+def random_entry(rng, i):
+    timestamp = datetime(2025, 1, 1) + timedelta(seconds=i)
+    name = rng.choice(NODE_MEMORY_FIELDS)
+    value = {
+        "todo": lambda: TodoMemory(timestamp=timestamp, items=[f"todo {i}"]),
+        "conversation_state": lambda: ConversationStateMemory(timestamp=timestamp, content={"i": i}),
+        "conversation_compression": lambda: ConversationCompressionMemory(timestamp=timestamp, content=f"compressed {i}"),
+        "branch_backtrack_summary": lambda: BranchBacktrackSummaryMemory(
+            timestamp=timestamp, backtrack_branch_point_node_id=uuid.uuid4(), backtrack_from_node_id=uuid.uuid4(),
+            content=f"summary {i}"),
+    }[name]()
+    return NodeMemoryEntry(updated_field=UPDATED_FIELDS[name], timestamp=timestamp, **{name: value})
+
+
+def naive_append(history, entry):
+    """The full copy history the delta chain replaces: every entry carries every field's latest value"""
+    state = {name: getattr(history[-1], name) for name in NODE_MEMORY_FIELDS} if history else {}
+    state.update({name: getattr(entry, name) for name in NODE_MEMORY_FIELDS if getattr(entry, name) is not None})
+    history.append(NodeMemoryEntry(updated_field=entry.updated_field, timestamp=entry.timestamp, **state))
+
+
+def resolved_history(node_memory):
+    """Each entry of a delta chain with the fields it inherits filled in, oldest first"""
+    resolved, state = [], {}
+    for entry in node_memory.history():
+        state.update({name: getattr(entry, name) for name in NODE_MEMORY_FIELDS if getattr(entry, name) is not None})
+        resolved.append(NodeMemoryEntry(updated_field=entry.updated_field, timestamp=entry.timestamp, **state))
+    return resolved
+
+
+def node_with_entries(count, limit=None):
+    memory = DAGMemory(node_memory_history_limit=limit)
+    asyncio.run(memory.add_action("action", ActionType.AGENT_PLANNING))
+    node_id = memory.current_node_id
+    rng, naive = random.Random(count), []
+    for i in range(count):
+        entry = random_entry(rng, i)
+        memory.append_node_memory_entry(node_id, entry)
+        naive_append(naive, entry)
+    return memory, node_id, naive
+
+
+def test_compaction_to_zero_keeps_one_base_entry_with_the_latest_state():
+    memory, node_id, naive = node_with_entries(12)
+    memory.compact_node_memory(node_id, 0)
+    node_memory = memory.get_node_memory_history_for_node(node_id)
+    assert node_memory.length == 1
+    assert resolved_history(node_memory) == naive[-1:]
+    assert memory.get_current_node_memory(node_id) == naive[-1]
+
+
+@pytest.mark.parametrize("keep", [3, 4, 10])
+def test_compaction_of_a_short_history_changes_nothing(keep):
+    memory, node_id, naive = node_with_entries(4)
+    before = memory.get_node_memory_history_for_node(node_id).history()
+    memory.compact_node_memory(node_id, keep)
+    assert memory.get_node_memory_history_for_node(node_id).history() == before
+    assert resolved_history(memory.get_node_memory_history_for_node(node_id)) == naive
+
+
+def test_history_limit_compacts_past_twice_the_limit():
+    memory, node_id, naive = node_with_entries(7, limit=3)
+    node_memory = memory.get_node_memory_history_for_node(node_id)
+    # the 7th entry went past 6 and compacted back to 3 entries plus the base
+    assert node_memory.length == 4
+    assert resolved_history(node_memory) == naive[-4:]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_delta_chain_matches_full_copies(seed):
+    rng = random.Random(seed)
+    limit = rng.choice([None, 1, 3, 8])
+    memory = DAGMemory(node_memory_history_limit=limit)
+
+    async def add():
+        for i in range(5):
+            await memory.add_action(f"action {i}", ActionType.AGENT_PLANNING)
+
+    asyncio.run(add())
+    node_ids = list(memory.nodes)
+    naive = {node_id: [] for node_id in node_ids}
+
+    for i in range(300):
+        node_id = rng.choice(node_ids)
+        if rng.random() < 0.85:
+            entry = random_entry(rng, i)
+            memory.append_node_memory_entry(node_id, entry)
+            naive_append(naive[node_id], entry)
+        else:
+            memory.compact_node_memory(node_id, rng.randrange(5))
+
+        node_memory = memory.get_node_memory_history_for_node(node_id)
+        history = resolved_history(node_memory)
+        assert node_memory.length == len(history)
+        if limit is not None:
+            assert node_memory.length <= 2 * limit
+        # compaction only drops old entries, what is kept resolves to the same states as the full copies
+        assert history == naive[node_id][len(naive[node_id]) - len(history):]
+        assert memory.get_current_node_memory(node_id) == (naive[node_id][-1] if naive[node_id] else None)
+        latest = naive[node_id][-1] if naive[node_id] else None
+        assert memory.get_todo_list(node_id) == (latest and latest.todo)
+        assert memory.get_conversation_state(node_id) == (latest and latest.conversation_state)
+        assert memory.get_conversation_compression(node_id) == (latest and latest.conversation_compression)
+        assert memory.get_branch_backtrack_summary(node_id) == (latest and latest.branch_backtrack_summary)
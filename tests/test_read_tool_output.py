@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from agent import CoreAgent
+
+
+@pytest.fixture
+def agent():
+    agent = CoreAgent(llm=object(), verbose=False, spill_tool_output_chars=100)
+    yield agent
+    agent.blob_store.close()
+
+
+def spilled_blob(agent, output):
+    preview = agent.spill_tool_output(output)
+    return preview.split("is blob ")[1].split(",")[0]
+
+
+def test_reads_a_slice_of_a_spilled_output(agent):
+    blob = spilled_blob(agent, "".join(f"{i:04d}" for i in range(1000)))
+    call = {"tool_name": CoreAgent.READ_TOOL_OUTPUT, "tool_args": {"blob": blob, "offset": 8, "length": 8}}
+    assert asyncio.run(agent.execute_tool_call(call)) == "[bytes 8-16 of 4000]\n00020003"
+
+
+@pytest.mark.parametrize("tool_args", [
+    {"offset": "8", "length": "8"},
+    {"offset": 8.0, "length": 8.0},
+])
+def test_numeric_strings_and_floats_are_accepted(agent, tool_args):
+    blob = spilled_blob(agent, "".join(f"{i:04d}" for i in range(1000)))
+    call = {"tool_name": CoreAgent.READ_TOOL_OUTPUT, "tool_args": {"blob": blob, **tool_args}}
+    assert asyncio.run(agent.execute_tool_call(call)) == "[bytes 8-16 of 4000]\n00020003"
+
+
+@pytest.mark.parametrize("tool_args", [
+    {"length": "five"},
+    {"offset": "start"},
+    {"length": [5]},
+    {"offset": -1},
+    {"blob": "not-a-blob"},
+    {"blob": 42},
+])
+def test_bad_arguments_are_a_failed_tool_call(agent, tool_args):
+    blob = spilled_blob(agent, "x" * 1000)
+    call = {"tool_name": CoreAgent.READ_TOOL_OUTPUT, "tool_args": {"blob": blob, **tool_args}}
+    assert asyncio.run(agent.execute_tool_call(call)).startswith("Tool execution failed: ")
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+from agent import CoreAgent
+from models import ActionType
+from response_cache import CachedProvider, ResponseCache, sampling
+
+AVAILABLE = [ActionType.AGENT_PLANNING, ActionType.AGENT_RESPONSE]
+VALID = json.dumps({"response": "ok", "next_action": "AGENT_RESPONSE"})
+INVALID = json.dumps({"response": "ok", "next_action": "AWAIT_USER_INPUT"})
+
+
+class SequenceLLM:
+    """Returns the given replies in order, then repeats the last one"""
+
+    model_name = "sequence"
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = 0
+
+    async def generate(self, context, system_prompt=None):
+        reply = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        await asyncio.sleep(0)
+        return reply
+
+
+def next_action(llm, speculative_samples=1):
+    agent = CoreAgent(llm=llm, speculative_samples=speculative_samples, verbose=False)
+    try:
+        return asyncio.run(agent.generate_next_action("context", "prompt", ActionType.PROCESS_USER_INPUT,
+                                                      AVAILABLE))
+    finally:
+        agent.blob_store.close()
+
+
+@pytest.mark.parametrize("speculative_samples", [1, 3])
+def test_only_the_accepted_sample_is_recorded_and_replayed(tmp_path, speculative_samples):
+    cache = ResponseCache(str(tmp_path))
+    llm = SequenceLLM([INVALID, "not json", VALID])
+    recorded = next_action(CachedProvider(llm, cache), speculative_samples)
+    assert recorded == ("ok", ActionType.AGENT_RESPONSE, None)
+    assert llm.calls == 3
+    assert cache.stats()["entries"] == 1
+
+    # the discarded samples miss in replay too, the accepted one is found under its own sample index
+    replay = CachedProvider(None, cache, mode="replay", model_name="sequence")
+    assert next_action(replay, speculative_samples) == recorded
+    cache.close()
+
+
+def test_retries_do_not_get_the_response_of_an_earlier_sample(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    # a recording made outside sampling stored a malformed response for the request
+    asyncio.run(CachedProvider(SequenceLLM([INVALID]), cache).generate("context", "prompt"))
+
+    llm = SequenceLLM([VALID])
+    assert next_action(CachedProvider(llm, cache)) == ("ok", ActionType.AGENT_RESPONSE, None)
+    assert llm.calls == 1
+    assert cache.stats()["entries"] == 2
+    cache.close()
+
+
+def test_uncommitted_samples_are_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    provider = CachedProvider(SequenceLLM(["first", "second"]), cache)
+
+    async def run():
+        with sampling(0):
+            await provider.generate("context", "prompt")
+        with sampling(1) as sample:
+            await provider.generate("context", "prompt")
+        sample.commit()
+
+    asyncio.run(run())
+    assert cache.get(cache.key("sequence", "prompt", "context")) is None
+    assert cache.get(cache.key("sequence", "prompt", "context", 1)) == "second"
+    cache.close()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from server import AgentServer, Connection
+
+
+class FakeWriter:
+    def __init__(self):
+        self.messages = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.messages.append(json.loads(data))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeLLM:
+    async def generate(self, *args, **kwargs):
+        raise AssertionError("no LLM calls expected")
+
+
+def run_server(memory_root, scenario):
+    async def run():
+        server = AgentServer(llm=FakeLLM(), memory_root=str(memory_root))
+        try:
+            await scenario(server)
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+
+async def send(server, writer, **message):
+    await server.handle_message(message, writer.connection)
+    return writer.messages[-1]
+
+
+def client():
+    writer = FakeWriter()
+    writer.connection = Connection(writer)
+    return writer
+
+
+def test_sessions_belong_to_the_connection_that_opened_them(tmp_path):
+    async def scenario(server):
+        owner, other = client(), client()
+        session_id = (await send(server, owner, type="open"))["session_id"]
+        assert str(uuid.UUID(session_id)) == session_id
+
+        assert (await send(server, owner, type="open", session_id=session_id))["session_id"] == session_id
+        assert (await send(server, other, type="open", session_id=session_id))["type"] == "error"
+        assert (await send(server, other, type="input", session_id=session_id, text="hi"))["error"] == \
+            f"Unknown session: {session_id}"
+        assert (await send(server, other, type="close", session_id=session_id))["type"] == "error"
+        assert session_id in server.sessions
+
+        assert (await send(server, owner, type="close", session_id=session_id))["type"] == "closed"
+        # once closed, a logged session can be reopened by id from any connection
+        assert (await send(server, other, type="open", session_id=session_id))["session_id"] == session_id
+
+    run_server(tmp_path, scenario)
+
+
+@pytest.mark.parametrize("session_id", ["../../escaped", "{tmp_path}/escaped", "..", "", "not-a-uuid", 5, ["x"]])
+def test_open_rejects_session_ids_that_are_not_uuids(tmp_path, session_id):
+    if isinstance(session_id, str):
+        session_id = session_id.format(tmp_path=tmp_path)
+
+    async def scenario(server):
+        reply = await send(server, client(), type="open", session_id=session_id)
+        assert reply["type"] == "error" and reply["error"].startswith("Invalid session id")
+        assert server.sessions == {}
+
+    run_server(tmp_path / "a" / "sessions", scenario)
+    assert [path for path in tmp_path.rglob("*") if path.is_file()] == []
+
+
+def test_disconnect_closes_the_connection_sessions(tmp_path):
+    async def scenario(server):
+        other = client()
+        kept = (await send(server, other, type="open"))["session_id"]
+
+        reader, writer = asyncio.StreamReader(), FakeWriter()
+        reader.feed_data(b'{"type": "open"}\n')
+        reader.feed_eof()
+        await server.handle_connection(reader, writer)
+        assert writer.messages[0]["type"] == "opened"
+        assert list(server.sessions) == [kept]
+
+    run_server(tmp_path, scenario)
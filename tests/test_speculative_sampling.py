@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from agent import CoreAgent
+from models import ActionType
+
+AVAILABLE = [ActionType.AGENT_PLANNING, ActionType.AGENT_RESPONSE]
+VALID = json.dumps({"response": "ok", "next_action": "AGENT_RESPONSE"})
+INVALID = json.dumps({"response": "ok", "next_action": "AWAIT_USER_INPUT"})
+
+
+class SequenceLLM:
+    """Returns (or raises) the given replies in order, then repeats the last one"""
+
+    model_name = "sequence"
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = 0
+
+    async def generate(self, context, system_prompt=None):
+        reply = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        await asyncio.sleep(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def next_action(llm, speculative_samples):
+    agent = CoreAgent(llm=llm, speculative_samples=speculative_samples, verbose=False)
+    try:
+        return asyncio.run(agent.generate_next_action("context", "prompt", ActionType.PROCESS_USER_INPUT,
+                                                      AVAILABLE))
+    finally:
+        agent.blob_store.close()
+
+
+@pytest.mark.parametrize("speculative_samples", [1, 2, 3, 5])
+def test_invalid_responses_stop_at_the_retry_budget(speculative_samples):
+    llm = SequenceLLM([INVALID])
+    with pytest.raises(ValueError):
+        next_action(llm, speculative_samples)
+    assert llm.calls == CoreAgent.ACTION_MAX_RETRIES + 1
+
+
+def test_provider_error_is_a_failed_sample_in_a_batch():
+    llm = SequenceLLM([RuntimeError("503"), VALID, INVALID])
+    assert next_action(llm, 3) == ("ok", ActionType.AGENT_RESPONSE, None)
+
+
+def test_batches_that_only_raise_report_the_provider_error():
+    llm = SequenceLLM([RuntimeError("503")])
+    with pytest.raises(ValueError) as error:
+        next_action(llm, 2)
+    assert isinstance(error.value.__cause__, RuntimeError)
+    assert llm.calls == CoreAgent.ACTION_MAX_RETRIES + 1
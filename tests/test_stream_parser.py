@@ -0,0 +1,99 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from agent import CoreAgent
+from models import ActionType
+from stream_parser import IncrementalResponseParser
+
+RESPONSE = {
+    "response": 'ok \U0001F600 "quoted" back\\slash\nnew line é中 \U0001F680\tdone',
+    "next_action": "AGENT_TOOL_EXECUTION",
+    "next_action_parameters": {"tool_name": "bash_execute", "tool_args": {"command": "ls {a,b}", "n": [1, 2]}},
+    "confidence": 0.5,
+}
+
+
+def random_chunks(text, rng):
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+def stream(chunks):
+    parser = IncrementalResponseParser()
+    deltas = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        deltas.append(parser.take_string_delta("response"))
+    return parser, deltas
+
+
+def test_escaped_surrogate_pair_split_across_chunks():
+    parser, deltas = stream(['{"response": "ok \\ud83d', '\\ude00 done"}'])
+    assert deltas == ["ok ", "\U0001F600 done"]
+    assert parser.fields["response"] == "ok \U0001F600 done"
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("seed", range(50))
+def test_random_chunking_matches_a_full_parse(ensure_ascii, seed):
+    text = "```json\n" + json.dumps(RESPONSE, ensure_ascii=ensure_ascii) + "\n```"
+    parser, deltas = stream(random_chunks(text, random.Random(seed)))
+
+    assert parser.done
+    assert parser.fields == RESPONSE
+    assert "".join(deltas) == RESPONSE["response"]
+    for delta in deltas:
+        # a delta holding half a surrogate pair can't be printed or encoded
+        delta.encode("utf-8")
+
+
+def test_fields_are_available_before_the_object_closes():
+    parser = IncrementalResponseParser()
+    parser.feed('{"response": "hi", "next_action": "AGENT_RESPONSE", "next_action_parameters": {"a": 1}')
+    assert not parser.done
+    assert parser.fields == {"response": "hi", "next_action": "AGENT_RESPONSE", "next_action_parameters": {"a": 1}}
+
+
+def test_partial_string_decodes_each_streamed_character_once(monkeypatch):
+    value = 'line \\"é\\u00e9\\ud83d\\ude00\\n' * 200
+    text = '{"response": "' + value + '"}'
+    decoded = []
+    loads = json.loads
+    monkeypatch.setattr("stream_parser.json.loads", lambda raw, **kwargs: decoded.append(len(raw)) or loads(raw))
+
+    parser = IncrementalResponseParser()
+    for i, ch in enumerate(text[:-2]):
+        parser.feed(ch)
+        partial = parser.partial_string("response")
+        if partial is not None:
+            assert loads('"' + value + '"').startswith(partial)
+    assert parser.partial_string("response") == loads('"' + value + '"')
+    # the key plus every raw character of the value once, with the quotes added around each decoded tail
+    assert sum(decoded) < len(text) + 3 * len(text[:-2])
+
+
+class StreamingLLM:
+    model_name = "streaming"
+
+    async def generate_stream(self, context, system_prompt=None):
+        for chunk in ['{"response": "hel', 'lo", "next_action": "AWAIT_USER_INPUT"}']:
+            yield chunk
+
+
+@pytest.mark.parametrize("verbose", [True, False])
+def test_streamed_response_text_is_printed_only_when_verbose(capsys, verbose):
+    agent = CoreAgent(llm=StreamingLLM(), stream_responses=True, verbose=verbose)
+    try:
+        asyncio.run(agent.generate_response("context", "prompt", ActionType.AGENT_RESPONSE,
+                                            [ActionType.AWAIT_USER_INPUT]))
+    finally:
+        agent.blob_store.close()
+    assert capsys.readouterr().out == ("hello\n" if verbose else "")
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import random
+
+import pytest
+
+from gateway_tools import MCPGatewayTools, ToolResultCache
+
+WORKING_DIRS = [None, "/w", "/w/", "/w/a", "/w/./a", "/w/a/b", "/w/ab", "/w/c", "/x"]
+READS = ["cat notes.txt", "ls", "git status", "date"]
+
+
+def parts(working_dir):
+    return os.path.normpath(working_dir).split(os.sep)
+
+
+def affects(written_dir, read_dir):
+    """Whether a write in written_dir can change a read in read_dir: same directory, inside or above it"""
+    if written_dir is None or read_dir is None:
+        return True
+    written, read = parts(written_dir), parts(read_dir)
+    return written[:len(read)] == read or read[:len(written)] == written
+
+
+class FakeGateway:
+    """A gateway whose read results change whenever a write could have affected them"""
+
+    is_closed = False
+
+    def __init__(self):
+        self.writes = []
+        self.clock = 0
+
+    class Response:
+        def __init__(self, result):
+            self.result = result
+
+        def json(self):
+            return {"result": self.result}
+
+    async def post(self, url, json, headers, timeout):
+        args = json["args"]
+        working_dir = args.get("working_dir")
+        if args.get("permission", "readonly") != "readonly":
+            self.writes.append(working_dir)
+            return self.Response("ok")
+        if args["command"] == "date":
+            self.clock += 1
+            return self.Response(f"tick {self.clock}")
+        seen = [i for i, written_dir in enumerate(self.writes) if affects(written_dir, working_dir)]
+        where = os.path.normpath(working_dir) if working_dir else None
+        return self.Response(f"{args['command']} in {where} after writes {seen}")
+
+
+def random_calls(rng, count):
+    calls = []
+    for _ in range(count):
+        args = {}
+        working_dir = rng.choice(WORKING_DIRS)
+        if working_dir is not None:
+            args["working_dir"] = working_dir
+        if rng.random() < 0.2:
+            args.update(command="touch notes.txt", permission=rng.choice(["write", "full"]))
+        else:
+            args["command"] = rng.choice(READS)
+        calls.append(args)
+    return calls
+
+
+def cached_dirs(cache):
+    return sorted(str(key[2]) for key in cache.entries)
+
+
+@pytest.mark.parametrize("written_dir, kept", [
+    ("/w/a/", ["/w/ab", "/w/c", "/x"]),
+    ("/w/./a/b", ["/w/ab", "/w/c", "/x"]),
+    ("/w", ["/x"]),
+    ("/y", ["/w", "/w/a", "/w/a/b", "/w/ab", "/w/c", "/x"]),
+    (None, []),
+])
+def test_invalidation_drops_overlapping_working_dirs(written_dir, kept):
+    cache = ToolResultCache()
+    for working_dir in [None, "/w", "/w/a", "/w/a/b", "/w/ab", "/w/c", "/x"]:
+        args = {"command": "ls"} if working_dir is None else {"command": "ls", "working_dir": working_dir}
+        cache.put("bash_execute", args, f"ls {working_dir}", cache.generation)
+    cache.invalidate({"command": "touch x"} if written_dir is None else {"command": "touch x", "working_dir": written_dir})
+    assert cached_dirs(cache) == kept
+
+
+def test_result_read_before_an_invalidation_is_not_stored():
+    cache = ToolResultCache()
+    generation = cache.generation
+    cache.invalidate({"command": "touch x", "working_dir": "/x"})
+    cache.put("bash_execute", {"command": "ls", "working_dir": "/w"}, "stale", generation)
+    assert cache.get("bash_execute", {"command": "ls", "working_dir": "/w"}) is None
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_cached_results_match_uncached_calls(seed):
+    rng = random.Random(seed)
+    calls = random_calls(rng, 300)
+    cache = ToolResultCache(max_entries=rng.choice([4, 1024]), ttl=3600)
+
+    async def run(result_cache):
+        tools = MCPGatewayTools(client=FakeGateway(), search_cache=None, result_cache=result_cache)
+        tools.session_id = "session"
+        return [await tools.execute_tool("bash_execute", **args) for args in calls]
+
+    assert asyncio.run(run(cache)) == asyncio.run(run(None))
+    assert cache.hits > 0
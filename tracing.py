@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+class Span:
+    """One timed phase, timestamps are time.perf_counter_ns() (monotonic) and ids are formatted on export"""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "thread_id", "attributes",
+                 "_tracer", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(tracer.ids)
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        parent = CURRENT_SPAN.get()
+        self.parent_id = parent.span_id if parent else None
+        # every root span (a step, a background memory update) starts its own trace
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.thread_id = self._tracer.thread_id()
+        self._token = CURRENT_SPAN.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        CURRENT_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self._tracer.spans.append(self)
+        return False
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end_ns - self.start_ns
+
+
+CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Records nested timing spans of the agent loop
+    Parents are tracked per asyncio task through a context variable, so concurrent tool calls nest
+    under the action that started them. The newest `max_spans` finished spans are kept and can be
+    written as OpenTelemetry (OTLP/JSON) or Chrome trace (chrome://tracing, Perfetto) files.
+    """
+
+    enabled = True
+
+    def __init__(self, service_name: str = "dude", max_spans: int = 100_000):
+        self.service_name = service_name
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        # maps perf_counter_ns onto wall clock time for the exported timestamps
+        self.epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+        self.thread_ids: Dict[int, int] = {}
+        # ids count up from a random start instead of drawing 8 random bytes per span
+        self.ids = itertools.count(int.from_bytes(os.urandom(6), "big") << 16)
+        self.trace_id_prefix = os.urandom(8).hex()
+
+    def span(self, name: str, **attributes) -> Span:
+        return Span(self, name, attributes)
+
+    def thread_id(self) -> int:
+        """A small id per asyncio task, Chrome traces only nest spans of the same thread"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0
+        return self.thread_ids.setdefault(id(task), len(self.thread_ids) + 1)
+
+    def clear(self):
+        self.spans.clear()
+        self.thread_ids.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and mean milliseconds per span name"""
+        totals: Dict[str, List[int]] = {}
+        for span in self.spans:
+            totals.setdefault(span.name, []).append(span.duration_ns)
+        return {name: {"count": len(durations), "total_ms": sum(durations) / 1e6,
+                       "mean_ms": sum(durations) / len(durations) / 1e6}
+                for name, durations in totals.items()}
+
+    @staticmethod
+    def otel_value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def to_otel(self) -> Dict[str, Any]:
+        spans = [{
+            "traceId": f"{self.trace_id_prefix}{span.trace_id:016x}",
+            "spanId": f"{span.span_id:016x}",
+            **({"parentSpanId": f"{span.parent_id:016x}"} if span.parent_id is not None else {}),
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns + self.epoch_offset_ns),
+            "endTimeUnixNano": str(span.end_ns + self.epoch_offset_ns),
+            "attributes": [{"key": key, "value": self.otel_value(value)} for key, value in span.attributes.items()],
+            **({"status": {"code": 2, "message": span.attributes["error"]}} if "error" in span.attributes else {}),
+        } for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "dude.tracing"}, "spans": spans}],
+        }]}
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        events = [{
+            "name": span.name,
+            "ph": "X",
+            "ts": (span.start_ns + self.epoch_offset_ns) / 1000,
+            "dur": span.duration_ns / 1000,
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": {key: value if isinstance(value, (bool, int, float)) else str(value)
+                     for key, value in span.attributes.items()},
+        } for span in self.spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_otel_json(self, path: str) -> str:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otel(), f)
+        return path
+
+    def write_chrome_trace(self, path: str) -> str:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+    def write(self, path: str) -> str:
+        """Write OTLP JSON for *.otlp.json paths, a Chrome trace otherwise"""
+        if path.endswith(".otlp.json"):
+            return self.write_otel_json(path)
+        return self.write_chrome_trace(path)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTracer:
+    """Tracer used when tracing is off, every span is one shared no-op object"""
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name: str, **attributes) -> _NullSpan:
+        return self._span
+
+
+NULL_TRACER = NullTracer()